@@ -1,3 +1,4 @@
+import httmock
 import vcr
 import pytest
 import json
@@ -167,6 +168,163 @@ class TestDataONERegister(base.TestCase):
             metadata = set()
             check_multiple_maps(metadata)
 
+    def test_iter_query(self):
+        # Test that results are paged with a sorted cursor from the first request
+        from urllib.parse import parse_qs
+        from server.lib.dataone.register import iter_query
+
+        ids = ['urn:uuid:{}'.format(i) for i in range(5)]
+        cursors = {'*': 'AoE1', 'AoE1': 'AoE2', 'AoE2': 'AoE2'}
+        requested = []
+
+        def page(docs, **kwargs):
+            content = {
+                'responseHeader': {'status': 0},
+                'response': {'numFound': len(ids), 'docs': docs}
+            }
+            content.update(kwargs)
+            return json.dumps(content)
+
+        @httmock.urlmatch(scheme='https', netloc='^cn.dataone.org$',
+                          path='^/cn/v2/query/solr/$', method='GET')
+        def mockSolr(url, request):
+            params = parse_qs(url.query)
+            requested.append(params)
+            self.assertEqual(params['sort'], ['id asc'])
+            cursor = params['cursorMark'][0]
+            start = {'*': 0, 'AoE1': 2, 'AoE2': 4}[cursor]
+            rows = int(params['rows'][0])
+            docs = [{'identifier': _} for _ in ids[start:start + rows]]
+            return page(docs, nextCursorMark=cursors[cursor])
+
+        with httmock.HTTMock(mockSolr):
+            result = [doc['identifier'] for doc in iter_query(
+                'resourceMap:"foo"', base_url='https://cn.dataone.org/cn/v2', rows=2)]
+
+        self.assertEqual(result, ids)
+        # The last page is recognized from numFound, without an extra request
+        self.assertEqual([_['cursorMark'] for _ in requested], [['*'], ['AoE1'], ['AoE2']])
+        self.assertEqual(requested[0]['fl'], ['identifier'])
+
+        # Results fitting in a page take a single request
+        requested.clear()
+        with httmock.HTTMock(mockSolr):
+            result = [doc['identifier'] for doc in iter_query(
+                'resourceMap:"foo"', base_url='https://cn.dataone.org/cn/v2', rows=10)]
+        self.assertEqual(result, ids)
+        self.assertEqual(len(requested), 1)
+
+    def test_list_package_stream(self):
+        # Test that streamed documents are listed once the documenting metadata is known
+        from server.lib.dataone.provider import DataOneImportProvider
+        from server.lib.import_item import ImportItem
+
+        def data(i):
+            return {'identifier': 'data{}'.format(i), 'formatType': 'DATA',
+                    'fileName': 'data{}.csv'.format(i), 'size': 1, 'formatId': 'text/csv'}
+
+        primary = {'identifier': 'meta', 'formatType': 'METADATA', 'title': 'Package',
+                   'documents': ['data0', 'data1'], 'size': 1, 'formatId': 'eml'}
+        extra = {'identifier': 'extra', 'formatType': 'METADATA', 'fileName': 'extra.xml',
+                 'size': 1, 'formatId': 'eml'}
+        provider = DataOneImportProvider()
+        items = list(provider._listRecursive(
+            self.user, 'pkg', None, docs=[data(0), extra, primary, data(1)]))
+        self.assertEqual(
+            [(item.type, item.name) for item in items],
+            [(ImportItem.FOLDER, 'Package'), (ImportItem.FILE, 'data0.csv'),
+             (ImportItem.FILE, 'data1.csv'), (ImportItem.FILE, 'extra.xml'),
+             (ImportItem.END_FOLDER, None)]
+        )
+
+        other = dict(primary, identifier='meta2')
+        with pytest.raises(RestException):
+            list(provider._listRecursive(self.user, 'pkg', None, docs=[primary, other]))
+
+        # Data buffered while waiting for the documenting metadata is bounded
+        provider.max_pending = 2
+        with pytest.raises(RestException):
+            list(provider._listRecursive(
+                self.user, 'pkg', None, docs=[data(0), data(1), data(2), primary]))
+
+    def test_get_package_tree(self):
+        # Test that nested packages are fetched with one query per tree level
+        from urllib.parse import parse_qs
+        from server.lib.dataone.register import get_package_tree
+
+        index = [
+            {'identifier': 'a.xml', 'formatType': 'METADATA', 'resourceMap': ['A']},
+            {'identifier': 'C', 'formatType': 'RESOURCE', 'resourceMap': ['A']},
+            {'identifier': 'shared.csv', 'formatType': 'DATA', 'resourceMap': ['A', 'B']},
+            {'identifier': 'b.xml', 'formatType': 'METADATA', 'resourceMap': ['B']},
+            {'identifier': 'c.xml', 'formatType': 'METADATA', 'resourceMap': ['C']},
+        ]
+        queries = []
+
+        @httmock.urlmatch(scheme='https', netloc='^cn.dataone.org$',
+                          path='^/cn/v2/query/solr/$', method='GET')
+        def mockSolr(url, request):
+            q = parse_qs(url.query)['q'][0]
+            queries.append(q)
+            docs = [dict(doc) for doc in index
+                    if any('"{}"'.format(pid) in q for pid in doc['resourceMap'])]
+            return json.dumps({
+                'responseHeader': {'status': 0},
+                'response': {'numFound': len(docs), 'docs': docs}
+            })
+
+        with httmock.HTTMock(mockSolr):
+            tree = get_package_tree(['A', 'B'], 'https://cn.dataone.org/cn/v2')
+
+        self.assertEqual(queries, ['resourceMap:("A" OR "B")', 'resourceMap:("C")'])
+        self.assertEqual(sorted(tree.keys()), ['A', 'B', 'C'])
+        self.assertEqual([_['identifier'] for _ in tree['A']], ['a.xml', 'C', 'shared.csv'])
+        self.assertEqual([_['identifier'] for _ in tree['B']], ['shared.csv', 'b.xml'])
+        self.assertEqual([_['identifier'] for _ in tree['C']], ['c.xml'])
+
+    def test_get_package_list_batched(self):
+        # Test that batched and unbatched listings resolve child packages the same way
+        from urllib.parse import parse_qs
+        from server.lib.dataone.register import get_package_list
+
+        child = 'resource_map_doi:10.5063/CHILD'
+        index = [
+            {'identifier': 'resource_map_root', 'formatType': 'RESOURCE', 'resourceMap': []},
+            {'identifier': 'root.xml', 'formatType': 'METADATA', 'title': 'Root',
+             'fileName': 'root.xml', 'documents': ['root.xml'], 'size': 1,
+             'resourceMap': ['resource_map_root']},
+            {'identifier': child, 'formatType': 'RESOURCE', 'resourceMap': ['resource_map_root']},
+            # The child listed in the root package was obsoleted by a new version
+            {'identifier': 'old.xml', 'formatType': 'METADATA', 'title': 'Child v1',
+             'fileName': 'old.xml', 'documents': ['old.xml'], 'resourceMap': [child]},
+            {'identifier': 'doi:10.5063/CHILD', 'formatType': 'METADATA', 'title': 'Child v2',
+             'fileName': 'new.xml', 'documents': ['doi:10.5063/CHILD'],
+             'resourceMap': [child + '.2']},
+        ]
+
+        @httmock.urlmatch(scheme='https', netloc='^cn.dataone.org$',
+                          path='^/cn/v2/query/solr/$', method='GET')
+        def mockSolr(url, request):
+            q = parse_qs(url.query)['q'][0]
+            if q.startswith('identifier:'):
+                docs = [dict(doc) for doc in index
+                        if q == 'identifier:"{}"'.format(doc['identifier'])]
+            else:
+                docs = [dict(doc) for doc in index
+                        if any('"{}"'.format(pid) in q for pid in doc['resourceMap'])]
+            return json.dumps({
+                'responseHeader': {'status': 0},
+                'response': {'numFound': len(docs), 'docs': docs}
+            })
+
+        with httmock.HTTMock(mockSolr):
+            unbatched = get_package_list('resource_map_root', 'https://cn.dataone.org/cn/v2')
+            batched = get_package_list(
+                'resource_map_root', 'https://cn.dataone.org/cn/v2', batched=True)
+
+        self.assertEqual(sorted(unbatched['Root']), ['Child v2', 'fileList'])
+        self.assertEqual(batched, unbatched)
+
     @vcr.use_cassette(os.path.join(DATA_PATH, 'test_get_package_list_nested.txt'))
     def test_get_package_list_nested(self):
         # Test that we're getting all of the files in a nested package
@@ -96,11 +96,51 @@ class DatasetTestCase(base.TestCase):
         )
         self.assertStatusOk(resp)
 
+        # Concurrent registration is opt-in and bounded
+        resp = self.request(
+            path='/dataset/register',
+            method='POST',
+            params={'dataMap': json.dumps(admin_data_map), 'workers': 0},
+            user=self.admin,
+        )
+        self.assertStatus(resp, 400)
+        self.assertEqual(resp.json['message'], 'Workers has to be between 1 and 8.')
+
         resp = self.request(path='/dataset', method='GET', user=self.user)
         self.assertStatusOk(resp)
         ds = resp.json
         self.assertEqual(len(ds), 4)
 
+        # Registered folders carry precomputed recursive sizes
+        from server.lib.folder_size import COUNT_KEY, SIZE_KEY, compute_folder_sizes
+        for dataset in ds:
+            if dataset['_modelType'] != 'folder':
+                continue
+            folder = self.model('folder').load(dataset['_id'], force=True)
+            self.assertIn(SIZE_KEY, folder['meta'])
+            self.assertIn(COUNT_KEY, folder['meta'])
+            size, count = compute_folder_sizes([folder])[folder['_id']]
+            self.assertEqual((dataset['size'], dataset['fileCount']), (size, count))
+
+        # Missing rollups are computed once and stored
+        folder = self.model('folder').load(
+            next(_['_id'] for _ in ds if _['_modelType'] == 'folder'), force=True)
+        self.model('folder').update(
+            {'_id': folder['_id']},
+            {'$unset': {'meta.' + SIZE_KEY: '', 'meta.' + COUNT_KEY: ''}}, multi=False)
+        resp = self.request(
+            path='/dataset/{_id}'.format(**folder), method='GET', user=self.user)
+        self.assertStatusOk(resp)
+        self.assertEqual(
+            (resp.json['size'], resp.json['fileCount']),
+            compute_folder_sizes([folder])[folder['_id']]
+        )
+        folder = self.model('folder').load(folder['_id'], force=True)
+        self.assertEqual(
+            (folder['meta'][SIZE_KEY], folder['meta'][COUNT_KEY]),
+            (resp.json['size'], resp.json['fileCount'])
+        )
+
         resp = self.request(
             path='/dataset', method='GET', user=self.user, params={'myData': True}
         )
@@ -134,3 +174,247 @@ class DatasetTestCase(base.TestCase):
         ds = resp.json
         self.assertEqual(len(ds), 1)
         self.assertEqual(ds[0]['name'], 'usco2000.xls')
+
+    def _fakeProvider(self):
+        from server.lib.import_item import ImportItem
+        from server.lib.import_providers import ImportProvider
+
+        class FakeProvider(ImportProvider):
+            files = [('a.csv', 10), ('b.csv', 20), ('a.csv', 10)]
+
+            def _listRecursive(self, user, pid, name, base_url=None, progress=None):
+                yield ImportItem(ImportItem.FOLDER, name, identifier=pid)
+                for fname, size in self.files:
+                    yield ImportItem(ImportItem.FILE, fname, identifier='id:' + fname,
+                                     url='https://example.org/' + fname, size=size,
+                                     mimeType='text/csv')
+                yield ImportItem(ImportItem.FOLDER, 'sub', identifier=pid + '/sub')
+                yield ImportItem(ImportItem.FILE, 'c.csv', url='https://example.org/c.csv',
+                                 size=5)
+                yield ImportItem(ImportItem.END_FOLDER)
+                yield ImportItem(ImportItem.END_FOLDER)
+
+        return FakeProvider('Fake')
+
+    def testBulkRegistration(self):
+        from girder import events
+        from server.lib.data_map import DataMap
+        from server.lib.folder_size import COUNT_KEY, SIZE_KEY
+
+        parent = self.model('folder').createFolder(
+            self.admin, 'Catalog', parentType='user', creator=self.admin)
+        provider = self._fakeProvider()
+        dataMap = DataMap('fake:1', 45, name='Fake dataset', repository='Fake')
+
+        def tree():
+            root = self.model('folder').findOne({'parentId': parent['_id']})
+            sub = self.model('folder').findOne({'parentId': root['_id']})
+            items = {
+                item['name']: item for item in self.model('item').find(
+                    {'folderId': {'$in': [root['_id'], sub['_id']]}})
+            }
+            return root, sub, items
+
+        saved = []
+        with events.bound('model.item.save.after', 'test', lambda e: saved.append(e.info)):
+            objType, obj = provider.register(parent, 'folder', None, self.admin, dataMap)
+        self.assertEqual(objType, 'folder')
+        root, sub, items = tree()
+        # Bulk inserts trigger the same events as Model.save
+        self.assertEqual(sorted(item['name'] for item in saved), sorted(items))
+        self.assertEqual(obj['_id'], root['_id'])
+        self.assertEqual(root['meta']['identifier'], 'fake:1')
+        self.assertEqual(root['meta']['provider'], 'Fake')
+        self.assertEqual((root['meta'][SIZE_KEY], root['meta'][COUNT_KEY]), (45, 4))
+        self.assertEqual((sub['meta'][SIZE_KEY], sub['meta'][COUNT_KEY]), (5, 1))
+        # Duplicated names are registered once, as with reuseExisting
+        self.assertEqual(sorted(items), ['a.csv', 'b.csv', 'c.csv'])
+        self.assertEqual(items['b.csv']['size'], 20)
+        self.assertEqual(items['b.csv']['meta']['identifier'], 'id:b.csv')
+        self.assertEqual(root['size'], 30)
+        fileObj = self.model('file').findOne({'itemId': items['b.csv']['_id']})
+        self.assertEqual(fileObj['linkUrl'], 'https://example.org/b.csv')
+        self.assertEqual(fileObj['exts'], ['csv'])
+
+        # Registering again reuses existing objects and updates changed files
+        provider.files = [('a.csv', 10), ('b.csv', 25), ('d.csv', 1)]
+        objType, obj = provider.register(parent, 'folder', None, self.admin, dataMap)
+        self.assertEqual(obj['_id'], root['_id'])
+        root, sub, items = tree()
+        self.assertEqual(sorted(items), ['a.csv', 'b.csv', 'c.csv', 'd.csv'])
+        self.assertEqual(
+            len(list(self.model('file').find({'itemId': items['b.csv']['_id']}))), 1)
+        self.assertEqual(items['b.csv']['size'], 25)
+        self.assertEqual(root['size'], 36)
+        self.assertEqual((root['meta'][SIZE_KEY], root['meta'][COUNT_KEY]), (41, 4))
+        self.assertEqual(
+            len(list(self.model('folder').find({'parentId': parent['_id']}))), 1)
+
+    def testBulkRegistrationFallback(self):
+        from server.lib.data_map import DataMap
+        from server.lib.import_item import ImportItem
+
+        parent = self.model('folder').createFolder(
+            self.admin, 'Catalog', parentType='user', creator=self.admin)
+        provider = self._fakeProvider()
+        # Names the model would change are registered one by one
+        provider.files = [(' padded.csv ', 3), ('a.csv', 10)]
+        dataMap = DataMap('fake:1', 18, name='Fake dataset', repository='Fake')
+        objType, obj = provider.register(parent, 'folder', None, self.admin, dataMap)
+        root = self.model('folder').findOne({'parentId': parent['_id']})
+        items = {
+            item['name']: item for item in self.model('item').find({'folderId': root['_id']})
+        }
+        self.assertEqual(sorted(items), ['a.csv', 'padded.csv'])
+        self.assertEqual(items['padded.csv']['meta']['identifier'], 'id: padded.csv ')
+
+        # Items registered by the fallback are counted as added only once
+        provider.files = [(' padded.csv ', 3), ('a.csv', 10), (' new.csv ', 4)]
+        objType, obj, summary = provider.sync(parent, 'folder', None, self.admin, dataMap)
+        self.assertEqual(summary, {
+            'added': 1, 'updated': 1, 'unchanged': 2, 'removed': 0,
+            'foldersAdded': 0, 'foldersRemoved': 0,
+        })
+        items = {
+            item['name']: item for item in self.model('item').find({'folderId': root['_id']})
+        }
+        self.assertEqual(sorted(items), ['a.csv', 'new.csv', 'padded.csv'])
+
+        # Also when it's the root of the dataset
+        def _listRecursive(user, pid, name, base_url=None, progress=None):
+            yield ImportItem(ImportItem.FILE, ' lone.csv ', identifier=pid,
+                             url='https://example.org/lone.csv', size=1)
+
+        provider._listRecursive = _listRecursive
+        dataMap = DataMap('fake:2', 1, name=' lone.csv ', repository='Fake')
+        objType, obj = provider.register(parent, 'folder', None, self.admin, dataMap)
+        self.assertEqual(objType, 'item')
+        self.assertEqual(obj['name'], 'lone.csv')
+        self.assertEqual(obj['folderId'], parent['_id'])
+
+    def testSyncRegistration(self):
+        from server.lib.data_map import DataMap
+        from server.lib.folder_size import COUNT_KEY, SIZE_KEY
+
+        parent = self.model('folder').createFolder(
+            self.admin, 'Catalog', parentType='user', creator=self.admin)
+        provider = self._fakeProvider()
+        provider.files = [('a.csv', 10), ('b.csv', 20)]
+        dataMap = DataMap('fake:1', 35, name='Fake dataset', repository='Fake')
+        provider.register(parent, 'folder', None, self.admin, dataMap)
+        root = self.model('folder').findOne({'parentId': parent['_id']})
+        item = self.model('item').findOne({'folderId': root['_id'], 'name': 'a.csv'})
+
+        # Nothing changed, nothing is written
+        objType, obj, summary = provider.sync(parent, 'folder', None, self.admin, dataMap)
+        self.assertEqual(obj['_id'], root['_id'])
+        self.assertEqual(summary, {
+            'added': 0, 'updated': 0, 'unchanged': 3, 'removed': 0,
+            'foldersAdded': 0, 'foldersRemoved': 0,
+        })
+        self.assertEqual(
+            self.model('item').load(item['_id'], force=True)['updated'], item['updated'])
+
+        provider.files = [('b.csv', 25), ('d.csv', 1)]
+        objType, obj, summary = provider.sync(
+            parent, 'folder', None, self.admin, dataMap, prune=True)
+        self.assertEqual(summary, {
+            'added': 1, 'updated': 1, 'unchanged': 1, 'removed': 1,
+            'foldersAdded': 0, 'foldersRemoved': 0,
+        })
+        items = {
+            item['name']: item
+            for item in self.model('item').find({'folderId': root['_id']})
+        }
+        self.assertEqual(sorted(items), ['b.csv', 'd.csv'])
+        self.assertEqual(items['b.csv']['size'], 25)
+        updated = root['updated']
+        root = self.model('folder').load(root['_id'], force=True)
+        self.assertEqual((root['meta'][SIZE_KEY], root['meta'][COUNT_KEY]), (31, 3))
+        self.assertGreater(root['updated'], updated)
+
+    def testResumeRegistration(self):
+        from server.lib.bulk_register import BulkRegistration
+        from server.lib.data_map import DataMap
+        from server.lib.folder_size import COUNT_KEY, SIZE_KEY
+
+        parent = self.model('folder').createFolder(
+            self.admin, 'Catalog', parentType='user', creator=self.admin)
+        provider = self._fakeProvider()
+        provider.files = [('a.csv', 10), ('b.csv', 20), ('e.csv', 30)]
+        dataMap = DataMap('fake:1', 65, name='Fake dataset', repository='Fake')
+        listing = list(provider._listRecursive(self.admin, 'fake:1', 'Fake dataset'))
+
+        states = []
+        registration = BulkRegistration(
+            provider, parent, 'folder', self.admin, batchSize=2, checkpoint=states.append)
+        # The registration is interrupted after a.csv and b.csv were committed
+        for item in listing[:4]:
+            registration.add(item)
+        self.assertEqual(states[-1]['position'], 3)
+        root = self.model('folder').findOne({'parentId': parent['_id']})
+        self.assertEqual(
+            sorted(_['name'] for _ in self.model('item').find({'folderId': root['_id']})),
+            ['a.csv', 'b.csv'])
+
+        objType, obj = provider.register(
+            parent, 'folder', None, self.admin, dataMap, resume=states[-1])
+        self.assertEqual(obj['_id'], root['_id'])
+        items = list(self.model('item').find({'folderId': root['_id']}))
+        self.assertEqual(sorted(_['name'] for _ in items), ['a.csv', 'b.csv', 'e.csv'])
+        self.assertEqual(len(list(self.model('file').find(
+            {'itemId': {'$in': [_['_id'] for _ in items]}}))), 3)
+        root = self.model('folder').load(root['_id'], force=True)
+        self.assertEqual((root['meta'][SIZE_KEY], root['meta'][COUNT_KEY]), (65, 4))
+        self.assertEqual(root['size'], 60)
+
+        # Nothing is skipped if the listing changed since the checkpoint
+        registration = BulkRegistration(provider, parent, 'folder', self.admin)
+        changed = iter([listing[0], listing[2], listing[1]] + listing[3:])
+        self.assertFalse(registration.resume(changed, states[-1]))
+        self.assertEqual(registration.position, 0)
+        self.assertIsNone(registration.rootObj)
+
+    def testConcurrentRegistration(self):
+        from server.lib import IMPORT_PROVIDERS, RegistrationError, register_dataMap
+        from server.lib.data_map import DataMap
+
+        parent = self.model('folder').createFolder(
+            self.admin, 'Catalog', parentType='user', creator=self.admin)
+        provider = self._fakeProvider()
+        listRecursive = provider._listRecursive
+
+        def _listRecursive(user, pid, name, base_url=None, progress=None):
+            if pid == 'fake:bad':
+                raise ValueError('Dataset is gone')
+            return listRecursive(user, pid, name, base_url=base_url, progress=progress)
+
+        provider._listRecursive = _listRecursive
+        dataMaps = [
+            DataMap(pid, 45, name=pid, repository='Fake').toDict()
+            for pid in ('fake:1', 'fake:bad', 'fake:2')
+        ]
+        states = []
+        IMPORT_PROVIDERS.providerMap['Fake'] = provider
+        try:
+            with self.assertRaises(RegistrationError) as context:
+                register_dataMap(
+                    dataMaps, parent, 'folder', user=self.admin,
+                    checkpoint=states.append, workers=3)
+        finally:
+            del IMPORT_PROVIDERS.providerMap['Fake']
+
+        exc = context.exception
+        self.assertEqual(exc.errors, [
+            ('fake:bad', 'Registration of "fake:bad" failed with: Dataset is gone')
+        ])
+        # The other datasets are registered regardless
+        folders = {
+            folder['name']: folder
+            for folder in self.model('folder').find({'parentId': parent['_id']})
+        }
+        self.assertEqual(sorted(folders), ['fake:1', 'fake:2'])
+        self.assertEqual(
+            exc.results, [folders['fake:1']['_id'], None, folders['fake:2']['_id']])
+        # Only the failed dataset is left to do when resuming
+        self.assertEqual(states[-1], {'results': exc.results, 'current': {}})
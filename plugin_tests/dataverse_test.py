@@ -351,6 +351,46 @@ class DataverseHarversterTestCase(base.TestCase):
         Tale().remove(tale)
         Image().remove(image)
 
+    def testSanitizeFilesConcurrently(self):
+        from unittest import mock
+        from urllib.parse import urlparse
+        from server.lib.dataverse import provider
+
+        files = [
+            {'id': i, 'filename': 'file{}.tab'.format(i), 'filesize': 1,
+             'mimeType': 'text/tab-separated-values'}
+            for i in range(10)
+        ]
+        files.insert(5, {'id': 100, 'filename': 'readme.txt', 'filesize': 2,
+                         'mimeType': 'text/plain'})
+
+        def head(url, **kwargs):
+            resp = mock.Mock()
+            resp.headers = {'Content-Length': str(len(url))}
+            return resp
+
+        url = urlparse('https://dataverse.example.org/api/datasets/1')
+        provider._HEAD_CACHE.clear()
+        with mock.patch.object(provider.SESSION, 'head', side_effect=head) as mock_head:
+            result = list(provider.DataverseImportProvider._sanitize_files(url, files))
+            self.assertEqual(mock_head.call_count, 20)
+            self.assertEqual(
+                [_['url'] for _ in result][:3],
+                [
+                    'https://dataverse.example.org/api/access/datafile/0?format=original',
+                    'https://dataverse.example.org/api/access/datafile/0',
+                    'https://dataverse.example.org/api/access/datafile/1?format=original',
+                ]
+            )
+            self.assertEqual(result[10]['filename'], 'readme.txt')
+            self.assertEqual(result[10]['filesize'], 2)
+            self.assertEqual(result[0]['filesize'], len(result[0]['url']))
+
+            # Repeated sanitization, e.g. register after lookup, is served from cache
+            again = list(provider.DataverseImportProvider._sanitize_files(url, files))
+            self.assertEqual(mock_head.call_count, 20)
+            self.assertEqual(again, result)
+
     def tearDown(self):
         self.model('user').remove(self.user)
         self.model('user').remove(self.admin)
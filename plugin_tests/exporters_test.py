@@ -0,0 +1,361 @@
+from hashlib import md5, sha256
+from tests import base
+
+
+def setUpModule():
+    base.enabledPlugins.append('wholetale')
+    base.startServer()
+
+
+def tearDownModule():
+    base.stopServer()
+
+
+class HashFileStreamTestCase(base.TestCase):
+
+    def testChecksums(self):
+        from server.lib.exporters import HashFileStream
+
+        chunks = [b'Hello ', b'World', b'!']
+        stream = HashFileStream(lambda: (_ for _ in chunks))
+        self.assertEqual(b''.join(stream), b'Hello World!')
+        self.assertEqual(stream.md5, md5(b'Hello World!').hexdigest())
+        self.assertEqual(stream.sha256, sha256(b'Hello World!').hexdigest())
+
+    def testCheckpoint(self):
+        from server.lib.exporters import HashFileStream
+
+        stream = HashFileStream((_ for _ in [b'Hello ', b'World']))
+        self.assertEqual(next(stream), b'Hello ')
+        state = stream.checkpoint()
+
+        resumed = HashFileStream((_ for _ in [b'World!']), state=state)
+        self.assertEqual(b''.join(resumed), b'World!')
+        self.assertEqual(resumed.md5, md5(b'Hello World!').hexdigest())
+        self.assertEqual(resumed.sha256, sha256(b'Hello World!').hexdigest())
+
+
+class TaleExporterTestCase(base.TestCase):
+
+    def testPrehashedFile(self):
+        import tempfile
+        import threading
+        from server.lib.exporters import PrehashedFile
+
+        with tempfile.NamedTemporaryFile() as fp:
+            fp.write(b'Hello World!')
+            fp.flush()
+            checksums = {}
+            prehashed = PrehashedFile(
+                fp.name, ['md5', 'sha256'], checksums, chunksize=4, maxsize=1)
+            reader = threading.Thread(target=prehashed.read)
+            reader.start()
+            self.assertEqual(list(prehashed), [b'Hell', b'o Wo', b'rld!'])
+            reader.join()
+            self.assertEqual(checksums['md5'], md5(b'Hello World!').hexdigest())
+            self.assertEqual(checksums['sha256'], sha256(b'Hello World!').hexdigest())
+
+            # A cancelled reader gives up instead of blocking on the full queue
+            checksums = {}
+            prehashed = PrehashedFile(fp.name, ['md5'], checksums, chunksize=4, maxsize=1)
+            reader = threading.Thread(target=prehashed.read)
+            reader.start()
+            self.assertEqual(next(iter(prehashed)), b'Hell')
+            prehashed.cancel()
+            reader.join(timeout=5)
+            self.assertFalse(reader.is_alive())
+            self.assertEqual(checksums, {})
+
+    def testPipelinedWorkspace(self):
+        import os
+        import shutil
+        import tempfile
+        from unittest import mock
+        from server.lib.exporters import TaleExporter
+        from server.lib.exporters.ziputil import ZipGenerator
+        from server.lib.workspace_snapshot import WorkspaceSnapshot
+
+        root = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(root, 'data'))
+            for i in range(20):
+                with open(os.path.join(root, 'data', 'file%d.csv' % i), 'wb') as fp:
+                    fp.write(os.urandom(i * 100000))
+
+            def export(hash_workers):
+                exporter = TaleExporter.__new__(TaleExporter)
+                exporter.algs = ['md5', 'sha256']
+                exporter.hash_workers = hash_workers
+                exporter.use_checksum_cache = False
+                exporter.workspace_snapshot = WorkspaceSnapshot(root)
+                exporter.workspace_stats = exporter.workspace_snapshot.stats()
+                exporter.file_cache = {}
+                exporter.file_updates = {}
+                exporter.state = {'md5': [], 'sha256': []}
+                exporter.zip_generator = ZipGenerator('root')
+                data = []
+                with mock.patch('time.time', return_value=1500000000):
+                    for fullpath, relpath, checksums in exporter.checksummed_workspace():
+                        data.extend(exporter.dump_and_checksum(
+                            exporter.bytes_from_file(fullpath), 'workspace/' + relpath,
+                            checksums=checksums, size=exporter.workspace_stats[relpath].st_size
+                        ))
+                    data.append(exporter.zip_generator.footer())
+                updates = {
+                    relpath: entry[1] for relpath, entry in exporter.file_updates.items()
+                }
+                return b''.join(data), exporter.state, updates
+
+            serial = export(0)
+            pipelined = export(2)
+        finally:
+            shutil.rmtree(root)
+
+        self.assertEqual(len(serial[1]['md5']), 20)
+        self.assertEqual(serial[0], pipelined[0])
+        self.assertEqual(serial[1], pipelined[1])
+        self.assertEqual(serial[2], pipelined[2])
+
+
+class FileChecksumTestCase(base.TestCase):
+
+    def testCacheInvalidation(self):
+        import os
+        import tempfile
+        from bson import ObjectId
+        from server.models.file_checksum import FileChecksum
+
+        workspaceId = ObjectId()
+        with tempfile.NamedTemporaryFile() as fp:
+            fp.write(b'Hello World!')
+            fp.flush()
+            stat = os.stat(fp.name)
+            FileChecksum().record(
+                workspaceId,
+                {'file.txt': (stat, {'md5': 'abc', 'mimeType': 'text/plain'})}
+            )
+            valid = FileChecksum().getValid(workspaceId, {'file.txt': stat})
+            self.assertEqual(valid['file.txt']['md5'], 'abc')
+            self.assertEqual(valid['file.txt']['mimeType'], 'text/plain')
+
+            fp.write(b' Bye!')
+            fp.flush()
+            valid = FileChecksum().getValid(workspaceId, {'file.txt': os.stat(fp.name)})
+            self.assertEqual(valid, {})
+
+            # Entries of files no longer in the workspace are dropped
+            FileChecksum().record(
+                workspaceId, {'other.txt': (stat, {'md5': 'def'})}, paths={'other.txt': stat}
+            )
+            self.assertEqual(
+                [doc['path'] for doc in FileChecksum().find({'workspaceId': workspaceId})],
+                ['other.txt']
+            )
+
+        FileChecksum().removeWorkspace(workspaceId)
+        self.assertEqual(FileChecksum().find({'workspaceId': workspaceId}).count(), 0)
+
+    def testFindAggregate(self):
+        from server.lib.exporters import TaleExporter
+
+        exporter = TaleExporter.__new__(TaleExporter)
+        exporter.manifest = {
+            'aggregates': [{'uri': '../workspace/a'}, {'uri': '../workspace/b'}]
+        }
+        exporter.state = {'md5': [('workspace/b', 'abc'), ('workspace/c', 'def')]}
+        exporter.reset_aggregate_index()
+        exporter.append_aggergate_checksums()
+        self.assertEqual(exporter.manifest['aggregates'][1]['md5'], 'abc')
+        self.assertNotIn('md5', exporter.manifest['aggregates'][0])
+        self.assertIsNone(exporter.find_aggregate('../workspace/c'))
+
+        exporter.manifest['aggregates'][0]['uri'] = '../data/workspace/a'
+        exporter.reset_aggregate_index()
+        self.assertIs(
+            exporter.find_aggregate('../data/workspace/a'), exporter.manifest['aggregates'][0]
+        )
+
+
+class WorkspaceSnapshotTestCase(base.TestCase):
+
+    def testMatchesWalk(self):
+        import os
+        import shutil
+        import tempfile
+        from server.lib.workspace_snapshot import WorkspaceSnapshot
+
+        root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(root, 'a', 'b'))
+        os.makedirs(os.path.join(root, 'c'))
+        for path in ('top.txt', 'a/1.txt', 'a/b/2.txt', 'c/3.txt'):
+            with open(os.path.join(root, path), 'w') as fp:
+                fp.write(path)
+
+        expected = [
+            os.path.relpath(os.path.join(curdir, fname), root)
+            for curdir, _, files in os.walk(root)
+            for fname in files
+        ]
+        snapshot = WorkspaceSnapshot(root)
+        self.assertEqual([entry.relpath for entry in snapshot], expected)
+        self.assertEqual(snapshot.stats()['a/b/2.txt'].st_size, len('a/b/2.txt'))
+        shutil.rmtree(root)
+
+    def testVanishedEntry(self):
+        import os
+        import shutil
+        import tempfile
+        from unittest import mock
+        from server.lib.workspace_snapshot import WorkspaceSnapshot
+
+        root = tempfile.mkdtemp()
+        for path in ('a.txt', 'gone.txt', 'z.txt'):
+            with open(os.path.join(root, path), 'w') as fp:
+                fp.write(path)
+        scandir = os.scandir
+
+        class Vanished:
+            def __init__(self, dir_entry):
+                self.path = dir_entry.path
+
+            def is_dir(self):
+                return False
+
+            def stat(self, follow_symlinks=True):
+                raise FileNotFoundError(self.path)
+
+        class Listing:
+            def __init__(self, path):
+                self.it = scandir(path)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                self.it.close()
+
+            def __iter__(self):
+                return self
+
+            def __next__(self):
+                dir_entry = next(self.it)
+                if dir_entry.name == 'gone.txt':
+                    return Vanished(dir_entry)
+                return dir_entry
+
+        # Only the file removed while walking is missing from the snapshot
+        with mock.patch('server.lib.workspace_snapshot.os.scandir', Listing):
+            snapshot = WorkspaceSnapshot(root)
+            self.assertEqual(sorted(snapshot.stats()), ['a.txt', 'z.txt'])
+        shutil.rmtree(root)
+
+
+class MimeTypeDetectorTestCase(base.TestCase):
+
+    def testDetect(self):
+        import os
+        import tempfile
+        from unittest import mock
+        from server.lib.mimetype import MimeTypeDetector
+
+        detector = MimeTypeDetector(cache_size=1)
+        tmpdir = tempfile.mkdtemp()
+        csv_path = os.path.join(tmpdir, 'data.csv')
+        blob_path = os.path.join(tmpdir, 'blob')
+        for path in (csv_path, blob_path):
+            with open(path, 'w') as fp:
+                fp.write('a,b\n1,2\n')
+
+        with mock.patch.object(detector, 'sniff', return_value='text/plain') as sniff:
+            # Known extension, never sniffed
+            self.assertEqual(detector.detect(csv_path, 'abc'), 'text/csv')
+            self.assertEqual(sniff.call_count, 0)
+
+            # Identical files are sniffed once
+            self.assertEqual(
+                detector.detect_many([(blob_path, 'abc'), (blob_path, 'abc')], workers=2),
+                ['text/plain', 'text/plain']
+            )
+            self.assertEqual(sniff.call_count, 1)
+
+            # Repeated checksum comes from the cache
+            self.assertEqual(detector.detect(blob_path, 'abc'), 'text/plain')
+            self.assertEqual(sniff.call_count, 1)
+
+            self.assertEqual(detector.detect(blob_path, 'def'), 'text/plain')
+            self.assertEqual(sniff.call_count, 2)
+            self.assertEqual(list(detector._cache), ['def'])
+
+            # 'abc' was evicted from the cache of size 1
+            self.assertEqual(detector.detect(blob_path, 'abc'), 'text/plain')
+            self.assertEqual(sniff.call_count, 3)
+            self.assertEqual(list(detector._cache), ['abc'])
+
+        self.assertEqual(detector.sniff(blob_path), 'text/plain')
+
+
+class ZipGeneratorTestCase(base.TestCase):
+
+    def _build(self, zip_generator, members):
+        import io
+
+        data = io.BytesIO()
+        for path, content, size in members:
+            for chunk in zip_generator.addFile(lambda: content, path, size=size):
+                data.write(chunk)
+        data.write(zip_generator.footer())
+        data.seek(0)
+        return data
+
+    def testCompressionPerType(self):
+        import zipfile
+        from server.lib.exporters.ziputil import ZipGenerator
+
+        text = b'a,b,c\n' * 1000
+        members = [
+            ('data.csv', text, len(text)),
+            ('plot.png', text, len(text)),
+            ('tiny.txt', b'x', 1),
+            ('stream.txt', text, None),
+        ]
+        zip_generator = ZipGenerator('root', compression_level=6)
+        with zipfile.ZipFile(self._build(zip_generator, members)) as archive:
+            self.assertIsNone(archive.testzip())
+            compression = {info.filename: info.compress_type for info in archive.infolist()}
+            self.assertEqual(compression, {
+                'root/data.csv': zipfile.ZIP_DEFLATED,
+                'root/plot.png': zipfile.ZIP_STORED,
+                'root/tiny.txt': zipfile.ZIP_STORED,
+                'root/stream.txt': zipfile.ZIP_DEFLATED,
+            })
+            self.assertEqual(archive.read('root/stream.txt'), text)
+
+        # Everything is stored by default
+        with zipfile.ZipFile(self._build(ZipGenerator('root'), members)) as archive:
+            self.assertEqual(
+                {info.compress_type for info in archive.infolist()}, {zipfile.ZIP_STORED}
+            )
+
+    def testZip64(self):
+        import zipfile
+        from server.lib.exporters.ziputil import ZipGenerator
+
+        zip_generator = ZipGenerator('root')
+        # Pretend we're way past the limits of the classic format
+        zip_generator.zip64_limit = 100
+        zip_generator.max_entries = 3
+        members = [
+            ('file_{}.txt'.format(i), str(i).encode() * 200, 200) for i in range(5)
+        ]
+        with zipfile.ZipFile(self._build(zip_generator, members)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(len(archive.infolist()), 5)
+            self.assertEqual(archive.read('root/file_4.txt'), b'4' * 200)
+
+        # Size hints that are too small fall back to ZIP64 data descriptors
+        zip_generator = ZipGenerator('root')
+        zip_generator.zip64_limit = 100
+        members = [('small.txt', b'a' * 10, 10), ('large.txt', b'b' * 200, 50)]
+        with zipfile.ZipFile(self._build(zip_generator, members)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.read('root/large.txt'), b'b' * 200)
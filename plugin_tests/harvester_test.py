@@ -49,7 +49,7 @@ D1_MAP_URL = (
     '?q=resourceMap:%22resource_map_urn%3A'
     'uuid%3Ac878ae53-06cf-40c9-a830-7f6f564133f9%22&'
     'fl=identifier,formatType,title,size,formatId,'
-    'fileName,documents&rows=1000&start=0&wt=json'
+    'fileName,documents&rows=1000&sort=formatType+desc,id+asc&cursorMark=%2A&wt=json'
 )
 
 D1_MAP = {
@@ -506,6 +506,134 @@ class ManifestTestCase(base.TestCase):
             [str(_["itemId"]) for _ in self.tale["dataSet"][:-1]]
         )
 
+    def test_parse_dataSet(self):
+        from server.lib.folder_size import compute_folder_sizes
+        from server.lib.manifest import Manifest
+
+        manifest = Manifest(self.tale, self.user)
+        folder = self.model("folder").load(
+            self.tale["dataSet"][0]["itemId"], force=True
+        )
+        files = [
+            fobj for _, fobj in self.model("folder").fileList(
+                folder, user=self.user, subpath=False, data=False
+            )
+        ]
+        self.assertEqual(
+            compute_folder_sizes([folder], user=self.user),
+            {folder["_id"]: (sum(_["size"] for _ in files), len(files))}
+        )
+
+        missing = [{"itemId": ObjectId(), "_modelType": "item", "mountPath": "a"}]
+        with self.assertRaises(ValidationException):
+            manifest._parse_dataSet(dataSet=missing)
+
+    def test_parse_dataSet_http_items(self):
+        from server.lib.manifest import Manifest
+
+        # Every HTTP item is a dataset of its own, even if they share a folder
+        folder = self.model("folder").load(self.tale["dataSet"][-1]["itemId"], force=True)
+        items = list(self.model("folder").childItems(folder))[:2]
+        self.assertEqual(len(items), 2)
+        dataSet = [
+            {"itemId": item["_id"], "_modelType": "item", "mountPath": item["name"]}
+            for item in items
+        ]
+        ext, identifiers = Manifest(self.tale, self.user)._parse_dataSet(dataSet=dataSet)
+        self.assertEqual(
+            [_["dataset_identifier"] for _ in ext],
+            [item["meta"]["identifier"] for item in items]
+        )
+        self.assertEqual(identifiers, {item["meta"]["identifier"] for item in items})
+
+    def test_expand_folder_into_items(self):
+        from girder.models.file import File
+        from girder.models.folder import Folder
+        from girder.models.item import Item
+        from server.lib.manifest import Manifest
+
+        catalog = lookUpPath(
+            "/collection/WholeTale Catalog/WholeTale Catalog", force=True
+        )["document"]
+
+        def create_folder(parent, name, public=True):
+            return Folder().createFolder(
+                parent, name, creator=self.admin, public=public, reuseExisting=True
+            )
+
+        def create_item(folder, name):
+            url = "https://example.com/{}/{}".format(folder["name"], name)
+            item = Item().createItem(name, self.admin, folder)
+            Item().setMetadata(item, {"provider": "HTTP", "identifier": url})
+            File().createLinkFile(
+                name, item, "item", url, self.admin, size=10, mimeType="text/plain"
+            )
+
+        root = create_folder(catalog, "nested")
+        create_item(root, "b.txt")
+        create_item(root, "a.txt")
+        second = create_folder(root, "second")
+        first = create_folder(root, "first")
+        hidden = create_folder(root, "hidden", public=False)
+        create_item(second, "c.txt")
+        create_item(first, "d.txt")
+        create_item(create_folder(first, "deep"), "e.txt")
+        create_item(hidden, "secret.txt")
+
+        manifest = Manifest(self.tale, self.user)
+        ext = list(manifest._expand_folder_into_items(root, self.user, relpath="data"))
+        # Breadth-first, sorted by name within each level, skipping unreadable folders
+        self.assertEqual(
+            [(_["relpath"], _["name"]) for _ in ext],
+            [
+                ("data/nested", "a.txt"),
+                ("data/nested", "b.txt"),
+                ("data/nested/first", "d.txt"),
+                ("data/nested/second", "c.txt"),
+                ("data/nested/first/deep", "e.txt"),
+            ]
+        )
+        Folder().remove(root)
+
+    def test_manifest_cache(self):
+        from server.lib.manifest_cache import MANIFEST_CACHE, ManifestCache
+
+        cache = ManifestCache(maxsize=1)
+        first = cache.get(self.tale, self.user)
+        first["@id"] = "modified"
+        second = cache.get(self.tale, self.user)
+        self.assertNotEqual(second["@id"], "modified")
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+        cache.get(self.tale, self.user, expand_folders=True)
+        self.assertEqual(cache.stats()["misses"], 2)
+        self.assertEqual(cache.stats()["size"], 1)
+        cache.invalidate(self.tale["_id"])
+        self.assertEqual(cache.stats()["size"], 0)
+
+        # Changes to the creator's profile or to access to the datasets are misses
+        cache = ManifestCache()
+        cache.get(self.tale, self.user)
+        self.user["firstName"] = "Renamed"
+        self.user = self.model("user").save(self.user)
+        manifest = cache.get(self.tale, self.user)
+        self.assertEqual(manifest["createdBy"]["schema:givenName"], "Renamed")
+        self.assertEqual(cache.stats()["misses"], 2)
+
+        entry = self.tale["dataSet"][0]
+        folder = self.model(entry["_modelType"]).load(entry["itemId"], force=True)
+        self.model("folder").setPublic(folder, False, save=True)
+        with self.assertRaises(AccessException):
+            cache.get(self.tale, self.user)
+        self.model("folder").setPublic(folder, True, save=True)
+
+        MANIFEST_CACHE.clear()
+        MANIFEST_CACHE.get(self.tale, self.user)
+        self.assertEqual(MANIFEST_CACHE.stats()["size"], 1)
+        self.tale = self.model("tale", "wholetale").updateTale(self.tale)
+        self.assertEqual(MANIFEST_CACHE.stats()["size"], 0)
+
     def tearDown(self):
         self.model("user").remove(self.user)
         self.model("user").remove(self.admin)
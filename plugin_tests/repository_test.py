@@ -72,6 +72,137 @@ class RepositoryTestCase(base.TestCase):
                     )
                 )
 
+    def testConcurrentResolution(self):
+        import time
+        from unittest import mock
+        from server.lib import PidResolutionError, pids_to_entities
+
+        def fake_resolve(pid, user, base_url, lookup, path, depth):
+            # Finish in reverse order
+            time.sleep(0.01 * (5 - int(pid[-1])))
+            if pid.endswith("3"):
+                return None, "failed " + pid
+            return {"pid": pid}, None
+
+        pids = ["https://example.org/{}".format(i) for i in range(5)]
+        with mock.patch("server.lib._resolve_pid", side_effect=fake_resolve):
+            with self.assertRaises(PidResolutionError) as exc:
+                pids_to_entities(pids, workers=5, per_host=2)
+        self.assertEqual(exc.exception.errors, [(pids[3], "failed " + pids[3])])
+        self.assertEqual(
+            [_ and _["pid"] for _ in exc.exception.results],
+            pids[:3] + [None] + pids[4:],
+        )
+
+    def testStreamFiles(self):
+        from unittest import mock
+        from server.lib.entity import Entity
+        from server.lib.import_item import ImportItem
+        from server.lib.import_providers import ImportProvider
+
+        class FakeProvider(ImportProvider):
+            def _listRecursive(self, user, pid, name, base_url=None, progress=None):
+                yield ImportItem(ImportItem.FOLDER, "Dataset")
+                yield ImportItem(ImportItem.FILE, "a.csv", size=10)
+                yield ImportItem(ImportItem.FOLDER, "data")
+                yield ImportItem(ImportItem.FOLDER, "raw")
+                yield ImportItem(ImportItem.FILE, "b.csv", size=20)
+                yield ImportItem(ImportItem.END_FOLDER)
+                yield ImportItem(ImportItem.END_FOLDER)
+                yield ImportItem(ImportItem.END_FOLDER)
+
+        def fake_resolve(pid, user, base_url):
+            if pid.endswith("bad"):
+                raise ValueError("not found")
+            entity = Entity(pid, user)
+            entity["base_url"] = base_url
+            return entity, FakeProvider("Fake")
+
+        def stream(**params):
+            params["dataId"] = json.dumps(
+                ["https://example.org/1", "https://example.org/bad"]
+            )
+            params["stream"] = True
+            resp = self.request(
+                path="/repository/listFiles", method="GET", params=params, isJson=False
+            )
+            self.assertStatusOk(resp)
+            self.assertEqual(resp.headers["Content-Type"], "application/x-ndjson")
+            return [json.loads(line) for line in self.getBody(resp).splitlines()]
+
+        with mock.patch("server.lib._resolve_entity", side_effect=fake_resolve):
+            entries = stream()
+            self.assertEqual(
+                entries,
+                [
+                    {"type": "folder", "path": [], "name": "Dataset"},
+                    {"type": "file", "path": ["Dataset"], "name": "a.csv", "size": 10},
+                    {"type": "folder", "path": ["Dataset"], "name": "data"},
+                    {"type": "folder", "path": ["Dataset", "data"], "name": "raw"},
+                    {
+                        "type": "file",
+                        "path": ["Dataset", "data", "raw"],
+                        "name": "b.csv",
+                        "size": 20,
+                    },
+                    {
+                        "type": "error",
+                        "dataId": "https://example.org/bad",
+                        "message": 'Listing files at "https://example.org/bad" '
+                        "failed with: not found",
+                    },
+                ],
+            )
+
+            # Contents of "data" are left out
+            self.assertEqual(stream(depth=0), entries[:3] + entries[5:])
+            self.assertEqual(
+                stream(path="data", depth=0),
+                [
+                    {"type": "folder", "path": [], "name": "data"},
+                    {"type": "folder", "path": ["data"], "name": "raw"},
+                    {
+                        "type": "error",
+                        "dataId": "https://example.org/bad",
+                        "message": 'Listing files at "https://example.org/bad" '
+                        "failed with: not found",
+                    },
+                ],
+            )
+
+            # Paging through with cursors yields the same entries
+            pages = [stream(limit=4)]
+            self.assertEqual(pages[0][-1], {"type": "cursor", "cursor": "0:4"})
+            pages.append(stream(limit=4, cursor=pages[0][-1]["cursor"]))
+            self.assertEqual(pages[0][:-1] + pages[1], entries)
+
+            # Same options without streaming
+            resp = self.request(
+                path="/repository/listFiles",
+                method="GET",
+                params={"dataId": json.dumps(["https://example.org/1"]), "depth": 0},
+            )
+            self.assertStatusOk(resp)
+            self.assertEqual(
+                resp.json, [{"Dataset": {"fileList": [{"a.csv": {"size": 10}}], "data": {}}}]
+            )
+            resp = self.request(
+                path="/repository/listFiles",
+                method="GET",
+                params={"dataId": json.dumps(["https://example.org/1"]), "path": "data/raw"},
+            )
+            self.assertStatusOk(resp)
+            self.assertEqual(resp.json, [{"raw": {"fileList": [{"b.csv": {"size": 20}}]}}])
+
+        resp = self.request(
+            path="/repository/listFiles",
+            method="GET",
+            params={"dataId": json.dumps(["https://example.org/1"]), "stream": True,
+                    "cursor": "nope"},
+        )
+        self.assertStatus(resp, 400)
+        self.assertEqual(resp.json["message"], 'Invalid cursor "nope".')
+
     def testPublishers(self):
         # This assumes some defaults that probably should be set here instead...
         resp = self.request(path="/repository", method="GET")
@@ -610,6 +610,93 @@ class TaleTestCase(base.TestCase):
             self.assertTrue("{}/{}".format(tale["_id"], content_file) in zip_files)
         self.model('tale', 'wholetale').remove(tale)
 
+    def testResumableExport(self):
+        from girder.plugins.jobs.models.job import Job
+        from server.models.tale_export import TaleExport
+
+        resp = self.request(
+            path='/tale', method='POST', user=self.user,
+            type='application/json',
+            body=json.dumps({
+                'authors': self.authors,
+                'imageId': str(self.image['_id']),
+                'dataSet': [],
+                'title': 'tale tile',
+            })
+        )
+        self.assertStatusOk(resp)
+        tale = resp.json
+        workspace = Folder().load(tale["workspaceId"], force=True)
+        with open(os.path.join(workspace["fsPath"], "test_file.txt"), "wb") as f:
+            f.write(b"Hello World!")
+
+        export_path = '/tale/{}/export'.format(str(tale['_id']))
+
+        def _waitForExport(user):
+            # The zipfile is built by a job, 202 is returned until it's ready
+            for i in range(50):
+                resp = self.request(
+                    path=export_path, method='GET', isJson=False, user=user,
+                    params={'resumable': True})
+                if not resp.output_status.startswith(b'202'):
+                    break
+                self.assertEqual(resp.headers['Retry-After'], '5')
+                time.sleep(0.1)
+            self.assertStatusOk(resp)
+            return resp
+
+        resp = _waitForExport(self.user)
+        body = b''.join(resp.body)
+        etag = resp.headers['ETag']
+        self.assertEqual(resp.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(int(resp.headers['Content-Length']), len(body))
+        with tempfile.NamedTemporaryFile() as fp:
+            fp.write(body)
+            fp.seek(0)
+            self.assertTrue(zipfile.is_zipfile(fp))
+
+        # Unchanged tale is served from the stored zipfile
+        resp = self.request(
+            path=export_path, method='GET', isJson=False, user=self.user,
+            params={'resumable': True}, additionalHeaders=[('Range', 'bytes=10-19')])
+        self.assertStatus(resp, 206)
+        self.assertEqual(resp.headers['ETag'], etag)
+        self.assertEqual(
+            resp.headers['Content-Range'], 'bytes 10-19/{}'.format(len(body)))
+        self.assertEqual(b''.join(resp.body), body[10:20])
+
+        # Multiple ranges are not supported, the whole zipfile is sent
+        resp = self.request(
+            path=export_path, method='GET', isJson=False, user=self.user,
+            params={'resumable': True}, additionalHeaders=[('Range', 'bytes=0-1,10-19')])
+        self.assertStatusOk(resp)
+        self.assertEqual(b''.join(resp.body), body)
+
+        resp = self.request(
+            path=export_path, method='GET', isJson=False, user=self.user,
+            params={'resumable': True}, additionalHeaders=[('If-None-Match', etag)])
+        self.assertStatus(resp, 304)
+
+        self.assertEqual(Job().find({'type': 'wholetale.export_tale'}).count(), 1)
+        job = Job().findOne({'type': 'wholetale.export_tale'})
+        self.assertEqual(job['userId'], self.user['_id'])
+        self.assertNotIn('user', job['kwargs'])
+
+        # Other users get their own export, built with their permissions
+        resp = _waitForExport(self.admin)
+        b''.join(resp.body)
+        self.assertEqual(Job().find({'type': 'wholetale.export_tale'}).count(), 2)
+        self.assertEqual(
+            TaleExport().find({'taleId': tale['_id']}).count(), 2)
+
+        # Modifying the workspace invalidates the stored zipfile
+        with open(os.path.join(workspace["fsPath"], "test_file2.txt"), "wb") as f:
+            f.write(b"Bye World!")
+        resp = _waitForExport(self.user)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+        b''.join(resp.body)
+        self.model('tale', 'wholetale').remove(tale)
+
     @mock.patch('gwvolman.tasks.build_tale_image')
     def testImageBuild(self, it):
         resp = self.request(
@@ -22,3 +22,76 @@ class TestDataONEUtils(base.TestCase):
 
         self.assertEqual(folder['name'], folder_name)
         self.assertEqual(folder['description'], folder_desc)
+
+
+class ResolutionCacheTestCase(base.TestCase):
+
+    def testResolutionCache(self):
+        from unittest import mock
+        from server.lib.resolution_cache import ResolutionCache
+        from server.models.redirect_cache import RedirectCache
+
+        resolve = mock.Mock(side_effect=lambda link: (link + '/target', link.endswith('bad')))
+        cache = ResolutionCache(maxsize=2, negative_ttl=0, store=RedirectCache())
+
+        self.assertEqual(cache.get('https://doi.org/good', resolve), 'https://doi.org/good/target')
+        self.assertEqual(cache.get('https://doi.org/good', resolve), 'https://doi.org/good/target')
+        self.assertEqual(resolve.call_count, 1)
+
+        # Negative entries with zero TTL expire immediately
+        cache.get('https://doi.org/bad', resolve)
+        cache.get('https://doi.org/bad', resolve)
+        self.assertEqual(resolve.call_count, 3)
+
+        # Another process only sees the shared store
+        other = ResolutionCache(store=RedirectCache())
+        self.assertEqual(other.get('https://doi.org/good', resolve), 'https://doi.org/good/target')
+        self.assertEqual(resolve.call_count, 3)
+
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 3)
+        self.assertEqual(other.stats()['shared_hits'], 1)
+
+
+class HTTPClientTestCase(base.TestCase):
+
+    def testSession(self):
+        from server.lib.http_client import SESSION, TimeoutHTTPAdapter, create_session
+
+        adapter = SESSION.get_adapter('https://doi.org/')
+        self.assertIsInstance(adapter, TimeoutHTTPAdapter)
+        self.assertEqual(adapter.max_retries.total, 3)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+
+        session = create_session(retries=0, timeout=1)
+        adapter = session.get_adapter('http://example.org/')
+        self.assertEqual(adapter.timeout, 1)
+        self.assertEqual(adapter.max_retries.total, 0)
+
+
+class FileMapTestCase(base.TestCase):
+
+    def testWriteJSON(self):
+        import io
+        import json
+        from server.lib.file_map import FileMap
+
+        fm = FileMap('Dataset "é"')
+        fm.addFile('b.csv', 20)
+        fm.addFile('a.csv', 10)
+        sub = fm.addChild('sub')
+        sub.addFile('c.csv', 5)
+        sub.addChild('empty')
+        self.assertEqual(fm.toDict(), {
+            'Dataset "é"': {
+                'fileList': [{'a.csv': {'size': 10}}, {'b.csv': {'size': 20}}],
+                'sub': {'fileList': [{'c.csv': {'size': 5}}], 'empty': {}},
+            }
+        })
+        self.assertEqual(
+            [(item.name, item.size) for item in fm.getFileList()],
+            [('b.csv', 20), ('a.csv', 10)])
+
+        fp = io.StringIO()
+        fm.writeJSON(fp)
+        self.assertEqual(fp.getvalue(), json.dumps(fm.toDict()))
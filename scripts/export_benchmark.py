@@ -0,0 +1,210 @@
+#!/usr/bin/env girder-shell
+# -*- coding: utf-8 -*-
+
+"""Benchmark Tale export building blocks.
+
+Available benchmarks:
+
+    hashing - throughput of the checksum engine used by TaleExporter on a
+        synthetic workspace, comparing the legacy approach (restoring and
+        serializing hash state on every chunk) with the streaming one.
+    aggregates - updating checksums of synthetic
+        manifest aggregates, comparing linear scans with the uri index.
+    compression - archive size and build time of a mixed content workspace
+        (text and already compressed files) when storing everything,
+        deflating everything and using the per file type policy.
+
+Example:
+
+    $ ./export_benchmark.py hashing --size 5G --files 50
+    $ ./export_benchmark.py aggregates --count 100000
+    $ ./export_benchmark.py compression --size 1G --files 100
+
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from hashlib import md5, sha256
+
+from girder.utility import hash_state
+from girder.plugins.wholetale.lib.exporters import HashFileStream, TaleExporter
+from girder.plugins.wholetale.lib.exporters.ziputil import ZipGenerator
+
+
+def parse_size(value):
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if value[-1].upper() in units:
+        return int(float(value[:-1]) * units[value[-1].upper()])
+    return int(value)
+
+
+def create_workspace(size, nfiles, chunk=1024 ** 2):
+    path = tempfile.mkdtemp(prefix='wt_bench_')
+    per_file = size // nfiles
+    block = os.urandom(chunk)
+    for i in range(nfiles):
+        with open(os.path.join(path, 'file_{:05d}.bin'.format(i)), 'wb') as fp:
+            remaining = per_file
+            while remaining > 0:
+                fp.write(block[:min(chunk, remaining)])
+                remaining -= chunk
+    return path
+
+
+class LegacyHashFileStream:
+    """Per-chunk state serialization, as done before streaming checksums."""
+
+    def __init__(self, gen):
+        self.gen = gen
+        self.state = {
+            'md5': hash_state.serializeHex(md5()),
+            'sha256': hash_state.serializeHex(sha256()),
+        }
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        nxt = next(self.gen)
+        for alg in self.state.keys():
+            checksum = hash_state.restoreHex(self.state[alg], alg)
+            checksum.update(nxt)
+            self.state[alg] = hash_state.serializeHex(checksum)
+        return nxt
+
+
+def timed_run(workspace, stream_cls):
+    total = 0
+    start = time.perf_counter()
+    for fname in sorted(os.listdir(workspace)):
+        stream = stream_cls(TaleExporter.bytes_from_file(os.path.join(workspace, fname)))
+        for chunk in stream:
+            total += len(chunk)
+    return total, time.perf_counter() - start
+
+
+def report(label, nbytes, elapsed):
+    print('{:<12} {:>8.2f} s {:>10.2f} MiB/s'.format(
+        label, elapsed, nbytes / elapsed / 1024 ** 2))
+
+
+def bench_hashing(args):
+    workspace = create_workspace(parse_size(args.size), args.files)
+    try:
+        for label, cls in (('legacy', LegacyHashFileStream), ('streaming', HashFileStream)):
+            report(label, *timed_run(workspace, cls))
+    finally:
+        shutil.rmtree(workspace)
+
+
+def linear_find_aggregate(manifest, uri):
+    index = next(
+        (i for (i, d) in enumerate(manifest['aggregates']) if d['uri'] == uri), None
+    )
+    if index is not None:
+        return manifest['aggregates'][index]
+
+
+def bench_aggregates(args):
+    manifest = {
+        'aggregates': [
+            {'uri': '../workspace/dir_{:03d}/file_{:06d}.txt'.format(i % 100, i)}
+            for i in range(args.count)
+        ]
+    }
+    state = [(agg['uri'][3:], 'd41d8cd98f00b204e9800998ecf8427e')
+             for agg in manifest['aggregates']]
+    # Linear scans are quadratic, only sample them and extrapolate
+    sample = state[-min(args.sample, len(state)):]
+
+    start = time.perf_counter()
+    for path, chksum in sample:
+        linear_find_aggregate(manifest, '../' + path)['md5'] = chksum
+    elapsed = (time.perf_counter() - start) * len(state) / len(sample)
+    print('{:<12} {:>8.2f} s (extrapolated from {} lookups)'.format(
+        'linear', elapsed, len(sample)))
+
+    exporter = TaleExporter.__new__(TaleExporter)
+    exporter.manifest = manifest
+    exporter.state = {'md5': state}
+    exporter.reset_aggregate_index()
+    start = time.perf_counter()
+    exporter.append_aggergate_checksums()
+    print('{:<12} {:>8.2f} s'.format('indexed', time.perf_counter() - start))
+
+
+def create_mixed_workspace(size, nfiles, chunk=1024 ** 2):
+    """Half of the files are csv text, the other half random (incompressible) data."""
+    path = tempfile.mkdtemp(prefix='wt_bench_')
+    per_file = size // nfiles
+    row = b''.join(b'%d,%d.%03d,sample_%d\n' % (i, i * 7, i % 1000, i % 13)
+                   for i in range(chunk // 24))
+    blobs = {'csv': row[:chunk], 'png': os.urandom(chunk), 'gz': os.urandom(chunk)}
+    for i in range(nfiles):
+        ext = 'csv' if i % 2 == 0 else ('png' if i % 4 == 1 else 'gz')
+        with open(os.path.join(path, 'file_{:05d}.{}'.format(i, ext)), 'wb') as fp:
+            remaining = per_file
+            while remaining > 0:
+                fp.write(blobs[ext][:min(chunk, remaining)])
+                remaining -= chunk
+    return path
+
+
+def bench_compression(args):
+    workspace = create_mixed_workspace(parse_size(args.size), args.files)
+    policies = (
+        ('stored', dict(compression_level=0)),
+        ('deflate-all', dict(compression_level=args.level, stored_extensions=())),
+        ('per-type', dict(compression_level=args.level)),
+    )
+    try:
+        for label, kwargs in policies:
+            zip_generator = ZipGenerator('bench', **kwargs)
+            total = 0
+            start = time.perf_counter()
+            for fname in sorted(os.listdir(workspace)):
+                fullpath = os.path.join(workspace, fname)
+                for data in zip_generator.addFile(
+                    lambda: TaleExporter.bytes_from_file(fullpath), fname,
+                    size=os.path.getsize(fullpath)
+                ):
+                    total += len(data)
+            total += len(zip_generator.footer())
+            print('{:<12} {:>8.2f} s {:>10.2f} MiB'.format(
+                label, time.perf_counter() - start, total / 1024 ** 2))
+    finally:
+        shutil.rmtree(workspace)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    hashing = subparsers.add_parser('hashing', help='Checksum engine throughput')
+    hashing.add_argument('--size', default='5G', help='Total workspace size (e.g. 512M, 5G)')
+    hashing.add_argument('--files', type=int, default=50, help='Number of files')
+    hashing.set_defaults(func=bench_hashing)
+
+    aggregates = subparsers.add_parser('aggregates', help='Manifest aggregates lookup')
+    aggregates.add_argument('--count', type=int, default=100000,
+                            help='Number of synthetic aggregates')
+    aggregates.add_argument('--sample', type=int, default=1000,
+                            help='Number of lookups timed for the linear scan')
+    aggregates.set_defaults(func=bench_aggregates)
+
+    compression = subparsers.add_parser('compression', help='Per file type compression')
+    compression.add_argument('--size', default='1G', help='Total workspace size (e.g. 512M, 5G)')
+    compression.add_argument('--files', type=int, default=100, help='Number of files')
+    compression.add_argument('--level', type=int, default=6, help='Deflate level')
+    compression.set_defaults(func=bench_compression)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
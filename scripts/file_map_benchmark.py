@@ -0,0 +1,157 @@
+#!/usr/bin/env girder-shell
+# -*- coding: utf-8 -*-
+
+"""Benchmark memory use and serialization of FileMap on a synthetic tree.
+
+A tree of --files files spread over --folders folders (nested --depth levels
+deep) is built with the legacy FileMap (a FileItem per file, ChildList and
+FileList wrappers per folder) and with the current one. For each, the memory
+held by the tree, the build time and the time to serialize it, either through
+toDict() and json.dumps or with writeJSON, are reported.
+
+Example:
+
+    $ ./file_map_benchmark.py --files 1000000 --folders 1000 --depth 3
+
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+from hashlib import sha256
+
+from girder.plugins.wholetale.lib.file_map import FileMap
+
+
+class LegacyFileItem:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+    def toDict(self):
+        return {self.name: {'size': self.size}}
+
+
+class LegacyFileList:
+    def __init__(self):
+        self.list = []
+
+    def addFile(self, fi):
+        self.list.append(fi)
+
+    def toList(self):
+        return sorted([x.toDict() for x in self.list], key=lambda k: list(k))
+
+
+class LegacyChildList:
+    def __init__(self):
+        self.list = {}
+
+    def addChild(self, name):
+        child = LegacyFileMap(name)
+        self.list[name] = child
+        return child
+
+
+class LegacyFileMap:
+    """FileMap as it was before FileList kept parallel name and size lists."""
+
+    def __init__(self, name):
+        self.name = name
+        self.children = None
+        self.fileList = None
+
+    def addChild(self, name):
+        if self.children is None:
+            self.children = LegacyChildList()
+        return self.children.addChild(name)
+
+    def addFile(self, name, size):
+        if self.fileList is None:
+            self.fileList = LegacyFileList()
+        self.fileList.addFile(LegacyFileItem(name, size))
+
+    def toDict(self, root=True):
+        d = {}
+        if self.fileList is not None:
+            d['fileList'] = self.fileList.toList()
+        if self.children is not None:
+            for name, child in self.children.list.items():
+                d[name] = child.toDict(root=False)
+        if root:
+            return {self.name: d}
+        return d
+
+
+def build(cls, nfiles, nfolders, depth):
+    root = cls('Dataset')
+    folders, depths = [root], [0]
+    for i in range(1, nfolders):
+        # Up to 10 subfolders per folder, going back to the root past depth
+        parent = (i - 1) // 10
+        if depths[parent] >= depth:
+            parent = 0
+        folders.append(folders[parent].addChild('folder_{:06d}'.format(i)))
+        depths.append(depths[parent] + 1)
+    for i in range(nfiles):
+        # Added in reverse order, so that sorting has some work to do
+        folders[i % nfolders].addFile('file_{:08d}.dat'.format(nfiles - i), i * 17 % 65536)
+    return root
+
+
+class HashWriter:
+    """File-like object keeping only a checksum of what's written."""
+
+    def __init__(self):
+        self.checksum = sha256()
+
+    def write(self, data):
+        self.checksum.update(data.encode())
+
+
+def measure(label, func):
+    """Time func, then run it again under tracemalloc, which slows it down a lot."""
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{:<24} {:>8.2f} s {:>10.1f} MiB held {:>10.1f} MiB peak'.format(
+        label, elapsed, current / 1024 ** 2, peak / 1024 ** 2))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=1000000, help='Number of files')
+    parser.add_argument('--folders', type=int, default=1000, help='Number of folders')
+    parser.add_argument('--depth', type=int, default=3, help='Maximum folder depth')
+    args = parser.parse_args()
+
+    checksums = set()
+    for label, cls in (('legacy', LegacyFileMap), ('current', FileMap)):
+        tree = measure(label + ' build', lambda: build(
+            cls, args.files, args.folders, args.depth))
+
+        def dumps(tree=tree):
+            writer = HashWriter()
+            writer.write(json.dumps(tree.toDict()))
+            return writer.checksum.hexdigest()
+        checksums.add(measure(label + ' toDict+dumps', dumps))
+
+        if cls is FileMap:
+            def write(tree=tree):
+                writer = HashWriter()
+                tree.writeJSON(writer)
+                return writer.checksum.hexdigest()
+            checksums.add(measure(label + ' writeJSON', write))
+        # Release the tree before building the next one
+        tree = dumps = write = None
+    assert len(checksums) == 1, 'Serializations differ'
+
+
+if __name__ == '__main__':
+    main()
@@ -37,6 +37,8 @@ from .rest.instance import Instance
 from .rest.wholetale import wholeTale
 from .rest.license import License
 from .models.instance import finalizeInstance
+from .models.redirect_cache import RedirectCache
+from .lib.resolvers import RESOLUTION_CACHE
 from .schema.misc import (
     external_auth_providers_schema,
     external_apikey_groups_schema,
@@ -122,6 +124,60 @@ def validateInstanceCap(doc):
             'Instance Cap needs to be an integer.', 'value')
 
 
+@setting_utilities.validator(PluginSettings.EXPORT_HASH_WORKERS)
+def validateExportHashWorkers(doc):
+    if not doc['value']:
+        doc['value'] = defaultExportHashWorkers()
+    try:
+        doc['value'] = int(doc['value'])
+    except ValueError:
+        raise ValidationException(
+            'Number of export hash workers needs to be an integer.', 'value')
+    if doc['value'] < 0:
+        raise ValidationException(
+            'Number of export hash workers cannot be negative.', 'value')
+
+
+@setting_utilities.validator(PluginSettings.EXPORT_COMPRESSION_LEVEL)
+def validateExportCompressionLevel(doc):
+    if doc['value'] is None or doc['value'] == '':
+        doc['value'] = defaultExportCompressionLevel()
+    try:
+        doc['value'] = int(doc['value'])
+    except ValueError:
+        raise ValidationException(
+            'Export compression level needs to be an integer.', 'value')
+    if not 0 <= doc['value'] <= 9:
+        raise ValidationException(
+            'Export compression level needs to be between 0 and 9.', 'value')
+
+
+@setting_utilities.validator({
+    PluginSettings.EXPORT_CACHE_SIZE,
+    PluginSettings.EXPORT_CACHE_TTL
+})
+def validateExportCache(doc):
+    if doc['value'] is None or doc['value'] == '':
+        doc['value'] = SettingDefault.defaults[doc['key']]
+    try:
+        doc['value'] = int(doc['value'])
+    except ValueError:
+        raise ValidationException(
+            'Export cache size and TTL need to be integers.', 'value')
+    if doc['value'] < 0:
+        raise ValidationException(
+            'Export cache size and TTL cannot be negative.', 'value')
+
+
+@setting_utilities.validator(PluginSettings.DATAONE_BATCH_CHILDREN)
+def validateDataONEBatchChildren(doc):
+    if doc['value'] is None or doc['value'] == '':
+        doc['value'] = defaultDataONEBatchChildren()
+    if not isinstance(doc['value'], bool):
+        raise ValidationException(
+            'DataONE batch children setting needs to be a boolean.', 'value')
+
+
 @setting_utilities.validator(PluginSettings.DATAVERSE_URL)
 def validateDataverseURL(doc):
     if not doc['value']:
@@ -135,6 +191,31 @@ def defaultInstanceCap():
     return SettingDefault.defaults[PluginSettings.INSTANCE_CAP]
 
 
+@setting_utilities.default(PluginSettings.EXPORT_HASH_WORKERS)
+def defaultExportHashWorkers():
+    return SettingDefault.defaults[PluginSettings.EXPORT_HASH_WORKERS]
+
+
+@setting_utilities.default(PluginSettings.EXPORT_COMPRESSION_LEVEL)
+def defaultExportCompressionLevel():
+    return SettingDefault.defaults[PluginSettings.EXPORT_COMPRESSION_LEVEL]
+
+
+@setting_utilities.default(PluginSettings.EXPORT_CACHE_SIZE)
+def defaultExportCacheSize():
+    return SettingDefault.defaults[PluginSettings.EXPORT_CACHE_SIZE]
+
+
+@setting_utilities.default(PluginSettings.EXPORT_CACHE_TTL)
+def defaultExportCacheTTL():
+    return SettingDefault.defaults[PluginSettings.EXPORT_CACHE_TTL]
+
+
+@setting_utilities.default(PluginSettings.DATAONE_BATCH_CHILDREN)
+def defaultDataONEBatchChildren():
+    return SettingDefault.defaults[PluginSettings.DATAONE_BATCH_CHILDREN]
+
+
 @setting_utilities.default(PluginSettings.DATAVERSE_URL)
 def defaultDataverseURL():
     return SettingDefault.defaults[PluginSettings.DATAVERSE_URL]
@@ -459,6 +540,8 @@ def load(info):
     events.bind('jobs.job.update.after', 'wholetale', updateNotification)
     events.bind('model.file.validate', 'wholetale', validateFileLink)
     events.bind('oauth.auth_callback.after', 'wholetale', store_other_globus_tokens)
+    # Share resolved DOIs between all server processes
+    RESOLUTION_CACHE.store = RedirectCache()
     info['apiRoot'].account = Account()
     info['apiRoot'].repository = Repository()
     info['apiRoot'].license = License()
@@ -32,6 +32,11 @@ class PluginSettings:
     EXTERNAL_APIKEY_GROUPS = "wholetale.external_apikey_groups"
     ZENODO_EXTRA_HOSTS = "wholetale.zenodo_extra_hosts"
     PUBLISHER_REPOS = "wholetale.publisher_repositories"
+    EXPORT_HASH_WORKERS = "wholetale.export_hash_workers"
+    EXPORT_COMPRESSION_LEVEL = "wholetale.export_compression_level"
+    EXPORT_CACHE_SIZE = "wholetale.export_cache_size"
+    EXPORT_CACHE_TTL = "wholetale.export_cache_ttl"
+    DATAONE_BATCH_CHILDREN = "wholetale.dataone_batch_children"
 
 
 class SettingDefault:
@@ -107,6 +112,11 @@ class SettingDefault:
                 "name": "DataONE Dev",
             },
         ],
+        PluginSettings.EXPORT_HASH_WORKERS: 0,
+        PluginSettings.EXPORT_COMPRESSION_LEVEL: 0,
+        PluginSettings.EXPORT_CACHE_SIZE: 10 * 1024 ** 3,
+        PluginSettings.EXPORT_CACHE_TTL: 7 * 24 * 3600,
+        PluginSettings.DATAONE_BATCH_CHILDREN: False,
     }
 
 
@@ -157,3 +167,9 @@ class TaleStatus(object):
     PREPARING = 0
     READY = 1
     ERROR = 2
+
+
+class TaleExportStatus(object):
+    BUILDING = 0
+    READY = 1
+    ERROR = 2
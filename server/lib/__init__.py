@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import itertools
 import html2markdown
-from urllib.request import urlopen
+import threading
+from urllib.parse import urlparse
 
 from girder import events, logger
 from girder.constants import AccessType
@@ -11,6 +15,8 @@ from girder.utility.model_importer import ModelImporter
 from girder.utility.progress import ProgressContext
 from .data_map import DataMap
 from .entity import Entity
+from .file_stream import iter_entries, make_cursor, parse_cursor
+from .http_client import SESSION
 from .resolvers import Resolvers, DOIResolver, ResolutionException
 from .import_providers import ImportProviders
 from .http_provider import HTTPImportProvider
@@ -48,61 +54,304 @@ Verificators = {
 }
 
 
-def pids_to_entities(pids, user=None, base_url=None, lookup=True):
+class PidResolutionError(RuntimeError):
+    """
+    Raised when some of the identifiers passed to pids_to_entities failed to resolve.
+
+    :ivar errors: A list of (pid, message) tuples, in input order
+    :ivar results: Results in input order, None for identifiers that failed
+    """
+
+    def __init__(self, errors, results):
+        super().__init__("\n".join(msg for _, msg in errors))
+        self.errors = errors
+        self.results = results
+
+
+class RegistrationError(RuntimeError):
+    """
+    Raised when some of the datasets passed to register_dataMap failed to register.
+
+    :ivar errors: A list of (dataId, message) tuples, in input order
+    :ivar results: Results in input order, None for datasets that failed
+    """
+
+    def __init__(self, errors, results):
+        super().__init__("\n".join(msg for _, msg in errors))
+        self.errors = errors
+        self.results = results
+
+
+class SharedProgress:
+    """Serialize updates of a ProgressContext shared by several threads."""
+
+    def __init__(self, ctx):
+        self._ctx = ctx
+        self._lock = threading.Lock()
+
+    def update(self, *args, **kwargs):
+        with self._lock:
+            return self._ctx.update(*args, **kwargs)
+
+
+class HostLimiter:
+    """Hand out a semaphore per host, bounding concurrent requests to each of them."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    @staticmethod
+    def host(pid):
+        if pid.lower().startswith("doi:"):
+            return "doi.org"
+        return urlparse(pid).netloc.lower()
+
+    def __call__(self, pid):
+        host = self.host(pid)
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.limit)
+            return self._semaphores[host]
+
+
+def _resolve_entity(pid, user, base_url):
+    """Return the resolved Entity of an identifier and its ImportProvider."""
+    entity = Entity(pid.strip(), user)
+    entity["base_url"] = base_url
+    entity = RESOLVERS.resolve(entity)
+    return entity, IMPORT_PROVIDERS.getProvider(entity)
+
+
+def _resolution_error(pid, exc, lookup):
+    if isinstance(exc, ResolutionException):
+        return 'Id "{}" was categorized as DOI, but its resolution failed.'.format(pid)
+    if lookup:
+        msg = 'Lookup for "{}" failed with: {}'
+    else:
+        msg = 'Listing files at "{}" failed with: {}'
+    return msg.format(pid, str(exc))
+
+
+def _resolve_pid(pid, user, base_url, lookup, path=None, depth=None):
+    """Resolve a single identifier, return a (result, error message) tuple."""
+    try:
+        entity, provider = _resolve_entity(pid, user, base_url)
+        if lookup:
+            return provider.lookup(entity).toDict(), None
+        return provider.listFiles(entity, path=path, depth=depth), None
+    except Exception as exc:
+        return None, _resolution_error(pid, exc, lookup)
+
+
+def pids_to_entities(pids, user=None, base_url=None, lookup=True, workers=8, per_host=4,
+                     path=None, depth=None):
     """
     Resolve unique external identifiers into WholeTale Entities or file listings
 
+    Identifiers are resolved concurrently, but no more than `per_host` at a time
+    are sent to the same host. All identifiers are processed even if some fail.
+
     :param pids: list of external identifiers
     :param user: User performing the resolution
     :param base_url: DataONE's node endpoint url
-    :param lookup: If false, a list of remote files is returned instead of Entities
+    :param lookup: If false, FileMaps listing remote files are returned instead of
+        Entities, see FileMap.iterJSON to serialize them
+    :param workers: Maximum number of identifiers resolved at the same time
+    :param per_host: Maximum number of identifiers resolved at the same time per host
+    :param path: Only with lookup=False, list the folder at that path in each
+        dataset, see ImportProvider.listFiles
+    :param depth: Only with lookup=False, maximum depth of the listings
+    :return: List of results in the same order as pids
+    :raises PidResolutionError: If any of the identifiers failed to resolve
     """
-    results = []
-    try:
-        for pid in pids:
-            entity = Entity(pid.strip(), user)
-            entity["base_url"] = base_url
-            entity = RESOLVERS.resolve(entity)
-            provider = IMPORT_PROVIDERS.getProvider(entity)
-            if lookup:
-                results.append(provider.lookup(entity))
-            else:
-                results.append(provider.listFiles(entity))
-    except ResolutionException:
-        msg = 'Id "{}" was categorized as DOI, but its resolution failed.'.format(pid)
-        raise RuntimeError(msg)
-    except Exception as exc:
-        if lookup:
-            msg = 'Lookup for "{}" failed with: {}'
-        else:
-            msg = 'Listing files at "{}" failed with: {}'
-        raise RuntimeError(msg.format(pid, str(exc)))
-    return [x.toDict() for x in results]
+    limiter = HostLimiter(per_host)
+
+    def resolve(pid):
+        with limiter(pid):
+            return _resolve_pid(pid, user, base_url, lookup, path, depth)
+
+    if len(pids) < 2 or workers < 2:
+        outcomes = [resolve(pid) for pid in pids]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(pids))) as executor:
+            outcomes = list(executor.map(resolve, pids))
+
+    errors = [(pid, error) for pid, (_, error) in zip(pids, outcomes) if error]
+    results = [result for result, _ in outcomes]
+    if errors:
+        raise PidResolutionError(errors, results)
+    return results
 
 
-def register_dataMap(dataMaps, parent, parentType, user=None, base_url=None, progress=False):
+def stream_files(pids, user=None, base_url=None, path=None, depth=None, cursor=None,
+                 limit=None):
+    """
+    List files in external datasets one entry at a time, see lib.file_stream
+
+    Unlike pids_to_entities(lookup=False), nothing is kept in memory and entries
+    are generated as the providers list them. A dataset that fails is reported
+    by an {"type": "error", "dataId": ..., "message": ...} entry and the listing
+    continues with the next one.
+
+    :param pids: list of external identifiers
+    :param user: User performing the listing
+    :param base_url: DataONE's node endpoint url
+    :param path: If given, list the folder at that path in each dataset, see
+        ImportProvider.listFiles
+    :param depth: If given, don't list contents of folders nested deeper than that
+    :param cursor: Cursor returned by a previous call with the same arguments, the
+        listing continues from there. The cursor only records how many entries of
+        the dataset were already returned: the dataset is listed again from its
+        start and these entries are skipped, so providers must list in a stable
+        order for the pages to be consistent.
+    :param limit: If given, at most that many entries are generated. If there are
+        more, the last entry is {"type": "cursor", "cursor": ...}. Since each page
+        re-lists what precedes it, paging through a dataset of n entries costs
+        O(n^2 / limit): prefer large limits, or no limit, for large datasets.
+    :raises ValueError: If the cursor is invalid
+    """
+    index, offset = parse_cursor(cursor)
+    count = 0
+    for index in range(index, len(pids)):
+        pid = pids[index]
+        try:
+            entity, provider = _resolve_entity(pid, user, base_url)
+            items = provider.iterFiles(entity, path=path, depth=depth)
+            entries = itertools.islice(iter_entries(items), offset, None)
+            for entry in entries:
+                if limit is not None and count >= limit:
+                    yield {"type": "cursor", "cursor": make_cursor(index, offset)}
+                    return
+                yield entry
+                count += 1
+                offset += 1
+        except Exception as exc:
+            if limit is not None and count >= limit:
+                yield {"type": "cursor", "cursor": make_cursor(index, offset)}
+                return
+            yield {
+                "type": "error", "dataId": pid, "message": _resolution_error(pid, exc, False)
+            }
+            count += 1
+        offset = 0
+
+
+def register_dataMap(dataMaps, parent, parentType, user=None, base_url=None, progress=False,
+                     checkpoint=None, resume=None, workers=1):
     """
     Register a list of Data Maps into a given Girder object
 
+    With more than one worker, the Data Maps are registered concurrently and
+    reported under a single progress notification. A failed registration
+    doesn't stop the other ones.
+
     :param dataMaps: list of dataMaps
     :param parent: A Collection or a Folder where data should be registered
     :param parentType: Either a 'collection' or a 'folder'
     :param user: User performing the registration
     :param base_url: DataONE's node endpoint url
     :param progress: If True, emit 'progress' notification for each registered file.
+    :param checkpoint: If given, called with the state of the registration each
+        time a part of it is committed.
+    :param resume: The last state passed to checkpoint by an interrupted call with
+        the same arguments. The registration is continued from there.
+    :param workers: Maximum number of Data Maps registered at the same time
     :return: List of ids of registered objects
+    :raises RegistrationError: If registering any of the Data Maps failed, when
+        workers > 1
     """
-    importedData = []
-    with ProgressContext(progress, user=user, title="Registering resources") as ctx:
-        for dataMap in DataMap.fromList(dataMaps):
-            # probably would be nicer if Entity kept all details and the dataMap
-            # would be merged into it
-            provider = IMPORT_PROVIDERS.getFromDataMap(dataMap)
-            objType, obj = provider.register(
-                parent, parentType, ctx, user, dataMap, base_url=base_url
-            )
-            importedData.append(obj["_id"])
-    return importedData
+    def register(provider, ctx, dataMap, **kwargs):
+        # probably would be nicer if Entity kept all details and the dataMap
+        # would be merged into it
+        objType, obj = provider.register(
+            parent, parentType, ctx, user, dataMap, base_url=base_url, **kwargs
+        )
+        return obj["_id"]
+
+    return _register_dataMaps(
+        dataMaps, register, "Registering resources", user, progress, checkpoint, resume,
+        workers,
+    )
+
+
+def sync_dataMap(dataMaps, parent, parentType, user=None, base_url=None, progress=False,
+                 prune=False, checkpoint=None, resume=None, workers=1):
+    """
+    Register a list of Data Maps that may have been registered before, writing
+    only the differences between the remote listing and what's registered.
+
+    :param prune: If True, remove files and folders that are no longer listed.
+    :return: List of dicts with the id of each registered object and the summary
+        of changes made to it.
+    """
+    def register(provider, ctx, dataMap, **kwargs):
+        objType, obj, summary = provider.sync(
+            parent, parentType, ctx, user, dataMap, base_url=base_url, prune=prune, **kwargs
+        )
+        return {"_id": obj["_id"], "dataId": dataMap.getDataId(), "changes": summary}
+
+    return _register_dataMaps(
+        dataMaps, register, "Synchronizing resources", user, progress, checkpoint, resume,
+        workers,
+    )
+
+
+def _register_dataMaps(dataMaps, register, title, user, progress, checkpoint, resume,
+                       workers):
+    """
+    Call register for each of the dataMaps, skipping the ones that were done
+    before an interruption, see register_dataMap.
+    """
+    dataMaps = DataMap.fromList(dataMaps)
+    # Results in input order, None for the ones that aren't registered yet, and
+    # the states of registrations in progress keyed by their (string) index
+    results = list(resume["results"]) if resume else []
+    results += [None] * (len(dataMaps) - len(results))
+    current = dict(resume["current"]) if resume else {}
+    lock = threading.Lock()
+
+    def save(index, state):
+        with lock:
+            if state is None:
+                current.pop(str(index), None)
+            else:
+                current[str(index)] = state
+            checkpoint({"results": list(results), "current": dict(current)})
+
+    def run(index):
+        dataMap = dataMaps[index]
+        provider = IMPORT_PROVIDERS.getFromDataMap(dataMap)
+        kwargs = {"resume": current.get(str(index))}
+        if checkpoint is not None:
+            kwargs["checkpoint"] = functools.partial(save, index)
+        results[index] = register(provider, shared, dataMap, **kwargs)
+        if checkpoint is not None:
+            save(index, None)
+
+    pending = [index for index, result in enumerate(results) if result is None]
+    with ProgressContext(progress, user=user, title=title) as ctx:
+        shared = SharedProgress(ctx)
+        if workers < 2 or len(pending) < 2:
+            for index in pending:
+                run(index)
+            return results
+
+        with ThreadPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            futures = [(index, executor.submit(run, index)) for index in pending]
+        errors = []
+        for index, future in futures:
+            exc = future.exception()
+            if exc is not None:
+                dataId = dataMaps[index].getDataId()
+                logger.warning('Registration of "%s" failed', dataId, exc_info=exc)
+                errors.append(
+                    (dataId, 'Registration of "{}" failed with: {}'.format(dataId, exc))
+                )
+        if errors:
+            raise RegistrationError(errors, results)
+    return results
 
 
 def update_citation(event):
@@ -140,9 +389,9 @@ def update_citation(event):
                 "https://api.datacite.org/dois/"
                 "text/x-bibliography/{}?style=harvard-cite-them-right"
             )
-            citations.append(
-                html2markdown.convert(urlopen(url.format(doi)).read().decode())
-            )
+            resp = SESSION.get(url.format(doi))
+            resp.raise_for_status()
+            citations.append(html2markdown.convert(resp.content.decode()))
         except Exception as ex:
             logger.info('Unable to get a citation for %s, getting "%s"', doi, str(ex))
 
@@ -0,0 +1,516 @@
+"""
+Bulk registration of external data.
+
+Registering files one at a time costs an item, a metadata update and a link
+file per file, each a separate Mongo write going through model validation.
+BulkRegistration buffers the ImportItems produced by an ImportProvider and
+writes items and files with one ordered bulk operation per batch, while
+keeping the reuseExisting semantics of the model methods: objects that were
+registered before are updated in place instead of duplicated.
+
+In sync mode, only the differences between the listing and what is already
+registered are written (see BulkRegistration).
+
+Each flush is a commit point: everything listed before it is in the database.
+The state returned by BulkRegistration.state() at that point allows an
+interrupted registration to be resumed with BulkRegistration.resume().
+"""
+import datetime
+import itertools
+
+from bson.objectid import ObjectId
+from pymongo import InsertOne, UpdateOne
+
+from girder import events
+from girder.models.file import File
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.utility.model_importer import ModelImporter
+
+from .folder_size import COUNT_KEY, SIZE_KEY, increment_folder_size
+from .import_item import ImportItem
+
+BATCH_SIZE = 1000
+
+
+def _validate(model, doc):
+    """Run the validation Model.save would, without saving the document."""
+    event = events.trigger('.'.join(('model', model.name, 'validate')), doc)
+    if not event.defaultPrevented:
+        doc = model.validate(doc)
+    return doc
+
+
+def _prepareInsert(model, doc):
+    """
+    Validate doc and trigger the save event Model.save would before inserting
+    it. Returns None if a handler prevented the save.
+    """
+    doc = _validate(model, doc)
+    event = events.trigger('model.%s.save' % model.name, doc)
+    if event.defaultPrevented:
+        return None
+    return doc
+
+
+def _metaUpdate(meta, update=None):
+    """Mongo update equivalent to Model.setMetadata, None values remove keys."""
+    update = {} if update is None else update
+    for key, value in meta.items():
+        if value is None:
+            update.setdefault('$unset', {})['meta.' + key] = ''
+        else:
+            update.setdefault('$set', {})['meta.' + key] = value
+    return update
+
+
+class _Folder:
+    """A folder on the registration stack."""
+
+    def __init__(self, doc, modelType, isNew=False, meta=None):
+        self.doc = doc
+        self.modelType = modelType
+        # Nothing inside a folder created by this registration needs to be looked up
+        self.isNew = isNew
+        self.created = isNew
+        self.meta = meta or {}
+        # [size, count] of files below the folder
+        self.total = [0, 0]
+        # Names of the subfolders and items registered in this folder, items
+        # are None if they aren't all known (after a restore)
+        self.subfolders = set()
+        self.items = set()
+
+    def state(self):
+        return {
+            '_id': self.doc['_id'],
+            'created': self.created,
+            'meta': dict(self.meta),
+            'total': list(self.total),
+            'subfolders': sorted(self.subfolders),
+        }
+
+    @classmethod
+    def restore(cls, state):
+        folder = cls(Folder().load(state['_id'], force=True), 'folder', meta=state['meta'])
+        folder.created = state['created']
+        folder.total = list(state['total'])
+        folder.subfolders = set(state['subfolders'])
+        folder.items = None
+        return folder
+
+
+def _itemKey(item):
+    """What identifies an ImportItem of a listing, as stored in Mongo."""
+    if item is None:
+        return None
+    return [item.type, item.name, item.identifier]
+
+
+def _changed(doc, values):
+    return any(doc.get(key) != value for key, value in values.items())
+
+
+class BulkRegistration:
+    """
+    Register the ImportItems of a dataset below a parent folder or collection.
+
+    Folders are created as they are listed, so that their ids are known, while
+    items and files are written batchSize at a time. Metadata and size rollups
+    of folders are written once, with the first batch after they are closed.
+
+    With sync, objects that were registered before are compared with the
+    listing by identifier, size and url, and only written if they changed.
+    With prune, items and folders of the dataset that are no longer listed are
+    removed too. The changes are counted in `summary`.
+
+    If given, checkpoint is called with the state of the registration after
+    each commit, see resume().
+    """
+
+    def __init__(self, provider, parent, parentType, user, batchSize=BATCH_SIZE,
+                 sync=False, prune=False, checkpoint=None):
+        self.provider = provider
+        self.parentType = parentType
+        self.user = user
+        self.batchSize = batchSize
+        self.sync = sync
+        self.prune = prune
+        self.checkpoint = checkpoint
+        # Number of ImportItems added so far, and the last of them
+        self.position = 0
+        self._lastKey = None
+        self.summary = dict.fromkeys(
+            ('added', 'updated', 'unchanged', 'removed', 'foldersAdded', 'foldersRemoved'), 0
+        )
+        self.stack = [_Folder(parent, parentType)]
+        self.rootObj = None
+        self.rootType = None
+        self.rootTotal = (0, 0)
+        # Rollup of the root before this registration, if it was registered before
+        self.previous = (0, 0)
+        self._rootFile = None
+        self._pending = []
+        self._folderUpdates = []
+        self._folderSizes = {}
+        self._baseSizes = {}
+        # (model, doc) inserted by the pending bulk writes, see _prepareInsert
+        self._created = []
+
+    @property
+    def creatorId(self):
+        return self.user['_id'] if self.user else None
+
+    def state(self):
+        """
+        Return the state of the registration after the last commit.
+
+        The state is a plain document, suitable to be stored in Mongo.
+        """
+        return {
+            'position': self.position,
+            'last': self._lastKey,
+            'rootType': self.rootType,
+            'rootId': None if self.rootObj is None else self.rootObj['_id'],
+            'rootTotal': list(self.rootTotal),
+            'previous': list(self.previous),
+            'summary': dict(self.summary),
+            'stack': [folder.state() for folder in self.stack[1:]],
+        }
+
+    def resume(self, listing, state):
+        """
+        Continue a registration interrupted after a commit.
+
+        The items of listing committed before state was saved are consumed,
+        and if the last of them is the one recorded in state, the registration
+        is restored so that the rest of listing can be added. Otherwise the
+        listing changed since the interruption and nothing is restored: the
+        registration has to start over with a new listing.
+
+        :return: Whether the registration was restored.
+        """
+        last = None
+        for last in itertools.islice(listing, state['position']):
+            pass
+        if _itemKey(last) != state.get('last', False):
+            return False
+        self.restore(state)
+        return True
+
+    def restore(self, state):
+        """Restore the state of a registration, see resume()."""
+        self.position = state['position']
+        self._lastKey = state['last']
+        self.rootType = state['rootType']
+        if state['rootId'] is not None:
+            model = Folder() if self.rootType == 'folder' else Item()
+            self.rootObj = model.load(state['rootId'], force=True)
+        self.rootTotal = tuple(state['rootTotal'])
+        self.previous = tuple(state['previous'])
+        self.summary.update(state['summary'])
+        self.stack[1:] = [_Folder.restore(folder) for folder in state['stack']]
+
+    def add(self, item: ImportItem):
+        self.position += 1
+        self._lastKey = _itemKey(item)
+        if item.type == ImportItem.FOLDER:
+            folder = self._openFolder(item)
+            if self.rootType is None:
+                self.rootObj, self.rootType = folder.doc, 'folder'
+                meta = folder.doc['meta']
+                self.previous = (meta.get(SIZE_KEY, 0), meta.get(COUNT_KEY, 0))
+        elif item.type == ImportItem.END_FOLDER:
+            self._closeFolder()
+        elif item.type == ImportItem.FILE:
+            if self.rootType is None:
+                self._rootFile, self.rootType = item, 'item'
+            self._pending.append((self.stack[-1], item))
+            if self.prune and self.stack[-1].items is not None:
+                self.stack[-1].items.add(item.name)
+            for folder in self.stack[1:]:
+                folder.total[0] += max(item.size or 0, 0)
+                folder.total[1] += 1
+            if len(self._pending) >= self.batchSize:
+                self.flush()
+        else:
+            raise Exception('Unknown import item type: %s' % item.type)
+
+    def finish(self):
+        """Write everything that is still buffered and return the root object."""
+        self.flush()
+        if self.parentType == 'folder' and self.rootType == 'folder':
+            increment_folder_size(
+                self.stack[0].doc,
+                self.rootTotal[0] - self.previous[0],
+                self.rootTotal[1] - self.previous[1],
+            )
+        return self.rootType, self.rootObj
+
+    def _openFolder(self, item):
+        parent = self.stack[-1]
+        # Concurrent registrations may create the same folder, reuse theirs
+        now = datetime.datetime.utcnow()
+        doc = Folder().createFolder(parent.doc, item.name, description='',
+                                    parentType=parent.modelType, creator=self.user,
+                                    reuseExisting=True)
+        isNew = doc['created'] >= now
+        if isNew:
+            self.summary['foldersAdded'] += 1
+        meta = {
+            "identifier": item.identifier,
+            "provider": self.provider.getName(),
+        }
+        if item.meta:
+            meta.update(item.meta)
+        folder = _Folder(doc, 'folder', isNew=isNew, meta=meta)
+        parent.subfolders.add(doc['name'])
+        self.stack.append(folder)
+        return folder
+
+    def _closeFolder(self):
+        folder = self.stack.pop()
+        size, count = folder.total
+        meta = dict(folder.meta)
+        meta.update({SIZE_KEY: size, COUNT_KEY: count})
+        Folder().validateKeys(meta)
+        folder.doc.setdefault('meta', {})
+        if not self.sync or _changed(folder.doc['meta'], meta):
+            folder.doc['updated'] = datetime.datetime.utcnow()
+            self._folderUpdates.append(UpdateOne(
+                {'_id': folder.doc['_id']},
+                _metaUpdate(meta, {'$set': {'updated': folder.doc['updated']}})))
+        folder.doc['meta'].update(meta)
+        if len(self.stack) == 1:
+            self.rootTotal = (size, count)
+        if self.prune and not folder.created:
+            self._pruneFolder(folder)
+
+    def _pruneFolder(self, folder):
+        """Remove what's in a folder but wasn't listed."""
+        if folder.items is not None:
+            for doc in Item().find({'folderId': folder.doc['_id'],
+                                    'name': {'$nin': list(folder.items)}}):
+                Item().remove(doc)
+                self.summary['removed'] += 1
+        for doc in Folder().find({'parentId': folder.doc['_id'], 'parentCollection': 'folder',
+                                  'name': {'$nin': list(folder.subfolders)}}):
+            Folder().remove(doc)
+            self.summary['foldersRemoved'] += 1
+
+    def flush(self):
+        """Write the buffered items, their files and the closed folders."""
+        pending, self._pending = self._pending, []
+        batches = {}
+        for folder, item in pending:
+            batches.setdefault(id(folder), (folder, []))[1].append(item)
+
+        itemOps = []
+        fileOps = []
+        for folder, items in batches.values():
+            self._flushFolder(folder, items, itemOps, fileOps)
+        if itemOps:
+            Item().collection.bulk_write(itemOps, ordered=True)
+        if fileOps:
+            File().collection.bulk_write(fileOps, ordered=True)
+        created, self._created = self._created, []
+        for model, doc in created:
+            events.trigger('model.%s.save.created' % model.name, doc)
+            events.trigger('model.%s.save.after' % model.name, doc)
+
+        ops = self._folderUpdates + [
+            UpdateOne({'_id': folderId}, {'$inc': {'size': size}})
+            for folderId, size in self._folderSizes.items() if size
+        ]
+        if ops:
+            Folder().collection.bulk_write(ops, ordered=True)
+        self._folderUpdates = []
+        self._folderSizes = {}
+        for (modelType, docId), size in self._baseSizes.items():
+            if size:
+                ModelImporter.model(modelType).increment(
+                    query={'_id': docId}, field='size', amount=size, multi=False)
+        self._baseSizes = {}
+
+        if self.checkpoint is not None:
+            self.checkpoint(self.state())
+
+    def _flushFolder(self, folder, entries, itemOps, fileOps):
+        existing, files, taken = self._lookupExisting(folder, entries)
+        # Later batches may contain names from this one
+        folder.isNew = False
+
+        now = datetime.datetime.utcnow()
+        # Objects inserted by this batch are written with their final state
+        inserted = set()
+        sizes = {}
+        for entry in entries:
+            name = entry.name
+            if not name or name != name.strip() or (name in taken and name not in existing):
+                # Item.validate would rename or reject it, let the model handle it
+                self._registerFallback(folder, entry, now)
+                continue
+
+            gitem, status = self._upsertItem(folder.doc, entry, existing, inserted, itemOps, now)
+            if gitem is None:
+                # A model.item.save handler prevented it
+                continue
+            self._setRootFile(entry, gitem)
+            changed, delta = self._upsertFile(gitem, entry, files, inserted, fileOps, now)
+            if status == 'unchanged' and changed:
+                status = 'updated'
+            if status is not None:
+                self.summary[status] += 1
+            self._propagateSize(folder.doc, gitem, delta, inserted, sizes)
+
+        itemOps += [UpdateOne({'_id': itemId}, {'$inc': {'size': size}})
+                    for itemId, size in sizes.items()]
+
+    def _lookupExisting(self, folder, entries):
+        """
+        Return the items of folder named after entries, keyed by name, their
+        files keyed by (itemId, name) and names items can't take.
+        """
+        existing = {}
+        files = {}
+        taken = set(folder.subfolders)
+        if folder.isNew:
+            return existing, files, taken
+        parent = folder.doc
+        names = list({entry.name for entry in entries})
+        existing = {
+            doc['name']: doc for doc in Item().find(
+                {'folderId': parent['_id'], 'name': {'$in': names}})
+        }
+        taken.update(doc['name'] for doc in Folder().find(
+            {'parentId': parent['_id'], 'parentCollection': 'folder',
+             'name': {'$in': names}}, fields=['name']))
+        if existing:
+            files = {
+                (doc['itemId'], doc['name']): doc for doc in File().find(
+                    {'itemId': {'$in': [doc['_id'] for doc in existing.values()]}})
+            }
+        return existing, files, taken
+
+    def _registerFallback(self, folder, entry, now):
+        """Register a file through the models, one write at a time."""
+        if entry.name:
+            # Item.validate strips it anyway, stripping first lets reuseExisting match
+            entry.name = entry.name.strip()
+        gitem, _ = self.provider._registerFile([(folder.doc, 'folder')], entry, self.user)
+        self._setRootFile(entry, gitem)
+        if folder.items is not None:
+            folder.items.add(gitem['name'])
+        self.summary['added' if gitem['created'] >= now else 'updated'] += 1
+
+    def _upsertItem(self, parent, entry, existing, inserted, itemOps, now):
+        """
+        Queue the insert or metadata update of the item of entry.
+
+        Returns the item and its status: 'added', 'updated', 'unchanged' or
+        None if it was already counted in this batch. The item is None if its
+        insertion was prevented.
+        """
+        name = entry.name
+        meta = {'provider': self.provider.getName()}
+        if entry.identifier:
+            meta['identifier'] = entry.identifier
+        if entry.meta:
+            meta.update(entry.meta)
+        Item().validateKeys(meta)
+
+        gitem = existing.get(name)
+        if gitem is None:
+            gitem = {
+                '_id': ObjectId(),
+                'name': name,
+                'lowerName': name.lower(),
+                'description': '',
+                'folderId': parent['_id'],
+                'creatorId': self.creatorId,
+                'baseParentType': parent['baseParentType'],
+                'baseParentId': parent['baseParentId'],
+                'created': now,
+                'updated': now,
+                'size': 0,
+                'meta': {k: v for k, v in meta.items() if v is not None},
+            }
+            gitem = _prepareInsert(Item(), gitem)
+            if gitem is None:
+                return None, None
+            itemOps.append(InsertOne(gitem))
+            self._created.append((Item(), gitem))
+            inserted.add(gitem['_id'])
+            # Duplicated names end up in the same item, as with reuseExisting
+            existing[name] = gitem
+            return gitem, 'added'
+
+        if gitem['_id'] in inserted:
+            gitem['meta'].update(meta)
+            gitem['meta'] = {k: v for k, v in gitem['meta'].items() if v is not None}
+            return gitem, None
+
+        status = 'updated' if _changed(gitem['meta'], meta) else 'unchanged'
+        if status == 'updated' or not self.sync:
+            # As Item().setMetadata
+            gitem['updated'] = now
+            itemOps.append(UpdateOne(
+                {'_id': gitem['_id']}, _metaUpdate(meta, {'$set': {'updated': now}})))
+        gitem['meta'].update(meta)
+        return gitem, status
+
+    def _upsertFile(self, gitem, entry, files, inserted, fileOps, now):
+        """
+        Queue the insert or update of the link file of entry.
+
+        Returns whether the file was added or changed, and its size change.
+        """
+        name = entry.name
+        fields = {'creatorId': self.creatorId, 'mimeType': entry.mimeType,
+                  'linkUrl': entry.url}
+        if entry.size is not None:
+            fields['size'] = int(entry.size)
+        fileObj = files.get((gitem['_id'], name))
+        if fileObj is None:
+            fileObj = dict(fields, _id=ObjectId(), created=now, itemId=gitem['_id'],
+                           assetstoreId=None, name=name)
+            fileObj = _prepareInsert(File(), fileObj)
+            if fileObj is None:
+                return False, 0
+            fileOps.append(InsertOne(fileObj))
+            self._created.append((File(), fileObj))
+            inserted.add(fileObj['_id'])
+            files[(gitem['_id'], name)] = fileObj
+            return True, max(fileObj.get('size') or 0, 0)
+
+        if self.sync and not _changed(
+            fileObj, {k: v for k, v in fields.items() if k != 'creatorId'}
+        ):
+            return False, 0
+
+        changed = _changed(fileObj, fields)
+        previous = max(fileObj.get('size') or 0, 0)
+        fileObj.update(fields, updated=now)
+        fileObj = _validate(File(), fileObj)
+        if fileObj['_id'] not in inserted:
+            fileOps.append(UpdateOne({'_id': fileObj['_id']}, {'$set': {
+                key: fileObj[key] for key in list(fields) + ['updated', 'exts']
+                if key in fileObj
+            }}))
+        return changed, max(fileObj.get('size') or 0, 0) - previous
+
+    def _propagateSize(self, parent, gitem, delta, inserted, sizes):
+        """Same propagation as File().propagateSizeChange, deferred to the flush."""
+        if not delta:
+            return
+        if gitem['_id'] not in inserted:
+            sizes[gitem['_id']] = sizes.get(gitem['_id'], 0) + delta
+        gitem['size'] = gitem.get('size', 0) + delta
+        self._folderSizes[parent['_id']] = self._folderSizes.get(parent['_id'], 0) + delta
+        base = (parent['baseParentType'], parent['baseParentId'])
+        self._baseSizes[base] = self._baseSizes.get(base, 0) + delta
+
+    def _setRootFile(self, entry, gitem):
+        if entry is self._rootFile:
+            self.rootObj = gitem
+            self._rootFile = None
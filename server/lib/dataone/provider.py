@@ -2,21 +2,23 @@ from girder import logger
 from girder.api.rest import RestException
 from girder.constants import AccessType
 from girder.models.folder import Folder
+from girder.models.setting import Setting
 
 from . import DataONELocations
+from ...constants import PluginSettings
 from ..import_providers import ImportProvider
 from ..data_map import DataMap
 from ..file_map import FileMap
+from ..file_stream import select_items
 from ..import_item import ImportItem
 from ..entity import Entity
 from .register import \
     D1_lookup, \
-    extract_metadata_docs, \
     get_documents, \
+    get_documents_batch, \
+    get_package_tree, \
     get_package_pid, \
     get_package_list, \
-    extract_data_docs, \
-    extract_resource_docs, \
     check_multiple_metadata
 
 
@@ -44,10 +46,24 @@ class DataOneImportProvider(ImportProvider):
         dm.setRepository(self.getName())
         return dm
 
-    def listFiles(self, entity: Entity) -> FileMap:
-        result = get_package_list(entity.getValue(), entity['base_url'])
+    def listFiles(self, entity: Entity, path: list = None, depth: int = None) -> FileMap:
+        if path or depth is not None:
+            return super().listFiles(entity, path=path, depth=depth)
+        result = get_package_list(entity.getValue(), entity['base_url'],
+                                  batched=self._batchChildren())
         return FileMap.fromDict(result)
 
+    def iterFiles(self, entity: Entity, path: list = None, depth: int = None):
+        base_url = entity['base_url']
+        pid = get_package_pid(entity.getValue(), base_url)
+        if depth is not None:
+            # Nested packages below the listed folder are not fetched
+            depth += len(path or [])
+        items = self._listRecursive(entity.getUser(), pid, None, base_url=base_url, depth=depth)
+        if path:
+            items = select_items(items, path)
+        return items
+
     def getDatasetUID(self, doc: object, user: object) -> str:
         if 'folderId' in doc:
             # It's an item, grab the parent which should contain all the info
@@ -55,63 +71,136 @@ class DataOneImportProvider(ImportProvider):
         # obj is a folder at this point use its meta
         return doc['meta']['identifier']
 
+    @staticmethod
+    def _batchChildren():
+        return Setting().get(PluginSettings.DATAONE_BATCH_CHILDREN)
+
+    # Data files listed before the documenting metadata are buffered. Documents from
+    # the index (see register.get_documents) list metadata before data, so more than
+    # a page of them means there's no documenting metadata at all.
+    max_pending = 1000
+
     def _listRecursive(self, user, pid: str, name: str, base_url: str = DataONELocations.prod_cn,
-                       progress=None):
-        """Create a package description (Dict) suitable for dumping to JSON."""
+                       progress=None, docs=None, tree=None, depth=None):
+        """
+        Create a package description (Dict) suitable for dumping to JSON.
+
+        When the dataone_batch_children setting is enabled, the documents of all the
+        nested packages are fetched upfront, a tree level at a time, and passed down
+        in `tree` instead of being queried for each child package. This saves round
+        trips, but the documents of the whole tree are then held in memory and
+        nothing below the top package is listed before all of them were fetched,
+        which is why it's off by default.
+        With `depth`, packages nested deeper than that are listed as empty folders.
+        """
         if progress:
             progress.update(increment=1, message='Processing package {}.'.format(pid))
 
         # query for things in the resource map. At this point, it is assumed that the pid
         # has been correctly identified by the user in the UI.
+        if docs is None:
+            docs = get_documents(pid, base_url)
+        metadata = []
+        children = []
+        primary = yield from self._listPackage(pid, name, docs, base_url, metadata, children)
+
+        # Metadata objects that aren't the main or documenting one are added as files
+        for fileObj in metadata:
+            if fileObj is not primary:
+                yield self._fileItem(fileObj)
+
+        yield from self._listChildren(user, children, base_url, progress, tree, depth)
+        yield ImportItem(ImportItem.END_FOLDER)
+        logger.debug('Finished registering dataset')
 
-        docs = get_documents(pid, base_url)
-
-        # Filter the Solr result by TYPE so we can construct the package
-        metadata = extract_metadata_docs(docs)
-        data = extract_data_docs(docs)
-        children = extract_resource_docs(docs)
-
-        # Add in URLs to resolve each metadata/data object by
-        self._addResolutionUrls(metadata, base_url)
-        self._addResolutionUrls(data, base_url)
-
-        # Determine the folder name. This is usually the title of the metadata file
-        # in the package but when there are multiple metadata files in the package,
-        # we need to figure out which one is the 'main' or 'documenting' one.
-        primary_metadata = [doc for doc in metadata if 'documents' in doc]
-
-        check_multiple_metadata(primary_metadata)
-
-        # Create a Dict to store folders' information
-        # the data key is a concatenation of the data and any metadata objects
-        # that aren't the main or documenting metadata
-
-        data += [doc for doc in metadata
-                 if doc['identifier'] != primary_metadata[0]['identifier']]
-        if not name:
-            name = primary_metadata[0]['title']
-
-        yield ImportItem(ImportItem.FOLDER, name, identifier=primary_metadata[0]['identifier'])
-
-        for fileObj in data:
-            try:
-                fileName = fileObj['fileName']
-            except KeyError:
-                fileName = fileObj['identifier']
-
-            yield ImportItem(ImportItem.FILE, fileName, identifier=fileObj['identifier'],
-                             url=fileObj['url'], size=int(fileObj['size']),
-                             mimeType=fileObj['formatId'])
+    def _listPackage(self, pid, name, docs, base_url, metadata, children):
+        """
+        Yield the folder of a package and its data files as documents are streamed.
 
-        # Recurse and add child packages if any exist
-        if children is not None and len(children) > 0:
+        Data files are yielded once the folder they belong to is known. Metadata
+        and resource maps of child packages are collected in `metadata` and
+        `children`. Returns the documenting metadata.
+        """
+        pending = []
+        documenting = []
+        for doc in docs:
+            formatType = doc.get('formatType')
+            if formatType == 'RESOURCE':
+                children.append(doc)
+                continue
+            elif formatType not in ('METADATA', 'DATA'):
+                continue
+
+            # Add in URLs to resolve each metadata/data object by
+            self._addResolutionUrls([doc], base_url)
+            if formatType == 'DATA':
+                if documenting:
+                    yield self._fileItem(doc)
+                elif len(pending) < self.max_pending:
+                    pending.append(doc)
+                else:
+                    break
+                continue
+
+            metadata.append(doc)
+            # Determine the folder name. This is usually the title of the metadata file
+            # in the package but when there are multiple metadata files in the package,
+            # we need to figure out which one is the 'main' or 'documenting' one.
+            if 'documents' not in doc:
+                continue
+            documenting.append(doc)
+            check_multiple_metadata(documenting)
+            yield ImportItem(ImportItem.FOLDER, name or doc['title'],
+                             identifier=doc['identifier'])
+            for fileObj in pending:
+                yield self._fileItem(fileObj)
+            pending = []
+
+        if not documenting:
+            raise RestException('No documenting metadata object found in {}.'.format(pid))
+        return documenting[0]
+
+    def _listChildren(self, user, children, base_url, progress, tree, depth):
+        """Recurse into child packages, listed as empty folders below `depth`."""
+        if not children:
+            return
+        if depth == 0:
+            # Only the names of the child packages are needed, fetch them all at once
+            childDocs = get_documents_batch([child['identifier'] for child in children],
+                                            base_url)
             for child in children:
-                logger.debug('Registering child package, {}'.format(child['identifier']))
-                yield from self._listRecursive(
-                    user, child['identifier'], None, base_url=base_url, progress=progress)
+                yield ImportItem(ImportItem.FOLDER, self._packageName(
+                    child['identifier'], childDocs[child['identifier']]))
+                yield ImportItem(ImportItem.END_FOLDER)
+            return
+
+        if tree is None and self._batchChildren():
+            tree = get_package_tree([child['identifier'] for child in children], base_url)
+        for child in children:
+            logger.debug('Registering child package, {}'.format(child['identifier']))
+            yield from self._listRecursive(
+                user, child['identifier'], None, base_url=base_url, progress=progress,
+                docs=None if tree is None else tree.get(child['identifier'], []),
+                tree=tree, depth=None if depth is None else depth - 1)
+
+    @staticmethod
+    def _packageName(pid, docs):
+        """Title of the documenting metadata of a package, see _listRecursive."""
+        for doc in docs:
+            if doc.get('formatType') == 'METADATA' and 'documents' in doc:
+                return doc['title']
+        raise RestException('No documenting metadata object found in {}.'.format(pid))
+
+    @staticmethod
+    def _fileItem(fileObj):
+        try:
+            fileName = fileObj['fileName']
+        except KeyError:
+            fileName = fileObj['identifier']
 
-        yield ImportItem(ImportItem.END_FOLDER)
-        logger.debug('Finished registering dataset')
+        return ImportItem(ImportItem.FILE, fileName, identifier=fileObj['identifier'],
+                          url=fileObj['url'], size=int(fileObj['size']),
+                          mimeType=fileObj['formatId'])
 
     def _addResolutionUrls(self, docs, base_url):
         """
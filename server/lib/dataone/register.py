@@ -6,29 +6,25 @@ Code for querying DataONE and verifying query results. Specifically used for
 import re
 import json
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 
 from girder import logger
 from girder.api.rest import RestException
 from . import DataONELocations
 from ...utils import esc
 from ..data_map import DataMap
+from ..http_client import SESSION
 
+# Number of resource maps queried at once and concurrent queries used when
+# fetching the documents of child packages, see get_package_tree
+CHILD_BATCH_SIZE = 50
+CHILD_WORKERS = 4
+DOCUMENT_FIELDS = ["identifier", "formatType", "title", "size", "formatId",
+                   "fileName", "documents"]
 
-def query(q,
-          base_url=DataONELocations.prod_cn,
-          fields=None,
-          rows=1000,
-          start=0):
-    """
-    Query a DataONE Solr index.
-    :param q: The query
-    :param base_url: The URL to the coordinating node
-    :param fields: The field to search for
-    :param rows: Number of rows to return
-    :param start: Which row to start at
-    :return: The content of the response
-    """
 
+def _query_url(q, base_url, fields, rows, start=0, sort=None, cursor=None):
     """
     Create the query section of the url. Note that the DataONE Python library
      has functionality for solr queries. If time permits or if errors occur
@@ -37,11 +33,17 @@ def query(q,
     if fields is None:
         fields = ["identifier"]
     fl = ",".join(fields)
-    query_url = "{}/query/solr/?q={}&fl={}&rows={}&start={}&wt=json".format(
-        base_url, q, fl, rows, start)
+    if cursor is None:
+        return "{}/query/solr/?q={}&fl={}&rows={}&start={}&wt=json".format(
+            base_url, q, fl, rows, start)
+    # cursorMark values are opaque base64 strings, they have to be escaped
+    return "{}/query/solr/?q={}&fl={}&rows={}&sort={}&cursorMark={}&wt=json".format(
+        base_url, q, fl, rows, sort.replace(' ', '+'), quote(cursor, safe=''))
 
+
+def _solr_get(query_url):
     try:
-        req = requests.get(query_url)
+        req = SESSION.get(query_url)
         req.raise_for_status()
     except requests.exceptions.HTTPError as e:
         raise RestException(e)
@@ -52,17 +54,78 @@ def query(q,
         raise RestException(
             "Solr query was not successful.\n{}\n{}".format(query_url, content))
 
-    # Stop if the number of results is equal to the number of rows requested
-    # Fix this in the future by supporting paginated queries.
+    if 'response' not in content or 'docs' not in content['response']:
+        raise RestException(
+            "Failed to get a result for the query\n {}".format(content))
+
+    return content
+
+
+def query(q,
+          base_url=DataONELocations.prod_cn,
+          fields=None,
+          rows=1000,
+          start=0):
+    """
+    Query a DataONE Solr index.
+    :param q: The query
+    :param base_url: The URL to the coordinating node
+    :param fields: The field to search for
+    :param rows: Number of rows to return
+    :param start: Which row to start at
+    :return: The content of the response
+    """
+    content = _solr_get(_query_url(q, base_url, fields, rows, start=start))
+
+    # Stop if the number of results is equal to the number of rows requested,
+    # queries that may return more results should use iter_query instead.
     if content['response']['numFound'] == rows:
         raise RestException(
             "Number of results returned equals number of rows requested. "
-            "This could mean the query result is truncated. "
-            "Implement paged queries.")
+            "This could mean the query result is truncated.")
 
     return content
 
 
+def iter_query(q,
+               base_url=DataONELocations.prod_cn,
+               fields=None,
+               rows=1000,
+               sort='id asc'):
+    """
+    Iterate over all the documents matching a query to a DataONE Solr index.
+
+    Results are paged through with Solr's cursorMark from the first request,
+    which stays cheap deep into the result set and isn't affected by documents
+    being indexed meanwhile. Results fitting in a single page take a single
+    request. Only a single page of documents is held in memory at a time.
+
+    :param q: The query
+    :param base_url: The URL to the coordinating node
+    :param fields: The fields to return
+    :param rows: Number of documents fetched per request
+    :param sort: Sort order of the results, it has to end with the uniqueKey of
+        the index (id)
+    :return: A generator of documents
+    """
+    if fields is None:
+        fields = ["identifier"]
+    cursor = '*'
+    count = 0
+    while True:
+        content = _solr_get(
+            _query_url(q, base_url, fields, rows, sort=sort, cursor=cursor))
+        docs = content['response']['docs']
+        yield from docs
+        count += len(docs)
+        if not docs or count >= int(content['response']['numFound']):
+            break
+        next_cursor = content.get('nextCursorMark')
+        if next_cursor is None or next_cursor == cursor:
+            break
+        cursor = next_cursor
+
+
 def find_resource_pid(pid, base_url):
     """
     Find the PID of the resource map for a given PID, which may be a resource map.
@@ -148,15 +211,15 @@ def find_nonobsolete_resmaps(pids, base_url):
     :return:
     """
 
-    result = query(
-        "identifier:(\"{}\")+AND+-obsoletedBy:*".format("\" OR \"".join(pids))
-    )
-    result_len = int(result['response']['numFound'])
+    nonobs = [
+        doc['identifier'] for doc in iter_query(
+            "identifier:(\"{}\")+AND+-obsoletedBy:*".format("\" OR \"".join(pids)))
+    ]
 
-    if result_len == 0:
+    if not nonobs:
         raise RestException('No results were found for identifier(s): {}.'.format(", ".join(pids)))
 
-    return [doc['identifier'] for doc in result['response']['docs']]
+    return nonobs
 
 
 def find_initial_pid(path):
@@ -243,39 +306,104 @@ def D1_lookup(path, base_url):
     """
 
     package_pid = get_package_pid(path, base_url)
-    docs = get_documents(package_pid, base_url)
 
-    if not docs:
+    # Compute package size (sum of 'size' values) and find the first metadata
+    # document in a single pass over the package
+    found = False
+    metadata = None
+    total_size = 0
+    for doc in get_documents(package_pid, base_url):
+        found = True
+        total_size += int(doc.get('size', 0))
+        if metadata is None and doc.get('formatType') == 'METADATA':
+            metadata = doc
+
+    if not found:
         raise RestException('Failed to find any documents in the provided package')
-    # Filter the Solr result by TYPE so we can construct the package
-    metadata = [doc for doc in docs if doc.get('formatType') == 'METADATA']
-    if not metadata:
+    if metadata is None:
         raise RestException('No metadata found.')
 
-    # Compute package size (sum of 'size' values)
-    total_size = sum([int(doc.get('size', 0)) for doc in docs])
-
-    return DataMap(package_pid, total_size, name=metadata[0].get('title', 'no title'),
-                   doi=metadata[0].get('identifier', 'no DOI'),
+    return DataMap(package_pid, total_size, name=metadata.get('title', 'no title'),
+                   doi=metadata.get('identifier', 'no DOI'),
                    repository='DataONE')
 
 
 def get_documents(package_pid, base_url):
     """
-    Retrieve a list of all the files in a data package. The metadata
+    Iterate over all the files in a data package. The metadata
     record providing information about the package is also in this list.
+
+    Documents are streamed from the index, so callers that need them more than
+    once have to keep them. Resource maps and metadata are returned before
+    the data files.
     """
 
-    result = query(q='resourceMap:"{}"'.format(esc(package_pid)),
-                   fields=["identifier", "formatType", "title", "size", "formatId",
-                           "fileName", "documents"],
-                   base_url=base_url)
+    return iter_query(q='resourceMap:"{}"'.format(esc(package_pid)),
+                      fields=DOCUMENT_FIELDS,
+                      base_url=base_url,
+                      sort='formatType desc,id asc')
 
-    if 'response' not in result or 'docs' not in result['response']:
-        raise RestException(
-            "Failed to get a result for the query\n {}".format(result))
 
-    return result['response']['docs']
+def get_documents_batch(package_pids, base_url, batch_size=CHILD_BATCH_SIZE,
+                        workers=CHILD_WORKERS):
+    """
+    Retrieve the documents of several data packages at once.
+
+    Packages are looked up `batch_size` at a time with a single OR query,
+    batches are fetched concurrently.
+    :return: A dict mapping each package pid to the list of its documents
+    """
+    package_pids = list(package_pids)
+    result = {pid: [] for pid in package_pids}
+
+    def fetch(batch):
+        q = 'resourceMap:({})'.format(
+            " OR ".join('"{}"'.format(esc(pid)) for pid in batch))
+        return list(iter_query(q=q, fields=DOCUMENT_FIELDS + ["resourceMap"],
+                               base_url=base_url, sort='formatType desc,id asc'))
+
+    batches = [package_pids[i:i + batch_size]
+               for i in range(0, len(package_pids), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches)))) as executor:
+        for docs in executor.map(fetch, batches):
+            for doc in docs:
+                # An object can be aggregated by more than one of the packages
+                for pid in doc.pop('resourceMap', []):
+                    if pid in result:
+                        result[pid].append(doc)
+    return result
+
+
+def get_package_tree(package_pids, base_url, resolve=False, workers=CHILD_WORKERS, **kwargs):
+    """
+    Retrieve the documents of packages and of all the packages nested in them.
+
+    Instead of one query per package, the child resource maps of a whole tree
+    level are collected and fetched together with get_documents_batch.
+    :param package_pids: The pids of the resource maps at the top of the tree
+    :param resolve: If True, the documents of each package are the ones of
+        get_package_pid(pid), e.g. the current version of an obsoleted resource
+        map, as get_package_list does when fetching packages one by one.
+    :return: A dict mapping each package pid to the list of its documents
+    """
+    tree = {}
+    level = list(dict.fromkeys(package_pids))
+    while level:
+        resolved = dict(zip(level, level))
+        if resolve:
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(level)))) as executor:
+                resolved = dict(zip(level, executor.map(
+                    lambda pid: get_package_pid(pid, base_url), level)))
+        docs = get_documents_batch(
+            dict.fromkeys(resolved.values()), base_url, workers=workers, **kwargs)
+        for pid in level:
+            tree[pid] = docs[resolved[pid]]
+        level = list(dict.fromkeys(
+            doc['identifier'] for pid in level
+            for doc in extract_resource_docs(tree[pid])
+            if doc['identifier'] not in tree
+        ))
+    return tree
 
 
 def check_multiple_maps(documenting):
@@ -293,13 +421,15 @@ def check_multiple_metadata(metadata):
                             "This is unexpected and unhandled.")
 
 
-def get_package_list(path, base_url, package=None, isChild=False):
+def get_package_list(path, base_url, package=None, isChild=False, batched=False):
     """
 
     :param path: The path to a package
     :param base_url: The node endpoint
     :param package: Holds the information about the package
     :param isChild: A bool set when the package has a parent
+    :param batched: Fetch the child packages a tree level at a time (see
+        get_package_tree) instead of one by one
     :return:
     """
 
@@ -308,8 +438,17 @@ def get_package_list(path, base_url, package=None, isChild=False):
 
     package_pid = get_package_pid(path, base_url)
 
-    docs = get_documents(package_pid, base_url)
+    docs = list(get_documents(package_pid, base_url))
+    tree = None
+    if batched:
+        tree = get_package_tree(
+            [doc['identifier'] for doc in extract_resource_docs(docs)], base_url,
+            resolve=True)
+    _add_package_list(docs, base_url, package, tree=tree)
+    return package
+
 
+def _add_package_list(docs, base_url, package, tree=None):
     # Filter the Solr result by TYPE so we can construct the package
     metadata = extract_metadata_docs(docs)
     data = extract_data_docs(docs)
@@ -335,11 +474,13 @@ def get_package_list(path, base_url, package=None, isChild=False):
     package[primary_metadata[0]['title']]['fileList'].append(fileList)
     if children is not None and len(children) > 0:
         for child in children:
-            get_package_list(child['identifier'],
-                             base_url=base_url,
-                             package=package[primary_metadata[0]['title']],
-                             isChild=True)
-    return package
+            if tree is None:
+                child_docs = list(get_documents(
+                    get_package_pid(child['identifier'], base_url), base_url))
+            else:
+                child_docs = tree.get(child['identifier'], [])
+            _add_package_list(child_docs, base_url,
+                              package=package[primary_metadata[0]['title']], tree=tree)
 
 
 def get_package_files(data, metadata, primary_metadata):
@@ -1,6 +1,8 @@
 import requests
 from girder.exceptions import RestException
 
+from ..http_client import SESSION
+
 
 class DataverseVerificator:
     def __init__(self, resource_server, key):
@@ -13,7 +15,7 @@ class DataverseVerificator:
             "X-Dataverse-key": "{}".format(self.key),
         }
         try:
-            r = requests.get(self.token_url, headers=headers)
+            r = SESSION.get(self.token_url, headers=headers)
             r.raise_for_status()
         except requests.exceptions.HTTPError:
             raise RestException(
@@ -1,10 +1,13 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import json
 import re
 import os
 import pathlib
+import threading
 from urllib.parse import urlparse, urlunparse, parse_qs
-from urllib.request import urlopen, Request
-from urllib.error import HTTPError
+
+import requests
 
 from girder import events, logger
 from girder.constants import AccessType
@@ -13,19 +16,32 @@ from girder.models.setting import Setting
 
 from ..import_providers import ImportProvider
 from ..data_map import DataMap
-from ..file_map import FileMap
+from ..file_stream import hierarchy_node
 from ..import_item import ImportItem
 from ..entity import Entity
+from ..http_client import SESSION
 from ... import constants
 
 _DOI_REGEX = re.compile(r'(10.\d{4,9}/[-._;()/:A-Z0-9]+)', re.IGNORECASE)
 _QUOTES_REGEX = re.compile(r'"(.*)"')
 _CNTDISP_REGEX = re.compile(r'filename="(.*)"')
+# Number of concurrent HEAD requests issued while sanitizing files
+_HEAD_WORKERS = 8
+# Access url -> (name, size). Dataverse files are immutable, a new version of
+# a file gets a new id.
+_HEAD_CACHE = OrderedDict()
+_HEAD_CACHE_SIZE = 10000
+_HEAD_CACHE_LOCK = threading.Lock()
+
+
+def _get_json(url, **kwargs):
+    resp = SESSION.get(url, **kwargs)
+    resp.raise_for_status()
+    return resp.json()
 
 
 def _query_dataverse(search_url):
-    resp = urlopen(search_url).read()
-    data = json.loads(resp.decode('utf-8'))['data']
+    data = _get_json(search_url)['data']
     if data['count_in_response'] != 1:
         raise ValueError
     item = data['items'][0]
@@ -48,26 +64,34 @@ def _query_dataverse(search_url):
 
 
 def _get_attrs_via_head(obj, url):
+    with _HEAD_CACHE_LOCK:
+        if url in _HEAD_CACHE:
+            _HEAD_CACHE.move_to_end(url)
+            return _HEAD_CACHE[url]
+
     name = obj['filename']
     size = obj['filesize']
     try:
-        req = Request(url)
-        req.get_method = lambda: 'HEAD'
-        resp = urlopen(req)
-    except HTTPError as err:
+        resp = SESSION.head(url, allow_redirects=True)
+        resp.raise_for_status()
+    except requests.HTTPError as err:
         logger.debug(str(err))
         return name, size
 
-    content_disposition = resp.getheader('Content-Disposition')
+    content_disposition = resp.headers.get('Content-Disposition')
     if content_disposition:
         fname = _CNTDISP_REGEX.search(content_disposition)
         if fname:
             name = fname.groups()[0]
 
-    content_length = resp.getheader('Content-Length')
+    content_length = resp.headers.get('Content-Length')
     if content_length:
         size = int(content_length)
 
+    with _HEAD_CACHE_LOCK:
+        _HEAD_CACHE[url] = (name, size)
+        while len(_HEAD_CACHE) > _HEAD_CACHE_SIZE:
+            _HEAD_CACHE.popitem(last=False)
     return name, size
 
 
@@ -91,9 +115,7 @@ class DataverseImportProvider(ImportProvider):
                 urlparse(url)._replace(path='/api/info/version')
             )
         try:
-            resp = urlopen(url, timeout=1)
-            resp_body = resp.read()
-            data = json.loads(resp_body.decode('utf-8'))
+            data = _get_json(url, timeout=1)
         except Exception:
             logger.warning(
                 "[dataverse] failed to fetch installations, using a local copy."
@@ -145,8 +167,7 @@ class DataverseImportProvider(ImportProvider):
             )
         else:
             dataset_url = urlunparse(url)
-        resp = urlopen(dataset_url).read()
-        data = json.loads(resp.decode('utf-8'))
+        data = _get_json(dataset_url)
         meta = data['data']['latestVersion']['metadataBlocks']['citation']['fields']
         title = next(_['value'] for _ in meta if _['typeName'] == 'title')
         doi = '{protocol}:{authority}/{identifier}'.format(**data['data'])
@@ -219,31 +240,41 @@ class DataverseImportProvider(ImportProvider):
 
         File size is wrong: https://github.com/IQSS/dataverse/issues/5321
         URL doesn't point to original format, by default.
+
+        Files needing a HEAD request are processed concurrently, the order of
+        files is preserved.
         """
 
-        def _update_attrs(url, obj, query):
-            access_url = urlunparse(
-                url._replace(path='/api/access/datafile/' + fileId,
-                             query=query)
+        def _access_url(fileId, query):
+            return urlunparse(
+                url._replace(path='/api/access/datafile/' + fileId, query=query)
             )
-            name, size = _get_attrs_via_head(obj, access_url)
-            obj['filesize'] = size
-            obj['filename'] = name
+
+        def _update_attrs(task):
+            obj, access_url, head = task
+            if head:
+                name, size = _get_attrs_via_head(obj, access_url)
+                obj['filesize'] = size
+                obj['filename'] = name
             obj['url'] = access_url
             return obj
 
+        tasks = []
         for obj in files:
             fileId = str(obj['id'])
             # Register original too
             if obj['mimeType'] == 'text/tab-separated-values':
-                yield _update_attrs(url, obj.copy(), 'format=original')
-                yield _update_attrs(url, obj.copy(), '')
+                tasks.append((obj.copy(), _access_url(fileId, 'format=original'), True))
+                tasks.append((obj.copy(), _access_url(fileId, ''), True))
             else:
-                obj['url'] = urlunparse(
-                    url._replace(path='/api/access/datafile/' + fileId,
-                                 query='')
-                )
-                yield obj
+                tasks.append((obj, _access_url(fileId, ''), False))
+
+        heads = sum(1 for task in tasks if task[2])
+        if heads < 2:
+            yield from map(_update_attrs, tasks)
+            return
+        with ThreadPoolExecutor(max_workers=min(_HEAD_WORKERS, heads)) as executor:
+            yield from executor.map(_update_attrs, tasks)
 
     def parse_pid(self, pid: str, sanitize: bool = False):
         url = urlparse(pid)
@@ -266,42 +297,52 @@ class DataverseImportProvider(ImportProvider):
         return DataMap(entity.getValue(), size, doi=doi, name=title,
                        repository=self.getName())
 
-    def listFiles(self, entity: Entity) -> FileMap:
-        stack = []
-        top = None
-        for item in self._listRecursive(entity.getUser(), entity.getValue(), None):
-            if item.type == ImportItem.FOLDER:
-                if len(stack) == 0:
-                    fm = FileMap(item.name)
-                else:
-                    fm = stack[-1].addChild(item.name)
-                stack.append(fm)
-            elif item.type == ImportItem.END_FOLDER:
-                top = stack.pop()
-            elif item.type == ImportItem.FILE:
-                stack[-1].addFile(item.name, item.size)
-        return top
+    def iterFiles(self, entity: Entity, path: list = None, depth: int = None):
+        pid = entity.getValue()
+        if not path and depth is None:
+            yield from self._listRecursive(entity.getUser(), pid, None)
+            return
+        title, files, doi = self.parse_pid(pid)
+        hierarchy = hierarchy_node(self._files_to_hierarchy(files), path)
+        # Only files of the listed folders are sanitized, which costs a HEAD
+        # request for some of them
+        self._sanitizeHierarchy(urlparse(pid), hierarchy, depth)
+        if path:
+            yield ImportItem(ImportItem.FOLDER, name=path[-1])
+        else:
+            yield ImportItem(ImportItem.FOLDER, name=title, identifier=doi)
+        yield from self._recurseHierarchy(hierarchy, doi, depth)
+        yield ImportItem(ImportItem.END_FOLDER)
+
+    def _sanitizeHierarchy(self, url, hierarchy, depth=None):
+        hierarchy['+files+'] = list(self._sanitize_files(url, hierarchy['+files+']))
+        if depth is None or depth > 0:
+            for folder, child in hierarchy.items():
+                if folder != '+files+':
+                    self._sanitizeHierarchy(url, child, None if depth is None else depth - 1)
+
+    @staticmethod
+    def _recurseHierarchy(hierarchy, doi, depth=None):
+        files = hierarchy.pop('+files+')
+        for obj in files:
+            yield ImportItem(
+                ImportItem.FILE, obj['filename'],
+                size=obj['filesize'],
+                mimeType=obj.get('mimeType', 'application/octet-stream'),
+                url=obj['url'],
+                identifier=obj.get('doi') or doi
+            )
+        for folder in hierarchy.keys():
+            yield ImportItem(ImportItem.FOLDER, name=folder)
+            if depth is None or depth > 0:
+                yield from DataverseImportProvider._recurseHierarchy(
+                    hierarchy[folder], doi, None if depth is None else depth - 1)
+            yield ImportItem(ImportItem.END_FOLDER)
 
     def _listRecursive(self, user, pid: str, name: str, base_url: str = None,
                        progress=None):
-
-        def _recurse_hierarchy(hierarchy):
-            files = hierarchy.pop('+files+')
-            for obj in files:
-                yield ImportItem(
-                    ImportItem.FILE, obj['filename'],
-                    size=obj['filesize'],
-                    mimeType=obj.get('mimeType', 'application/octet-stream'),
-                    url=obj['url'],
-                    identifier=obj.get('doi') or doi
-                )
-            for folder in hierarchy.keys():
-                yield ImportItem(ImportItem.FOLDER, name=folder)
-                yield from _recurse_hierarchy(hierarchy[folder])
-                yield ImportItem(ImportItem.END_FOLDER)
-
         title, files, doi = self.parse_pid(pid, sanitize=True)
         hierarchy = self._files_to_hierarchy(files)
         yield ImportItem(ImportItem.FOLDER, name=title, identifier=doi)
-        yield from _recurse_hierarchy(hierarchy)
+        yield from self._recurseHierarchy(hierarchy, doi)
         yield ImportItem(ImportItem.END_FOLDER)
@@ -1,54 +1,152 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import copy
+import hashlib
+import queue
+import threading
 from hashlib import sha256, md5
-import magic
-import os
-from girder.utility import hash_state, ziputil
+from girder.utility import hash_state
 from girder.constants import AccessType
 from girder.models.folder import Folder
+from girder.models.setting import Setting
 from ..license import WholeTaleLicense
 from ..manifest import Manifest
+from ..mimetype import MIMETYPE_DETECTOR
+from ..workspace_snapshot import WorkspaceSnapshot
+from ...constants import PluginSettings
+from ...models.file_checksum import FileChecksum
 from ...models.image import Image
+from .ziputil import ZipGenerator
 
 
 class HashFileStream:
     """Generator that computes md5 and sha256 of data returned by it"""
 
-    def __init__(self, gen):
+    algs = ('md5', 'sha256')
+
+    def __init__(self, gen, state=None):
         """
         This class is primarily meant to wrap Girder's download function,
         which returns iterators, hence self.x = x()
+
+        :param gen: generator (or a callable returning one) yielding bytes
+        :param state: optional checkpoint previously obtained via
+            :meth:`checkpoint`, used to resume hashing of a partially
+            consumed stream.
         """
         try:
             self.gen = gen()
         except TypeError:
             self.gen = gen
-        self.state = {
-            'md5': hash_state.serializeHex(md5()),
-            'sha256': hash_state.serializeHex(sha256()),
-        }
+        if state is None:
+            self.checksums = {'md5': md5(), 'sha256': sha256()}
+        else:
+            self.checksums = {
+                alg: hash_state.restoreHex(state[alg], alg) for alg in self.algs
+            }
 
     def __iter__(self):
         return self
 
     def __next__(self):
         nxt = next(self.gen)
-        for alg in self.state.keys():
-            checksum = hash_state.restoreHex(self.state[alg], alg)
+        for checksum in self.checksums.values():
             checksum.update(nxt)
-            self.state[alg] = hash_state.serializeHex(checksum)
         return nxt
 
     def __call__(self):
         """Needs to be callable, see comment in __init__"""
         return self
 
+    def checkpoint(self):
+        """
+        Serialize the current state of all the checksums.
+
+        The returned dict can be passed as ``state`` to a new HashFileStream
+        to resume hashing where this one left off.
+        """
+        return {
+            alg: hash_state.serializeHex(checksum)
+            for alg, checksum in self.checksums.items()
+        }
+
+    @property
+    def state(self):
+        return self.checkpoint()
+
     @property
     def sha256(self):
-        return hash_state.restoreHex(self.state['sha256'], 'sha256').hexdigest()
+        return self.checksums['sha256'].hexdigest()
 
     @property
     def md5(self):
-        return hash_state.restoreHex(self.state['md5'], 'md5').hexdigest()
+        return self.checksums['md5'].hexdigest()
+
+
+class PrehashedFile:
+    """
+    Chunks of a file read and hashed by a worker thread ahead of the zip writer.
+
+    The reader puts each chunk on a bounded queue right after hashing it, so the
+    checksums describe exactly the bytes that end up in the zip and at most
+    `maxsize` chunks per file are held in memory.
+    """
+
+    _END = object()
+
+    def __init__(self, fullpath, algs, checksums, chunksize=1024 ** 2, maxsize=8):
+        """
+        :param checksums: dict filled with hex digests keyed by algorithm once
+            the whole file was read.
+        """
+        self.fullpath = fullpath
+        self.algs = algs
+        self.checksums = checksums
+        self.chunksize = chunksize
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._cancelled = threading.Event()
+
+    def read(self):
+        """Read and hash the file, meant to run in a worker thread."""
+        try:
+            hashes = {alg: hashlib.new(alg) for alg in self.algs}
+            with open(self.fullpath, mode="rb") as f:
+                while True:
+                    chunk = f.read(self.chunksize)
+                    if not chunk:
+                        break
+                    for checksum in hashes.values():
+                        checksum.update(chunk)
+                    if not self._put(chunk):
+                        return
+            self.checksums.update(
+                {alg: checksum.hexdigest() for alg, checksum in hashes.items()}
+            )
+            self._put(self._END)
+        except Exception as exc:
+            self._put(exc)
+
+    def _put(self, item):
+        # Give up as soon as the consumer is gone instead of blocking forever
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is self._END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
 
 
 class TaleExporter:
@@ -61,9 +159,23 @@ class TaleExporter:
        README.md: This file"""
     default_bagit = "BagIt-Version: 0.97\nTag-File-Character-Encoding: UTF-8\n"
 
-    def __init__(self, tale, user, algs=None, expand_folders=False):
-        if algs is None:
-            self.algs = ["md5", "sha256"]
+    def __init__(self, tale, user, algs=None, expand_folders=False, hash_workers=None,
+                 use_checksum_cache=True, compression_level=None):
+        """
+        :param hash_workers: Number of threads computing checksums of workspace
+            files ahead of the zip writer. If 0, checksums are computed while
+            streaming. Defaults to the value of the export_hash_workers setting.
+        :param use_checksum_cache: If True, checksums and mimetypes of workspace
+            files that did not change since the last export are not recomputed.
+        :param compression_level: Deflate level used for compressible files, 0
+            disables compression. Already compressed formats (png, gz, zip, h5...)
+            are always stored. Defaults to the export_compression_level setting.
+        """
+        self.use_checksum_cache = use_checksum_cache
+        self.algs = algs or ["md5", "sha256"]
+        if hash_workers is None:
+            hash_workers = Setting().get(PluginSettings.EXPORT_HASH_WORKERS)
+        self.hash_workers = int(hash_workers or 0)
         self.tale = tale
         self.user = user
         self.image = Image().load(
@@ -76,14 +188,29 @@ class TaleExporter:
         self.workspace = Folder().load(
             tale['workspaceId'], user=user, level=AccessType.READ
         )
-        self.manifest = Manifest(tale, user, expand_folders).manifest
-        self.zip_generator = ziputil.ZipGenerator(str(tale['_id']))
+        self.workspace_snapshot = WorkspaceSnapshot(self.workspace['fsPath'])
+        self.manifest = Manifest(
+            tale, user, expand_folders, workspace_snapshot=self.workspace_snapshot
+        ).manifest
+        if compression_level is None:
+            compression_level = Setting().get(PluginSettings.EXPORT_COMPRESSION_LEVEL)
+        self.zip_generator = ZipGenerator(
+            str(tale['_id']), compression_level=int(compression_level)
+        )
         self.tale_license = WholeTaleLicense().license_from_spdx(
             tale.get('licenseSPDX', WholeTaleLicense.default_spdx())
         )
         self.state = {}
         for alg in self.algs:
             self.state[alg] = []
+        # relpath -> os.stat_result for all files in the workspace
+        self.workspace_stats = self.workspace_snapshot.stats()
+        # relpath -> valid FileChecksum entry
+        self.file_cache = {}
+        # relpath -> (os.stat_result, dict of values to store in FileChecksum)
+        self.file_updates = {}
+        # uri -> position in manifest['aggregates'], see find_aggregate
+        self._aggregate_index = None
 
     def list_workspace(self):
         """
@@ -92,17 +219,11 @@ class TaleExporter:
         Returns a tuple for each file:
            fullpath - absolute path to a file
            relpath - path to a file relative to workspace root
-        """
-
-        workspace_rootpath = self.workspace["fsPath"]
-        if not workspace_rootpath.endswith("/"):
-            workspace_rootpath += "/"
 
-        for curdir, _, files in os.walk(workspace_rootpath):
-            for fname in files:
-                fullpath = os.path.join(curdir, fname)
-                relpath = fullpath.replace(workspace_rootpath, "")
-                yield fullpath, relpath
+        The workspace is walked only once, see WorkspaceSnapshot.
+        """
+        for entry in self.workspace_snapshot:
+            yield entry.fullpath, entry.relpath
 
     @staticmethod
     def bytes_from_file(filename, chunksize=8192):
@@ -114,6 +235,90 @@ class TaleExporter:
                 else:
                     break
 
+    def load_file_cache(self):
+        """Fetch valid checksum cache entries for all the workspace files."""
+        if self.use_checksum_cache:
+            self.file_cache = FileChecksum().getValid(
+                self.workspace['_id'], self.workspace_stats
+            )
+
+    def save_file_cache(self):
+        """
+        Store checksums and mimetypes of files that were (re)computed and drop the
+        entries of files no longer in the workspace.
+        """
+        if not self.use_checksum_cache:
+            return
+        required = set(self.algs) | {'mimeType'}
+        updates = {
+            relpath: entry
+            for relpath, entry in self.file_updates.items()
+            if required <= entry[1].keys()
+        }
+        FileChecksum().record(self.workspace['_id'], updates, paths=self.workspace_stats)
+
+    def checksummed_workspace(self):
+        """
+        List contents of the workspace along with checksums of each file.
+
+        Returns a tuple for each file:
+           fullpath - absolute path to a file
+           relpath - path to a file relative to workspace root
+           checksums - dict of hex digests keyed by algorithm. It is empty if
+               checksums should be computed while the file is streamed, in which
+               case dump_and_checksum fills it in. If the file is being hashed
+               by a worker, it's a PrehashedFile instead.
+
+        Checksums of files that did not change since the previous export are
+        taken from the FileChecksum cache. If hash_workers > 0, remaining files
+        are read and hashed by a pool of threads running ahead of the consumer
+        (hashlib releases the GIL), preserving the walk order. The chunks they
+        read are the ones dump_and_checksum writes to the zip, so each file is
+        read only once.
+        """
+        self.load_file_cache()
+        pending = deque()
+        # Files hashed by a worker that weren't streamed yet
+        in_flight = set()
+
+        def _next_entry(fullpath, relpath):
+            cached = self.file_cache.get(relpath, {})
+            if all(alg in cached for alg in self.algs):
+                return fullpath, relpath, {alg: cached[alg] for alg in self.algs}
+            checksums = {}
+            self.file_updates[relpath] = (self.workspace_stats[relpath], checksums)
+            if executor is None:
+                return fullpath, relpath, checksums
+            prehashed = PrehashedFile(fullpath, self.algs, checksums)
+            in_flight.add(prehashed)
+            executor.submit(prehashed.read)
+            return fullpath, relpath, prehashed
+
+        def _pop_entry():
+            entry = pending.popleft()
+            yield entry
+            # The consumer moved on, the file is done with
+            if isinstance(entry[2], PrehashedFile):
+                entry[2].cancel()
+                in_flight.discard(entry[2])
+
+        executor = None
+        if self.hash_workers > 0:
+            executor = ThreadPoolExecutor(max_workers=self.hash_workers)
+        try:
+            for fullpath, relpath in self.list_workspace():
+                pending.append(_next_entry(fullpath, relpath))
+                if len(pending) > 2 * self.hash_workers:
+                    yield from _pop_entry()
+            while pending:
+                yield from _pop_entry()
+        finally:
+            if executor is not None:
+                # Unblock readers whose chunks will never be consumed
+                for prehashed in in_flight:
+                    prehashed.cancel()
+                executor.shutdown(wait=False)
+
     def stream(self):
         raise NotImplementedError
 
@@ -126,12 +331,55 @@ class TaleExporter:
     def stream_string(string):
         return (_.encode() for _ in (string,))
 
-    def dump_and_checksum(self, func, zip_path):
-        hash_file_stream = HashFileStream(func)
-        for data in self.zip_generator.addFile(hash_file_stream, zip_path):
-            yield data
+    def dump_and_checksum(self, func, zip_path, checksums=None, size=None):
+        """
+        Add a file to the zip and record its checksums.
+
+        :param size: Optional size of the file, see ZipGenerator.addFile.
+        :param checksums: Precomputed checksums keyed by algorithm. If not
+            provided (or empty), checksums are computed while the payload is
+            streamed. An empty dict is filled in with the computed values.
+            If it's a PrehashedFile, its chunks are streamed instead of func.
+        """
+        if isinstance(checksums, PrehashedFile):
+            prehashed = checksums
+            for data in self.zip_generator.addFile(lambda: prehashed, zip_path, size=size):
+                yield data
+            checksums = prehashed.checksums
+        elif not checksums:
+            hash_file_stream = HashFileStream(func)
+            for data in self.zip_generator.addFile(hash_file_stream, zip_path, size=size):
+                yield data
+            computed = {alg: getattr(hash_file_stream, alg) for alg in self.algs}
+            if checksums is None:
+                checksums = computed
+            else:
+                checksums.update(computed)
+        else:
+            # ZipGenerator expects a callable returning the payload
+            payload = func if callable(func) else (lambda: func)
+            for data in self.zip_generator.addFile(payload, zip_path, size=size):
+                yield data
         for alg in self.algs:
-            self.state[alg].append((zip_path, getattr(hash_file_stream, alg)))
+            self.state[alg].append((zip_path, checksums[alg]))
+
+    def find_aggregate(self, uri):
+        """
+        Return the first record in the 'aggregates' section with a given uri or None.
+
+        The uri -> record index is built on first use, call reset_aggregate_index
+        after modifying uris of the records.
+        """
+        if self._aggregate_index is None:
+            self._aggregate_index = {}
+            for i, aggregate in enumerate(self.manifest['aggregates']):
+                self._aggregate_index.setdefault(aggregate['uri'], i)
+        index = self._aggregate_index.get(uri)
+        if index is not None:
+            return self.manifest['aggregates'][index]
+
+    def reset_aggregate_index(self):
+        self._aggregate_index = None
 
     def append_aggergate_checksums(self):
         """
@@ -139,17 +387,45 @@ class TaleExporter:
         :return: None
         """
         for path, chksum in self.state['md5']:
-            uri = '../' + path
-            index = next(
-                (
-                    i
-                    for (i, d) in enumerate(self.manifest['aggregates'])
-                    if d['uri'] == uri
-                ),
-                None,
-            )
-            if index is not None:
-                self.manifest['aggregates'][index]['md5'] = chksum
+            aggregate = self.find_aggregate('../' + path)
+            if aggregate is not None:
+                aggregate['md5'] = chksum
+
+    def detect_mimetypes(self):
+        """
+        Get mimetypes of all the workspace files.
+
+        Mimetypes of unchanged files are taken from the FileChecksum cache, the
+        rest is detected by MIMETYPE_DETECTOR (using hash_workers threads) and
+        scheduled to be stored in the cache.
+
+        :return: A dict mapping relative paths to mimetypes
+        """
+        mimetypes = {}
+        to_detect = []
+        for fullpath, relpath in self.list_workspace():
+            cached = self.file_cache.get(relpath, {})
+            if 'mimeType' in cached:
+                mimetypes[relpath] = cached['mimeType']
+                continue
+            if relpath not in self.file_updates:
+                self.file_updates[relpath] = (
+                    self.workspace_stats[relpath],
+                    {alg: cached[alg] for alg in self.algs if alg in cached},
+                )
+            to_detect.append((fullpath, relpath))
+
+        detected = MIMETYPE_DETECTOR.detect_many(
+            [
+                (fullpath, self.file_updates[relpath][1].get('md5'))
+                for fullpath, relpath in to_detect
+            ],
+            workers=self.hash_workers,
+        )
+        for (_, relpath), mimetype in zip(to_detect, detected):
+            self.file_updates[relpath][1]['mimeType'] = mimetype
+            mimetypes[relpath] = mimetype
+        return mimetypes
 
     def append_aggregate_filesize_mimetypes(self, prepended_path):
         """
@@ -158,23 +434,12 @@ class TaleExporter:
         :type prepended_path: str
         :return: None
         """
-        magic_wrapper = magic.Magic(mime=True, uncompress=True)
-        for fullpath, relpath in self.list_workspace():
-            uri = prepended_path + relpath
-            index = next(
-                (
-                    i
-                    for (i, d) in enumerate(self.manifest['aggregates'])
-                    if d['uri'] == uri
-                ),
-                None,
-            )
-
-            if index is not None:
-                self.manifest['aggregates'][index]['mimeType'] = (
-                    magic_wrapper.from_file(fullpath) or 'application/octet-stream'
-                )
-            self.manifest['aggregates'][index]['size'] = os.path.getsize(fullpath)
+        mimetypes = self.detect_mimetypes()
+        for _, relpath in self.list_workspace():
+            aggregate = self.find_aggregate(prepended_path + relpath)
+            if aggregate is not None:
+                aggregate['mimeType'] = mimetypes[relpath]
+                aggregate['size'] = self.workspace_stats[relpath].st_size
 
     def append_extras_filesize_mimetypes(self, extra_files):
         """
@@ -184,15 +449,7 @@ class TaleExporter:
         :return: None
         """
         for path, content in extra_files.items():
-            uri = '../' + path
-            index = next(
-                (
-                    i
-                    for (i, d) in enumerate(self.manifest['aggregates'])
-                    if d['uri'] == uri
-                ),
-                None,
-            )
-            if index is not None:
-                self.manifest['aggregates'][index]['mimeType'] = 'text/plain'
-                self.manifest['aggregates'][index]['size'] = len(content)
+            aggregate = self.find_aggregate('../' + path)
+            if aggregate is not None:
+                aggregate['mimeType'] = 'text/plain'
+                aggregate['size'] = len(content)
@@ -1,7 +1,6 @@
 from datetime import datetime, timezone
 from hashlib import sha256, md5
 import json
-import os
 from girder.utility import JsonEncoder
 from . import TaleExporter
 from gwvolman.constants import REPO2DOCKER_VERSION
@@ -98,12 +97,13 @@ class BagTaleExporter(TaleExporter):
         oxum = dict(size=0, num=0)
 
         # Add files from the workspace computing their checksum
-        for fullpath, relpath in self.list_workspace():
+        for fullpath, relpath, checksums in self.checksummed_workspace():
             yield from self.dump_and_checksum(
-                self.bytes_from_file(fullpath), 'data/workspace/' + relpath
+                self.bytes_from_file(fullpath), 'data/workspace/' + relpath,
+                checksums=checksums, size=self.workspace_stats[relpath].st_size
             )
             oxum["num"] += 1
-            oxum["size"] += os.path.getsize(fullpath)
+            oxum["size"] += self.workspace_stats[relpath].st_size
 
         # Compute checksums for the extrafiles
         for path, content in extra_files.items():
@@ -125,6 +125,8 @@ class BagTaleExporter(TaleExporter):
                 self.manifest['aggregates'][i]['bundledAs']['folder'] = folder.replace(
                     '..', '../data'
                 )
+        self.reset_aggregate_index()
+
         # Update manifest with hashes
         self.append_aggergate_checksums()
 
@@ -134,6 +136,9 @@ class BagTaleExporter(TaleExporter):
         # Update manifest with filesizes and mimeTypes for extra items
         self.append_extras_filesize_mimetypes(extra_files)
 
+        # Remember checksums and mimeTypes of workspace files for subsequent exports
+        self.save_file_cache()
+
         # Create the fetch file
         fetch_file = ""
         for bundle in self.manifest['aggregates']:
@@ -14,9 +14,10 @@ class NativeTaleExporter(TaleExporter):
         }
 
         # Add files from the workspace
-        for fullpath, relpath in self.list_workspace():
+        for fullpath, relpath, checksums in self.checksummed_workspace():
             yield from self.dump_and_checksum(
-                self.bytes_from_file(fullpath), 'workspace/' + relpath
+                self.bytes_from_file(fullpath), 'workspace/' + relpath,
+                checksums=checksums, size=self.workspace_stats[relpath].st_size
             )
 
         # Compute checksums for extra files
@@ -33,6 +34,9 @@ class NativeTaleExporter(TaleExporter):
         # Update manifest with filesizes and mimeTypes for extra items
         self.append_extras_filesize_mimetypes(extra_files)
 
+        # Remember checksums and mimeTypes of workspace files for subsequent exports
+        self.save_file_cache()
+
         for data in self.zip_generator.addFile(
             lambda: json.dumps(self.manifest, indent=4), 'metadata/manifest.json'
         ):
@@ -0,0 +1,227 @@
+"""
+Streaming zip writer used by Tale exporters.
+
+Unlike girder.utility.ziputil.ZipGenerator it picks a compression method for
+each member based on its file type, and writes ZIP64 records for members and
+archives exceeding the limits of the classic zip format.
+"""
+import os
+import struct
+import time
+import zlib
+from zipfile import ZIP_STORED, ZIP_DEFLATED
+
+# Extensions of payloads that are already compressed and would not benefit
+# from another round of deflate.
+STORED_EXTENSIONS = frozenset({
+    '7z', 'avi', 'bz2', 'gif', 'gz', 'h5', 'hdf', 'hdf5', 'he5', 'jpeg', 'jpg',
+    'lz4', 'lzma', 'mkv', 'mov', 'mp3', 'mp4', 'nc', 'npz', 'ogg', 'parquet',
+    'pdf', 'png', 'rar', 'tgz', 'tif', 'tiff', 'webm', 'webp', 'whl', 'xlsx',
+    'docx', 'pptx', 'xz', 'zip', 'zst',
+})
+
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+_CENTRAL_DIR = struct.Struct('<4s4B4HL2L5H2L')
+_END_ARCHIVE = struct.Struct('<4s4H2LH')
+_END_ARCHIVE64 = struct.Struct('<4sQ2H2L4Q')
+_END_ARCHIVE64_LOCATOR = struct.Struct('<4sLQL')
+_DATA_DESCRIPTOR = struct.Struct('<4sL2L')
+_DATA_DESCRIPTOR64 = struct.Struct('<4sL2Q')
+
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_VERSION = 20
+_VERSION_ZIP64 = 45
+_UNIX = 3
+
+
+class ZipMember:
+    def __init__(self, filename, date_time, compress_type, header_offset, zip64):
+        self.filename = filename
+        self.date_time = date_time
+        self.compress_type = compress_type
+        self.header_offset = header_offset
+        self.zip64 = zip64
+        self.crc = 0
+        self.compress_size = 0
+        self.file_size = 0
+
+    @property
+    def dos_time(self):
+        year, month, day, hour, minute, second = self.date_time
+        return (
+            hour << 11 | minute << 5 | second // 2,
+            (year - 1980) << 9 | month << 5 | day,
+        )
+
+
+class ZipGenerator:
+    """
+    Generate a zip archive on the fly.
+
+    :param rootPath: Prefix prepended to the path of every member.
+    :param compression_level: Deflate level (1-9) used for compressible members.
+        If 0 (the default), all members are stored without compression.
+    :param stored_extensions: Extensions of members that are never compressed.
+    :param min_compress_size: Members known to be smaller than that are stored.
+    """
+
+    zip64_limit = (1 << 31) - 1
+    max_entries = 0xFFFF
+
+    def __init__(self, rootPath='', compression_level=0,
+                 stored_extensions=STORED_EXTENSIONS, min_compress_size=256):
+        self.rootPath = rootPath
+        self.compression_level = compression_level
+        self.stored_extensions = stored_extensions
+        self.min_compress_size = min_compress_size
+        self.files = []
+        self.offset = 0
+
+    def _advanceOffset(self, data):
+        self.offset += len(data)
+        return data
+
+    def compressionFor(self, path, size=None):
+        """Return compression method for a member at path with an optional size hint."""
+        if self.compression_level == 0:
+            return ZIP_STORED
+        if size is not None and size < self.min_compress_size:
+            return ZIP_STORED
+        ext = os.path.splitext(path)[1][1:].lower()
+        if ext in self.stored_extensions:
+            return ZIP_STORED
+        return ZIP_DEFLATED
+
+    @staticmethod
+    def _chunks(generator):
+        data = generator() if callable(generator) else generator
+        if isinstance(data, (str, bytes)):
+            data = (data,)
+        for chunk in data:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf8')
+            yield chunk
+
+    def addFile(self, generator, path, size=None):
+        """
+        Generate data for a member at the given path in the archive.
+
+        :param generator: A callable returning the member content, either as
+            a str/bytes or an iterable of them.
+        :param path: The path within the archive for this member.
+        :param size: Optional size hint. Members with unknown size get ZIP64
+            local headers, so they can safely exceed 4 GiB. Members exceeding
+            the classic limits despite a smaller hint fall back to a ZIP64
+            data descriptor.
+        """
+        fullpath = os.path.join(self.rootPath, path)
+        member = ZipMember(
+            fullpath,
+            time.localtime(time.time())[:6],
+            self.compressionFor(fullpath, size),
+            self.offset,
+            zip64=size is None or size > self.zip64_limit,
+        )
+        filename = member.filename.encode('utf8')
+        dostime, dosdate = member.dos_time
+
+        if member.zip64:
+            extra = struct.pack('<2H2Q', 1, 16, 0, 0)
+            placeholder = 0xFFFFFFFF
+            version = _VERSION_ZIP64
+        else:
+            extra = b''
+            placeholder = 0
+            version = _VERSION
+        yield self._advanceOffset(_LOCAL_HEADER.pack(
+            b'PK\003\004', version, 0, _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8,
+            member.compress_type, dostime, dosdate, 0, placeholder, placeholder,
+            len(filename), len(extra),
+        ) + filename + extra)
+
+        compressor = None
+        if member.compress_type == ZIP_DEFLATED:
+            compressor = zlib.compressobj(self.compression_level, zlib.DEFLATED, -15)
+
+        for chunk in self._chunks(generator):
+            member.file_size += len(chunk)
+            member.crc = zlib.crc32(chunk, member.crc)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+                if not chunk:
+                    continue
+            member.compress_size += len(chunk)
+            yield self._advanceOffset(chunk)
+        if compressor is not None:
+            chunk = compressor.flush()
+            member.compress_size += len(chunk)
+            yield self._advanceOffset(chunk)
+
+        if max(member.file_size, member.compress_size) > self.zip64_limit:
+            # The size hint was too small
+            member.zip64 = True
+        if member.zip64:
+            descriptor = _DATA_DESCRIPTOR64
+        else:
+            descriptor = _DATA_DESCRIPTOR
+        yield self._advanceOffset(descriptor.pack(
+            b'PK\007\010', member.crc, member.compress_size, member.file_size
+        ))
+        self.files.append(member)
+
+    def footer(self):
+        """Generate the central directory and the end of archive records."""
+        data = []
+        cd_offset = self.offset
+        for member in self.files:
+            zip64_fields = []
+            file_size, compress_size, header_offset = (
+                member.file_size, member.compress_size, member.header_offset
+            )
+            if file_size > self.zip64_limit:
+                zip64_fields.append(file_size)
+                file_size = 0xFFFFFFFF
+            if compress_size > self.zip64_limit:
+                zip64_fields.append(compress_size)
+                compress_size = 0xFFFFFFFF
+            if header_offset > self.zip64_limit:
+                zip64_fields.append(header_offset)
+                header_offset = 0xFFFFFFFF
+
+            extra = b''
+            version = _VERSION
+            if zip64_fields or member.zip64:
+                version = _VERSION_ZIP64
+            if zip64_fields:
+                extra = struct.pack(
+                    '<2H{}Q'.format(len(zip64_fields)), 1, 8 * len(zip64_fields),
+                    *zip64_fields
+                )
+
+            filename = member.filename.encode('utf8')
+            dostime, dosdate = member.dos_time
+            data.append(_CENTRAL_DIR.pack(
+                b'PK\001\002', version, _UNIX, version, 0,
+                _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8, member.compress_type,
+                dostime, dosdate, member.crc, compress_size, file_size,
+                len(filename), len(extra), 0, 0, 0, 0o100644 << 16, header_offset,
+            ) + filename + extra)
+
+        cd_size = sum(len(_) for _ in data)
+        entries = len(self.files)
+        too_large = max(cd_offset, cd_size) > self.zip64_limit
+        if entries > self.max_entries or too_large:
+            zip64_offset = cd_offset + cd_size
+            data.append(_END_ARCHIVE64.pack(
+                b'PK\006\006', _END_ARCHIVE64.size - 12, _VERSION_ZIP64, _VERSION_ZIP64,
+                0, 0, entries, entries, cd_size, cd_offset,
+            ))
+            data.append(_END_ARCHIVE64_LOCATOR.pack(b'PK\006\007', 0, zip64_offset, 1))
+            entries = min(entries, 0xFFFF)
+            cd_size = min(cd_size, 0xFFFFFFFF)
+            cd_offset = min(cd_offset, 0xFFFFFFFF)
+        data.append(_END_ARCHIVE.pack(
+            b'PK\005\006', 0, 0, entries, entries, cd_size, cd_offset, 0
+        ))
+        return self._advanceOffset(b''.join(data))
@@ -1,5 +1,11 @@
+import json
+from json.encoder import encode_basestring_ascii as _encodeString
 from typing import Optional, List, Dict
 
+from .import_item import ImportItem
+
+_encode = json.JSONEncoder().encode
+
 fileMapDoc = {
     'type': 'object',
     'description': ('A container with a list of filenames and sizes '
@@ -44,6 +50,8 @@ fileMapDoc = {
 
 
 class FileItem:
+    __slots__ = ('name', 'size')
+
     def __init__(self, name: str, size: int):
         self.name = name
         self.size = size
@@ -53,35 +61,51 @@ class FileItem:
 
 
 class FileList:
+    """
+    Files of a folder, kept as parallel lists of names and sizes rather than
+    as FileItems, which matters for folders with a lot of files.
+    """
+    __slots__ = ('names', 'sizes')
+
     def __init__(self):
-        self.list = []
+        self.names = []
+        self.sizes = []
 
     def addFile(self, fi: FileItem):
-        self.list.append(fi)
-
-    def toList(self):
-        return sorted([x.toDict() for x in self.list], key=lambda k: list(k))
+        self.names.append(fi.name)
+        self.sizes.append(fi.size)
 
+    def __len__(self):
+        return len(self.names)
 
-class ChildList:
-    def __init__(self):
-        self.list = {}
+    def __iter__(self):
+        return (FileItem(name, size) for name, size in zip(self.names, self.sizes))
 
-    def addChild(self, name: str) -> 'FileMap':
-        child = FileMap(name)
-        self.list[name] = child
-        return child
+    def _order(self):
+        """Indices of the files sorted by name."""
+        return sorted(range(len(self.names)), key=self.names.__getitem__)
 
-    def getChild(self, name: str) -> 'FileMap':
-        return self.list[name]
+    def toList(self):
+        names, sizes = self.names, self.sizes
+        return [{names[i]: {'size': sizes[i]}} for i in self._order()]
 
-    def names(self):
-        return self.list.keys()
+    def iterJSON(self, chunk=1000):
+        """Generate the JSON text of toList() by chunks of files."""
+        names, sizes = self.names, self.sizes
+        order = self._order()
+        for start in range(0, len(order), chunk):
+            yield '{}{}'.format(', ' if start else '', ', '.join(
+                '{{{}: {{"size": {}}}}}'.format(_encodeString(names[i]), _encode(sizes[i]))
+                for i in order[start:start + chunk]
+            ))
 
 
 class FileMap:
+    __slots__ = ('name', 'children', 'fileList')
+
     def __init__(self, name: str):
         self.name = name
+        # Name to FileMap, only created for folders with subfolders
         self.children = None
         self.fileList = None
 
@@ -93,13 +117,16 @@ class FileMap:
 
     def addChild(self, name: str) -> 'FileMap':
         if self.children is None:
-            self.children = ChildList()
-        return self.children.addChild(name)
+            self.children = {}
+        child = FileMap(name)
+        self.children[name] = child
+        return child
 
     def addFile(self, name: str, size: int):
         if self.fileList is None:
             self.fileList = FileList()
-        self.fileList.addFile(FileItem(name, size))
+        self.fileList.names.append(name)
+        self.fileList.sizes.append(size)
 
     def getFileList(self) -> FileList:
         return self.fileList
@@ -108,20 +135,68 @@ class FileMap:
         if self.children is None:
             return None
         else:
-            return self.children.getChild(name)
+            return self.children[name]
 
     def toDict(self, root=True):
         d = {}
         if self.fileList is not None:
             d['fileList'] = self.fileList.toList()
         if self.children is not None:
-            for name in self.children.names():
-                d[name] = self.getChild(name).toDict(root=False)
+            for name, child in self.children.items():
+                d[name] = child.toDict(root=False)
         if root:
             return {self.name: d}
         else:
             return d
 
+    def iterJSON(self, root=True):
+        """
+        Generate the JSON text of toDict() in chunks, straight from the tree.
+
+        Nothing but the chunks is allocated, so a listing can be written out
+        without holding its dict representation in memory.
+        """
+        if root:
+            yield '{{{}: '.format(_encode(self.name))
+        yield '{'
+        sep = ''
+        if self.fileList is not None:
+            yield '"fileList": ['
+            yield from self.fileList.iterJSON()
+            yield ']'
+            sep = ', '
+        if self.children is not None:
+            for name, child in self.children.items():
+                yield '{}{}: '.format(sep, _encode(name))
+                yield from child.iterJSON(root=False)
+                sep = ', '
+        yield '}'
+        if root:
+            yield '}'
+
+    def writeJSON(self, fp):
+        """Write the JSON text of toDict() to a file-like object."""
+        for chunk in self.iterJSON():
+            fp.write(chunk)
+
+    @staticmethod
+    def fromItems(items) -> Optional['FileMap']:
+        """Build a FileMap from ImportItems, as yielded by ImportProvider.iterFiles."""
+        stack = []
+        top = None
+        for item in items:
+            if item.type == ImportItem.FOLDER:
+                if len(stack) == 0:
+                    fm = FileMap(item.name)
+                else:
+                    fm = stack[-1].addChild(item.name)
+                stack.append(fm)
+            elif item.type == ImportItem.END_FOLDER:
+                top = stack.pop()
+            elif item.type == ImportItem.FILE:
+                stack[-1].addFile(item.name, item.size)
+        return top
+
     @staticmethod
     def fromDict(d: Dict):
         (name, value) = FileMap._checkSingleEntryDict(d)
@@ -0,0 +1,112 @@
+"""
+Streaming counterpart of FileMap.
+
+Instead of building the whole tree of a dataset in memory, the listing is
+produced entry by entry, straight from a provider's iterFiles generator.
+Each entry is a dict, serialized by the REST layer as one line of NDJSON:
+
+    {"type": "folder", "path": ["Dataset"], "name": "data"}
+    {"type": "file", "path": ["Dataset", "data"], "name": "a.csv", "size": 10}
+
+`path` holds the names of the folders above the entry, so the listed folder
+(the root of a dataset unless a path is given) is the entry with an empty path.
+Entries come in the provider's order, not sorted.
+"""
+from .import_item import ImportItem
+
+
+def select_items(items, path=None, depth=None):
+    """
+    Restrict a stream of ImportItems to a folder and its contents.
+
+    Reading from items stops as soon as the folder is closed.
+
+    :param items: ImportItems, as yielded by ImportProvider._listRecursive
+    :param path: Names of the folders leading from the root to the selected one,
+        the root by default
+    :param depth: If given, contents of folders nested deeper than `depth` levels
+        below the selected one are left out. With depth=0 only its files and
+        (empty) subfolders are kept.
+    :raises ValueError: If there's no folder at path
+    """
+    path = list(path or [])
+    items = iter(items)
+    stack = []
+    for item in items:
+        if item.type == ImportItem.FOLDER:
+            stack.append(item.name)
+            if stack[1:] == path:
+                yield from _subtree(item, items, depth)
+                return
+        elif item.type == ImportItem.END_FOLDER:
+            stack.pop()
+    raise ValueError('Folder "{}" not found.'.format('/'.join(path)))
+
+
+def _subtree(folder, items, depth):
+    yield folder
+    # Nesting of the current item below folder
+    level = 0
+    for item in items:
+        if item.type == ImportItem.FOLDER:
+            level += 1
+            if depth is None or level <= depth + 1:
+                yield item
+        elif item.type == ImportItem.END_FOLDER:
+            if depth is None or level <= depth + 1:
+                yield item
+            if level == 0:
+                return
+            level -= 1
+        elif depth is None or level <= depth:
+            yield item
+
+
+def hierarchy_node(hierarchy, path):
+    """
+    Return the folder at path of a {"+files+": [...], "<subfolder>": {...}}
+    hierarchy, as built by some providers from a flat list of files.
+
+    Folders are matched by their sanitized names, which are the ones listed.
+
+    :raises ValueError: If there's no folder at path
+    """
+    for name in path or []:
+        for key, child in hierarchy.items():
+            if key != '+files+' and ImportItem.sanitize_filename(key) == name:
+                hierarchy = child
+                break
+        else:
+            raise ValueError('Folder "{}" not found.'.format('/'.join(path)))
+    return hierarchy
+
+
+def iter_entries(items):
+    """Turn a stream of ImportItems into listing entries."""
+    path = []
+    for item in items:
+        if item.type == ImportItem.FOLDER:
+            yield {'type': 'folder', 'path': list(path), 'name': item.name}
+            path.append(item.name)
+        elif item.type == ImportItem.END_FOLDER:
+            path.pop()
+        else:
+            yield {'type': 'file', 'path': list(path), 'name': item.name, 'size': item.size}
+
+
+def make_cursor(index, offset):
+    """Cursor pointing at the entry `offset` of the dataset `index` of a request."""
+    return '{}:{}'.format(index, offset)
+
+
+def parse_cursor(cursor):
+    """Inverse of make_cursor, an empty cursor points at the start."""
+    if not cursor:
+        return 0, 0
+    try:
+        index, offset = (int(_) for _ in cursor.split(':'))
+    except ValueError:
+        raise ValueError('Invalid cursor "{}".'.format(cursor))
+    if index < 0 or offset < 0:
+        raise ValueError('Invalid cursor "{}".'.format(cursor))
+    return index, offset
@@ -0,0 +1,182 @@
+"""
+Recursive size and file count of registered folders.
+
+Registered (catalog) data is immutable, so the total size and number of
+files below a folder are computed once, when it is registered, and stored in
+its metadata. Readers should use `get_folder_sizes`, which falls back to
+traversing the folder tree (and stores the result) for folders registered
+before the rollup existed.
+"""
+from girder.constants import AccessType
+from girder.models.file import File
+from girder.models.folder import Folder
+from girder.models.item import Item
+
+SIZE_KEY = 'totalSize'
+COUNT_KEY = 'fileCount'
+
+
+def has_folder_size(folder):
+    meta = folder.get('meta') or {}
+    return SIZE_KEY in meta and COUNT_KEY in meta
+
+
+def set_folder_size(folder, size, count):
+    """Store the rollup in folder's metadata without touching its 'updated' time."""
+    Folder().update(
+        {'_id': folder['_id']},
+        {'$set': {'meta.' + SIZE_KEY: size, 'meta.' + COUNT_KEY: count}},
+        multi=False,
+    )
+    folder.setdefault('meta', {}).update({SIZE_KEY: size, COUNT_KEY: count})
+    return folder
+
+
+def increment_folder_size(folder, size, count=1):
+    """
+    Add size and count to the rollup of the folder and all its ancestors that
+    have one.
+    """
+    ids = []
+    while folder is not None and has_folder_size(folder):
+        ids.append(folder['_id'])
+        if folder.get('parentCollection') != 'folder':
+            break
+        folder = Folder().load(folder['parentId'], force=True)
+    _increment(ids, size, count)
+
+
+def _increment(ids, size, count):
+    if ids and (size or count):
+        Folder().update(
+            {'_id': {'$in': ids}},
+            {'$inc': {'meta.' + SIZE_KEY: size, 'meta.' + COUNT_KEY: count}},
+        )
+
+
+def update_folder_sizes(folders, size, count=1):
+    """
+    Add size and count to the rollups of the given folders. Folders that don't
+    have a rollup yet get it computed from scratch.
+    """
+    _increment([folder['_id'] for folder in folders if has_folder_size(folder)], size, count)
+    missing = [folder for folder in folders if not has_folder_size(folder)]
+    if missing:
+        sizes = compute_folder_sizes(missing)
+        for folder in missing:
+            set_folder_size(folder, *sizes[folder['_id']])
+
+
+# Number of ids per $in query
+BATCH_SIZE = 10000
+
+
+def batched(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), BATCH_SIZE):
+        yield ids[i:i + BATCH_SIZE]
+
+
+def _count_files(itemIds):
+    """Return the number of files of each item, keyed by item id."""
+    counts = {}
+    for batch in batched(itemIds):
+        for group in File().collection.aggregate([
+            {'$match': {'itemId': {'$in': batch}}},
+            {'$group': {'_id': '$itemId', 'count': {'$sum': 1}}},
+        ]):
+            counts[group['_id']] = group['count']
+    return counts
+
+
+def _compute_folder_sizes(folders, user=None):
+    """
+    See compute_folder_sizes. Also returns the set of ids of folders whose
+    size is partial, because the user cannot read some of their subfolders.
+    """
+    children = {}
+    restricted = set()
+    seen = {folder['_id'] for folder in folders}
+    level = list(seen)
+    while level:
+        subfolders = [
+            subfolder
+            for batch in batched(level)
+            for subfolder in Folder().find(
+                {'parentId': {'$in': batch}, 'parentCollection': 'folder'},
+                fields=['parentId', 'public', 'access']
+            )
+        ]
+        level = []
+        for subfolder in subfolders:
+            if user is not None and not Folder().hasAccess(
+                subfolder, user=user, level=AccessType.READ
+            ):
+                restricted.add(subfolder['parentId'])
+                continue
+            children.setdefault(subfolder['parentId'], []).append(subfolder['_id'])
+            if subfolder['_id'] not in seen:
+                seen.add(subfolder['_id'])
+                level.append(subfolder['_id'])
+
+    # Items keep the total size of their files
+    own = {folderId: [0, 0] for folderId in seen}
+    itemFolders = {}
+    for batch in batched(seen):
+        for item in Item().find(
+            {'folderId': {'$in': batch}}, fields=['folderId', 'size']
+        ):
+            own[item['folderId']][0] += item.get('size', 0)
+            itemFolders[item['_id']] = item['folderId']
+    for itemId, count in _count_files(itemFolders).items():
+        own[itemFolders[itemId]][1] += count
+
+    sizes = {}
+    partial = set()
+    for folder in folders:
+        size = count = 0
+        stack = [folder['_id']]
+        while stack:
+            folderId = stack.pop()
+            size += own[folderId][0]
+            count += own[folderId][1]
+            if folderId in restricted:
+                partial.add(folder['_id'])
+            stack += children.get(folderId, [])
+        sizes[folder['_id']] = (size, count)
+    return sizes, partial
+
+
+def compute_folder_sizes(folders, user=None):
+    """
+    Compute total size and number of files below each folder, traversing the
+    folder trees one level at a time.
+
+    :param folders: A list of folder documents
+    :param user: If provided, skip subfolders the user cannot read.
+    :return: A dict mapping folder ids to (size, count) tuples
+    """
+    return _compute_folder_sizes(folders, user=user)[0]
+
+
+def get_folder_sizes(folders, user=None):
+    """
+    Return (size, count) tuples for folders keyed by their ids, using stored
+    rollups where available.
+
+    Missing rollups are computed and stored, so that folders registered before
+    they existed are traversed only once. Sizes that exclude subfolders the
+    user cannot read are returned, but not stored.
+    """
+    sizes = {
+        folder['_id']: (folder['meta'][SIZE_KEY], folder['meta'][COUNT_KEY])
+        for folder in folders if has_folder_size(folder)
+    }
+    missing = [folder for folder in folders if folder['_id'] not in sizes]
+    if missing:
+        computed, partial = _compute_folder_sizes(missing, user=user)
+        for folder in missing:
+            if folder['_id'] not in partial:
+                set_folder_size(folder, *computed[folder['_id']])
+        sizes.update(computed)
+    return sizes
@@ -2,15 +2,14 @@ import os
 import re
 from typing import Tuple
 from urllib.parse import urlparse
-import requests
 
 from girder.models.item import Item
 from girder.models.folder import Folder
 
-from plugins.wholetale.server.lib.file_map import FileMap
 from ..import_providers import ImportProvider
 from ..entity import Entity
 from ..data_map import DataMap
+from ..http_client import SESSION
 from ..import_item import ImportItem
 from ...utils import deep_get
 
@@ -51,7 +50,7 @@ class GlobusImportProvider(ImportProvider):
             "advanced": False,
         }
 
-        req = requests.post(
+        req = SESSION.post(
             "https://search.api.globus.org/v1/index/mdf/search", json=data, headers=headers
         )
         req.raise_for_status()
@@ -73,21 +72,30 @@ class GlobusImportProvider(ImportProvider):
                 sz += item.size
         return sz
 
-    def listFiles(self, entity: Entity) -> FileMap:
-        stack = []
-        top = None
-        for item in self._listRecursive(entity.getUser(), entity.getValue(), None):
-            if item.type == ImportItem.FOLDER:
-                if len(stack) == 0:
-                    fm = FileMap(item.name)
-                else:
-                    fm = stack[-1].addChild(item.name)
-                stack.append(fm)
-            elif item.type == ImportItem.END_FOLDER:
-                top = stack.pop()
-            elif item.type == ImportItem.FILE:
-                stack[-1].addFile(item.name, item.size)
-        return top
+    def iterFiles(self, entity: Entity, path: list = None, depth: int = None):
+        endpoint, root, doi, title = self._extractMeta(entity.getValue())
+        tc = self.clients.getUserTransferClient(entity.getUser())
+        if path:
+            root = self._findDir(tc, endpoint, root, path)
+            yield ImportItem(ImportItem.FOLDER, name=path[-1])
+        else:
+            yield ImportItem(ImportItem.FOLDER, name=title, identifier='doi:' + doi)
+        yield from self._listRecursive2(tc, endpoint, root, depth=depth)
+        yield ImportItem(ImportItem.END_FOLDER)
+
+    @staticmethod
+    def _findDir(tc, endpoint: str, root: str, path: list) -> str:
+        """Return the endpoint path of a listed folder, looking it up a level at a time."""
+        for name in path:
+            if root[-1] != '/':
+                root = root + '/'
+            for entry in tc.operation_ls(endpoint, path=root):
+                if entry['type'] == 'dir' and ImportItem.sanitize_filename(entry['name']) == name:
+                    root = root + entry['name']
+                    break
+            else:
+                raise ValueError('Folder "{}" not found.'.format('/'.join(path)))
+        return root
 
     def _listRecursive(self, user, pid: str, name: str, base_url: str = None, progress=None):
         endpoint, path, doi, title = self._extractMeta(pid)
@@ -96,7 +104,7 @@ class GlobusImportProvider(ImportProvider):
         yield from self._listRecursive2(tc, endpoint, path, progress)
         yield ImportItem(ImportItem.END_FOLDER)
 
-    def _listRecursive2(self, tc, endpoint: str, path: str, progress=None):
+    def _listRecursive2(self, tc, endpoint: str, path: str, progress=None, depth=None):
         if path[-1] != '/':
             path = path + '/'
         if progress:
@@ -104,7 +112,11 @@ class GlobusImportProvider(ImportProvider):
         for entry in tc.operation_ls(endpoint, path=path):
             if entry['type'] == 'dir':
                 yield ImportItem(ImportItem.FOLDER, name=entry['name'])
-                yield from self._listRecursive2(tc, endpoint, path + entry['name'], progress)
+                # Subfolders past depth are listed without calling operation_ls on them
+                if depth is None or depth > 0:
+                    yield from self._listRecursive2(
+                        tc, endpoint, path + entry['name'], progress,
+                        None if depth is None else depth - 1)
                 yield ImportItem(ImportItem.END_FOLDER)
             elif entry['type'] == 'file':
                 yield ImportItem(
@@ -0,0 +1,72 @@
+"""
+Connection-pooled HTTP client shared by import providers.
+
+All outgoing requests to external repositories should go through `SESSION`,
+so that connections (and TLS sessions) to the same host are kept alive and
+reused across calls and threads, instead of being set up for every request.
+"""
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeouts in seconds, used unless a call passes its own
+DEFAULT_TIMEOUT = (10, 60)
+# Number of hosts for which a connection pool is kept
+POOL_CONNECTIONS = 32
+# Maximum number of concurrent connections to a single host
+POOL_MAXSIZE = 10
+USER_AGENT = 'Whole Tale'
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter applying a default timeout to all requests."""
+
+    def __init__(self, *args, timeout=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def _retry(total, backoff_factor):
+    kwargs = dict(
+        total=total,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        raise_on_status=False,
+    )
+    # Only idempotent requests are retried
+    methods = frozenset({'HEAD', 'GET', 'OPTIONS'})
+    try:
+        return Retry(allowed_methods=methods, **kwargs)
+    except TypeError:  # urllib3 < 1.26
+        return Retry(method_whitelist=methods, **kwargs)
+
+
+def create_session(retries=3, backoff_factor=0.5, timeout=DEFAULT_TIMEOUT,
+                   pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE):
+    """
+    Create a requests.Session with keep-alive connection pools, retries with
+    exponential backoff and default timeouts.
+
+    Requests for a host block when `pool_maxsize` connections to it are busy,
+    which bounds the load put on a single repository.
+    """
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    adapter = TimeoutHTTPAdapter(
+        timeout=timeout,
+        max_retries=_retry(retries, backoff_factor),
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=True,
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+SESSION = create_session()
@@ -1,17 +1,19 @@
 import os
 import pathlib
 import re
-import requests
 
 from urllib.parse import urlparse, unquote
 from girder.utility.model_importer import ModelImporter
 from girder.models.folder import Folder
+from girder.models.item import Item
 
+from .import_item import ImportItem
 from .import_providers import ImportProvider
 from .resolvers import DOIResolver
 from .entity import Entity
 from .data_map import DataMap
-from .file_map import FileMap
+from .http_client import SESSION
+from .folder_size import update_folder_sizes
 
 
 class HTTPImportProvider(ImportProvider):
@@ -29,7 +31,7 @@ class HTTPImportProvider(ImportProvider):
             # returns True, which, various errors aside, signifies a commitment
             # to the entity being legitimate from the perspective of this provider
             raise Exception('Unknown scheme %s' % url.scheme)
-        headers = requests.head(
+        headers = SESSION.head(
             pid, headers={'Accept-Encoding': 'identity'}).headers
 
         valid_target = 'Content-Length' in headers or 'Content-Range' in headers
@@ -49,23 +51,27 @@ class HTTPImportProvider(ImportProvider):
 
         return DataMap(pid, int(size), name=fname, repository=self.getName())
 
-    def listFiles(self, entity: Entity) -> FileMap:
+    def iterFiles(self, entity: Entity, path: list = None, depth: int = None):
+        # A single file, listed in a folder named after it
+        if path:
+            raise ValueError('Folder "{}" not found.'.format('/'.join(path)))
         dm = self.lookup(entity)
-        if dm is None:
-            return None
-        else:
-            fm = FileMap(dm.getName())
-            fm.addFile(entity.getValue(), dm.getSize())
-            return fm
+        yield ImportItem(ImportItem.FOLDER, dm.getName())
+        item = ImportItem(ImportItem.FILE, size=dm.getSize())
+        # The file is listed under its url, which isn't sanitized
+        item.name = entity.getValue()
+        yield item
+        yield ImportItem(ImportItem.END_FOLDER)
 
     def register(self, parent: object, parentType: str, progress, user, dataMap: DataMap,
-                 base_url: str = None):
+                 base_url: str = None, checkpoint=None, resume=None):
+        # A single file is registered at once, there's nothing to checkpoint
         uri = dataMap.getDataId()
         url = urlparse(uri)
         progress.update(increment=1, message='Processing file {}.'.format(uri))
         # Request basic info via HEAD, use 'identity' to avoid grabbing info about
         # zipped content
-        headers = requests.head(
+        headers = SESSION.head(
             uri, headers={'Accept-Encoding': 'identity'}).headers
         size = headers.get('Content-Length') or \
             headers.get('Content-Range').split('/')[-1]
@@ -87,6 +93,7 @@ class HTTPImportProvider(ImportProvider):
                 'provider': url.scheme.upper(),
             }
         )
+        folders = [parent]
 
         # Iterate over the path component of the url, creating a folder for each
         # part of the path
@@ -115,7 +122,11 @@ class HTTPImportProvider(ImportProvider):
                     'provider': url.scheme.upper(),
                 }
             )
+            folders.append(parent)
 
+        is_new = Item().findOne(
+            {'folderId': parent['_id'], 'name': dataMap.getName()}, fields=['_id']
+        ) is None
         fileModel = ModelImporter.model('file')
         fileDoc = fileModel.createLinkFile(
             url=uri, parent=parent, name=dataMap.getName(), parentType='folder',
@@ -128,8 +139,17 @@ class HTTPImportProvider(ImportProvider):
             gc_file['itemId'], force=True)
         gc_item['meta'] = {'identifier': uri, 'provider': url.scheme.upper()}
         gc_item = ModelImporter.model('item').updateItem(gc_item)
+        # Host and path folders are shared between registered urls
+        update_folder_sizes(folders, int(size) if is_new else 0, int(is_new))
         return ('item', gc_item)
 
+    def sync(self, parent: object, parentType: str, progress, user, dataMap: DataMap,
+             base_url: str = None, prune: bool = False, checkpoint=None, resume=None):
+        # A single file, there's nothing to compare
+        objType, obj = self.register(parent, parentType, progress, user, dataMap,
+                                     base_url=base_url)
+        return objType, obj, None
+
     def getDatasetUID(self, doc: object, user: object) -> str:
         if 'folderId' in doc:
             return doc['meta']['identifier']  # for http that's it...
@@ -1,8 +1,11 @@
+
 from girder.utility.model_importer import ModelImporter
 
 from .entity import Entity
 from .data_map import DataMap
 from .file_map import FileMap
+from .bulk_register import BulkRegistration
+from .file_stream import select_items
 from .import_item import ImportItem
 
 
@@ -36,8 +39,30 @@ class ImportProvider:
     def lookup(self, entity: Entity) -> DataMap:
         raise NotImplementedError()
 
-    def listFiles(self, entity: Entity) -> FileMap:
-        raise NotImplementedError()
+    def listFiles(self, entity: Entity, path: list = None, depth: int = None) -> FileMap:
+        """
+        List files of a dataset, or of one of its folders.
+
+        :param path: Names of the folders leading from the root of the dataset to
+            the listed one, the root by default
+        :param depth: If given, contents of folders nested deeper than that below
+            the listed one are left out, depth=0 lists a single level.
+        """
+        return FileMap.fromItems(self.iterFiles(entity, path=path, depth=depth))
+
+    def iterFiles(self, entity: Entity, path: list = None, depth: int = None):
+        """
+        Stream the files of a dataset as ImportItems, without building a FileMap.
+
+        See listFiles for path and depth. Providers that can list a folder without
+        walking the whole dataset should override this, by default the whole
+        listing is read up to the selected folder and filtered.
+        """
+        items = self._listRecursive(
+            entity.getUser(), entity.getValue(), None, base_url=entity['base_url'])
+        if path or depth is not None:
+            items = select_items(items, path, depth)
+        return items
 
     def getDatasetUID(self, doc: object, user: object) -> str:
         """Given a registered object, return dataset DOI"""
@@ -52,44 +77,46 @@ class ImportProvider:
         raise NotImplementedError()
 
     def register(self, parent: object, parentType: str, progress, user, dataMap: DataMap,
-                 base_url: str = None):
-        stack = [(parent, parentType)]
-        pid = dataMap.getDataId()
-        name = dataMap.getName()
-        rootObj = None
-        rootType = None
-
-        for item in self._listRecursive(user, pid, name, base_url, progress=progress):
-            if item.type == ImportItem.FOLDER:
-                (obj, objType) = self._registerFolder(stack, item, user)
-            elif item.type == ImportItem.END_FOLDER:
-                stack.pop()
-            elif item.type == ImportItem.FILE:
-                (obj, objType) = self._registerFile(stack, item, user)
-            else:
-                raise Exception('Unknown import item type: %s' % item.type)
-            if rootObj is None:
-                rootObj = obj
-                rootType = objType
-
-        return rootType, rootObj
-
-    def _registerFolder(self, stack, item: ImportItem, user):
-        (parent, parentType) = stack[-1]
-        folder = self.folderModel.createFolder(parent, item.name, description='',
-                                               parentType=parentType, creator=user,
-                                               reuseExisting=True)
-        meta = {
-            "identifier": item.identifier,
-            "provider": self.getName(),
-        }
-        if item.meta:
-            meta.update(item.meta)
-        folder = self.folderModel.setMetadata(folder, meta)
-        stack.append((folder, 'folder'))
-        return (folder, 'folder')
+                 base_url: str = None, checkpoint=None, resume=None):
+        """
+        Register a dataset below parent.
+
+        :param checkpoint: Called with the state of the registration each time
+            a batch of it is committed.
+        :param resume: The last state passed to checkpoint by an interrupted
+            registration of the same dataset, which is then continued.
+        :return: (objType, obj) of the registered dataset
+        """
+        registration = BulkRegistration(self, parent, parentType, user, checkpoint=checkpoint)
+        return self._register(registration, user, dataMap, base_url, progress, resume)
+
+    def sync(self, parent: object, parentType: str, progress, user, dataMap: DataMap,
+             base_url: str = None, prune: bool = False, checkpoint=None, resume=None):
+        """
+        Register a dataset again, writing only what changed since the last time.
+
+        :param prune: Also remove files and folders that are no longer listed.
+        :return: (objType, obj, summary), where summary counts the changes
+        """
+        registration = BulkRegistration(self, parent, parentType, user, sync=True, prune=prune,
+                                        checkpoint=checkpoint)
+        objType, obj = self._register(registration, user, dataMap, base_url, progress, resume)
+        return objType, obj, registration.summary
+
+    def _register(self, registration, user, dataMap, base_url, progress, resume):
+        listing = self._listRecursive(
+            user, dataMap.getDataId(), dataMap.getName(), base_url, progress=progress)
+        # Items committed before the interruption are skipped, not written again,
+        # unless the dataset changed in the meantime
+        if resume is not None and not registration.resume(listing, resume):
+            listing = self._listRecursive(
+                user, dataMap.getDataId(), dataMap.getName(), base_url, progress=progress)
+        for item in listing:
+            registration.add(item)
+        return registration.finish()
 
     def _registerFile(self, stack, item: ImportItem, user):
+        """Register a single file, see BulkRegistration for the bulk path."""
         (parent, parentType) = stack[-1]
         gitem = self.itemModel.createItem(item.name, user, parent, reuseExisting=True)
         meta = {'provider': self.getName()}
@@ -1,13 +1,18 @@
 import os
 
+from bson.objectid import ObjectId, InvalidId
 from girder import logger
+from girder.models.file import File
 from girder.models.folder import Folder
+from girder.models.item import Item
 from girder.utility.model_importer import ModelImporter
 from girder.exceptions import ValidationException
 from girder.constants import AccessType
 from gwvolman.constants import REPO2DOCKER_VERSION
 
+from .folder_size import batched, get_folder_sizes
 from .license import WholeTaleLicense
+from .workspace_snapshot import WorkspaceSnapshot
 from . import IMPORT_PROVIDERS
 
 
@@ -20,17 +25,23 @@ class Manifest:
     create<someProperty>
     """
 
-    def __init__(self, tale, user, expand_folders=False):
+    # Providers whose items all share the dataset UID of their folder
+    FOLDER_UID_PROVIDERS = frozenset(('DataONE', 'Dataverse', 'Zenodo', 'Globus'))
+
+    def __init__(self, tale, user, expand_folders=False, workspace_snapshot=None):
         """
         Initialize the manifest document with base variables
         :param tale: The Tale whose data is being serialized
         :param user: The user requesting the manifest document
         :param expand_folders: If True, when encountering a folder
             in the external data, return all child items recursively.
+        :param workspace_snapshot: Optional WorkspaceSnapshot of the Tale's workspace,
+            allows to share a single walk of the workspace with the caller.
         """
         self.tale = tale
         self.user = user
         self.expand_folders = expand_folders
+        self.workspace_snapshot = workspace_snapshot
 
         self.validate()
         self.manifest = dict()
@@ -242,14 +253,10 @@ class Manifest:
             self.tale["workspaceId"], user=self.user, level=AccessType.READ
         )
         if workspace and "fsPath" in workspace:
-            workspace_rootpath = workspace["fsPath"]
-            if not workspace_rootpath.endswith("/"):
-                workspace_rootpath += "/"
-
-            for curdir, _, files in os.walk(workspace_rootpath):
-                for fname in files:
-                    wfile = os.path.join(curdir, fname).replace(workspace_rootpath, "")
-                    self.manifest['aggregates'].append({'uri': '../workspace/' + wfile})
+            if self.workspace_snapshot is None:
+                self.workspace_snapshot = WorkspaceSnapshot(workspace["fsPath"])
+            for entry in self.workspace_snapshot:
+                self.manifest['aggregates'].append({'uri': '../workspace/' + entry.relpath})
 
         """
         Handle objects that are in the dataSet, ie files that point to external sources.
@@ -281,33 +288,138 @@ class Manifest:
 
     def _expand_folder_into_items(self, folder, user, relpath=''):
         """
-        Recursively handle data folder and return all child items as ext objs
+        Generate ext objs for all items below a data folder
 
-        In a perfect world there should be a better place for this...
+        The folder tree is traversed breadth-first, a level at a time, with
+        batched queries for all the items and all the subfolders of a level.
+        Within a level, folders keep the order of their parents and items and
+        subfolders are sorted by name.
         """
-        curpath = os.path.join(relpath, folder['name'])
-        dataSet = []
-        ext = []
-        for item in Folder().childItems(folder, user=user):
-            dataSet.append({
-                'itemId': item['_id'],
-                '_modelType': 'item',
-                'mountPath': os.path.join(curpath, item['name'])
-            })
+        level = [(folder, os.path.join(relpath, folder['name']))]
+        while level:
+            paths = {subfolder['_id']: curpath for subfolder, curpath in level}
+            items = {}
+            subfolders = {}
+            for batch in batched(paths):
+                for item in Item().find(
+                    {'folderId': {'$in': batch}}, fields=['folderId', 'name', 'lowerName']
+                ):
+                    items.setdefault(item['folderId'], []).append(item)
+                for subfolder in Folder().find(
+                    {'parentId': {'$in': batch}, 'parentCollection': 'folder'},
+                    fields=['parentId', 'name', 'lowerName', 'public', 'access']
+                ):
+                    subfolders.setdefault(subfolder['parentId'], []).append(subfolder)
+
+            dataSet = [
+                {
+                    'itemId': item['_id'],
+                    '_modelType': 'item',
+                    'mountPath': os.path.join(paths[folderId], item['name']),
+                    'relpath': paths[folderId],
+                }
+                for folderId in paths
+                for item in sorted(items.get(folderId, []), key=lambda _: _['lowerName'])
+            ]
+            for batch in batched(dataSet):
+                ext, _ = self._parse_dataSet(dataSet=batch)
+                yield from ext
+
+            level = [
+                (subfolder, os.path.join(paths[folderId], subfolder['name']))
+                for folderId in paths
+                for subfolder in sorted(
+                    subfolders.get(folderId, []), key=lambda _: _['lowerName'])
+                if Folder().hasAccess(subfolder, user=user, level=AccessType.READ)
+            ]
 
-        if dataSet:
-            ext, _ = self._parse_dataSet(dataSet=dataSet, relpath=curpath)
+    @staticmethod
+    def _object_id(value):
+        try:
+            return ObjectId(value)
+        except (InvalidId, TypeError):
+            raise ValidationException('Invalid ObjectId: {}'.format(value))
+
+    @staticmethod
+    def _find_by_ids(model, ids, **kwargs):
+        if not ids:
+            return {}
+        return {
+            doc['_id']: doc
+            for doc in model.find({'_id': {'$in': list(set(ids))}}, **kwargs)
+        }
 
-        for subfolder in Folder().childFolders(
-            folder, parentType='folder', user=user
-        ):
-            ext += self._expand_folder_into_items(subfolder, user, relpath=curpath)
-        return ext
+    def _bulk_load_dataSet(self, dataSet):
+        """
+        Fetch all documents referenced by `dataSet` using a few `$in` queries.
+
+        Returns:
+            docs: A dict mapping ids of dataSet entries to their documents
+            parents: A dict mapping ids of the items' parent folders to their documents
+            files: A dict mapping item ids to their first file
+        """
+        ids = {'item': [], 'folder': []}
+        for obj in dataSet:
+            ids.setdefault(obj['_modelType'], []).append(self._object_id(obj['itemId']))
+
+        docs = self._find_by_ids(Item(), ids['item'])
+        folders = self._find_by_ids(Folder(), ids['folder'])
+        parents = self._find_by_ids(Folder(), [_['folderId'] for _ in docs.values()])
+        files = {}
+        if docs:
+            for fileObj in File().find({'itemId': {'$in': list(docs)}}):
+                files.setdefault(fileObj['itemId'], fileObj)
+        docs.update(folders)
+        return docs, parents, files
+
+    def _check_dataSet_entry(self, obj, docs, parents):
+        """Return the document of a dataSet entry the user can read."""
+        doc = docs.get(self._object_id(obj['itemId']))
+        if doc is None or obj['_modelType'] not in ('item', 'folder'):
+            raise ValidationException('No such {}: {}'.format(
+                obj['_modelType'], obj['itemId']))
+        if obj['_modelType'] == 'item':
+            folder = parents.get(doc['folderId'])
+            if folder is None:
+                raise ValidationException('No such folder: {}'.format(doc['folderId']))
+        else:
+            folder = doc
+        Folder().requireAccess(folder, user=self.user, level=AccessType.READ)
+        return doc
+
+    def _get_dataset_uid(self, doc, provider_name, item_uids):
+        """
+        Return the UID of the dataset a document belongs to.
+
+        For providers in FOLDER_UID_PROVIDERS, UIDs of items are cached in
+        `item_uids` by folder. Other providers (e.g. HTTP, where each item is
+        its own dataset) are asked for every item.
+        """
+        provider = IMPORT_PROVIDERS.providerMap[provider_name]
+        if 'folderId' not in doc or provider_name not in self.FOLDER_UID_PROVIDERS:
+            return provider.getDatasetUID(doc, self.user)
+        key = (provider_name, doc['folderId'])
+        if key not in item_uids:
+            item_uids[key] = provider.getDatasetUID(doc, self.user)
+        return item_uids[key]
+
+    def _get_folder_size(self, doc, docs, folder_sizes):
+        """
+        Return the size of a dataSet folder. Sizes of all the folders in
+        `docs` are fetched into `folder_sizes` at once, on first use.
+        """
+        if not folder_sizes:
+            folder_sizes.update(get_folder_sizes(
+                [_ for _ in docs.values() if 'folderId' not in _], user=self.user
+            ))
+        return folder_sizes[doc['_id']][0]
 
     def _parse_dataSet(self, dataSet=None, relpath=''):
         """
         Get the basic info about the contents of `dataSet`
 
+        Entries may carry a 'relpath' overriding the `relpath` argument.
+
         Returns:
             external_objects: A list of objects that represent externally defined data
             dataset_top_identifiers: A set of DOIs for top-level packages that contain
@@ -317,17 +429,20 @@ class Manifest:
         if dataSet is None:
             dataSet = self.tale['dataSet']
 
+        docs, parents, files = self._bulk_load_dataSet(dataSet)
+        folder_sizes = {}
+        item_uids = {}
+
         dataset_top_identifiers = set()
         external_objects = []
         for obj in dataSet:
             try:
-                doc = ModelImporter.model(obj['_modelType']).load(
-                    obj['itemId'], user=self.user, level=AccessType.READ, exc=True)
+                doc = self._check_dataSet_entry(obj, docs, parents)
                 provider_name = doc['meta']['provider']
                 if provider_name.startswith('HTTP'):
                     provider_name = 'HTTP'  # TODO: handle HTTPS to make it unnecessary
                 provider = IMPORT_PROVIDERS.providerMap[provider_name]
-                top_identifier = provider.getDatasetUID(doc, self.user)
+                top_identifier = self._get_dataset_uid(doc, provider_name, item_uids)
                 if top_identifier:
                     dataset_top_identifiers.add(top_identifier)
 
@@ -335,7 +450,7 @@ class Manifest:
                     'dataset_identifier': top_identifier,
                     'provider': provider_name,
                     '_modelType': obj['_modelType'],
-                    'relpath': relpath
+                    'relpath': obj.get('relpath', relpath)
                 }
 
                 if obj['_modelType'] == 'folder':
@@ -350,14 +465,10 @@ class Manifest:
                     else:
                         ext_obj['uri'] = provider.getURI(doc, self.user)
                         #  Find path to root?
-                    ext_obj['size'] = 0
-                    for _, f in Folder().fileList(
-                        doc, user=self.user, subpath=False, data=False
-                    ):
-                        ext_obj['size'] += f['size']
+                    ext_obj['size'] = self._get_folder_size(doc, docs, folder_sizes)
 
                 elif obj['_modelType'] == 'item':
-                    fileObj = self.itemModel.childFiles(doc)[0]
+                    fileObj = files[doc['_id']]
                     ext_obj.update({
                         'name': fileObj['name'],
                         'uri': fileObj['linkUrl'],
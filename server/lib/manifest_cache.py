@@ -0,0 +1,119 @@
+from collections import OrderedDict
+import copy
+import threading
+
+from girder.constants import AccessType
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.user import User
+
+from .manifest import Manifest
+from .workspace_snapshot import WorkspaceSnapshot
+
+
+class ManifestCache:
+    """
+    LRU cache of generated Tale manifests.
+
+    Entries are keyed by the Tale's last update, the requesting user, the
+    expand_folders flag, a fingerprint of the workspace, the profile of the
+    Tale's creator and which of the Tale's datasets the user can read, so any
+    change to what ends up in the manifest results in a miss. Tale updates
+    also drop entries eagerly via `invalidate`, so stale manifests don't
+    occupy the cache.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _workspace_snapshot(tale):
+        workspace = Folder().load(tale['workspaceId'], force=True)
+        if workspace and 'fsPath' in workspace:
+            return WorkspaceSnapshot(workspace['fsPath'])
+
+    @staticmethod
+    def _creator_key(tale):
+        creator = User().load(
+            tale['creatorId'], force=True, fields=['email', 'firstName', 'lastName'])
+        if creator:
+            return creator.get('email'), creator.get('firstName'), creator.get('lastName')
+
+    @staticmethod
+    def _access_key(tale, user):
+        """Ids of the folders holding the Tale's datasets, with whether user can read them."""
+        ids = {'item': [], 'folder': []}
+        for obj in tale.get('dataSet', []):
+            ids.setdefault(obj['_modelType'], []).append(Manifest._object_id(obj['itemId']))
+        folderIds = [_['folderId'] for _ in Item().find(
+            {'_id': {'$in': ids['item']}}, fields=['folderId'])] if ids['item'] else []
+        folderIds += ids['folder']
+        if not folderIds:
+            return ()
+        return tuple(sorted(
+            (str(folder['_id']), Folder().hasAccess(folder, user=user, level=AccessType.READ))
+            for folder in Folder().find(
+                {'_id': {'$in': folderIds}}, fields=['access', 'public'])
+        ))
+
+    def get(self, tale, user, expand_folders=False):
+        """
+        Return the manifest of the Tale, generating it only if necessary.
+
+        The returned document is a copy, callers are free to modify it.
+        """
+        snapshot = self._workspace_snapshot(tale)
+        key = (
+            str(tale['_id']),
+            str(user['_id']) if user else None,
+            str(tale['updated']),
+            bool(expand_folders),
+            snapshot.fingerprint() if snapshot else None,
+            self._creator_key(tale),
+            self._access_key(tale, user),
+        )
+        with self._lock:
+            manifest = self._cache.get(key)
+            if manifest is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(manifest)
+            self.misses += 1
+
+        manifest = Manifest(
+            tale, user, expand_folders=expand_folders, workspace_snapshot=snapshot
+        ).manifest
+        with self._lock:
+            self._cache[key] = manifest
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return copy.deepcopy(manifest)
+
+    def invalidate(self, taleId):
+        """Drop all cached manifests of a Tale."""
+        taleId = str(taleId)
+        with self._lock:
+            for key in [_ for _ in self._cache if _[0] == taleId]:
+                del self._cache[key]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._cache),
+                'maxsize': self.maxsize,
+            }
+
+
+MANIFEST_CACHE = ManifestCache()
@@ -0,0 +1,106 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import mimetypes
+import os
+import threading
+
+import magic
+
+
+DEFAULT_MIMETYPE = 'application/octet-stream'
+
+
+class MimeTypeDetector:
+    """
+    Detect mimetypes of local files.
+
+    The mimetype is guessed from the file extension first. Only if that's
+    ambiguous (unknown extension, generic type or a compressed file) the
+    beginning of the file is sniffed with libmagic. Results of sniffing are
+    cached by content hash, so identical files are examined only once.
+    """
+
+    # Types that an extension doesn't tell much about
+    ambiguous = {None, DEFAULT_MIMETYPE}
+    header_size = 64 * 1024
+
+    def __init__(self, cache_size=10000):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def magic(self):
+        # libmagic handles are not thread safe, use one per thread
+        if not hasattr(self._local, 'magic'):
+            self._local.magic = magic.Magic(mime=True, uncompress=True)
+        return self._local.magic
+
+    def _cache_get(self, checksum):
+        with self._lock:
+            try:
+                self._cache.move_to_end(checksum)
+                return self._cache[checksum]
+            except KeyError:
+                return None
+
+    def _cache_set(self, checksum, mimetype):
+        with self._lock:
+            self._cache[checksum] = mimetype
+            self._cache.move_to_end(checksum)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def sniff(self, fullpath):
+        with open(fullpath, 'rb') as fp:
+            header = fp.read(self.header_size)
+        return self.magic.from_buffer(header) or DEFAULT_MIMETYPE
+
+    def detect(self, fullpath, checksum=None):
+        """
+        Return mimetype of a file.
+
+        :param fullpath: Path to the file
+        :param checksum: Optional content hash of the file used as a cache key
+        """
+        mimetype, encoding = mimetypes.guess_type(fullpath, strict=False)
+        if mimetype not in self.ambiguous and encoding is None:
+            return mimetype
+
+        if checksum is not None:
+            cached = self._cache_get(checksum)
+            if cached is not None:
+                return cached
+        mimetype = self.sniff(fullpath)
+        if checksum is not None:
+            self._cache_set(checksum, mimetype)
+        return mimetype
+
+    def detect_many(self, files, workers=0):
+        """
+        Return mimetypes for a list of (fullpath, checksum) tuples, in order.
+
+        Files sharing a checksum and an extension are detected only once.
+
+        :param workers: If > 0, files are sniffed using a pool of threads.
+        """
+        files = list(files)
+        keys = [
+            (fullpath, None) if checksum is None
+            else (os.path.splitext(fullpath)[1].lower(), checksum)
+            for fullpath, checksum in files
+        ]
+        unique = OrderedDict()
+        for key, args in zip(keys, files):
+            unique.setdefault(key, args)
+        if workers < 1:
+            detected = [self.detect(*args) for args in unique.values()]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                detected = list(executor.map(lambda args: self.detect(*args), unique.values()))
+        detected = dict(zip(unique, detected))
+        return [detected[key] for key in keys]
+
+
+MIMETYPE_DETECTOR = MimeTypeDetector()
@@ -15,5 +15,8 @@ class NullImportProvider(ImportProvider):
     def lookup(self, entity: Entity) -> DataMap:
         raise RestException('Failed to interpret "%s" in any meaningful way' % entity.getValue())
 
-    def listFiles(self, entity: Entity) -> FileMap:
+    def listFiles(self, entity: Entity, path: list = None, depth: int = None) -> FileMap:
+        raise RestException('Failed to interpret "%s" in any meaningful way' % entity.getValue())
+
+    def iterFiles(self, entity: Entity, path: list = None, depth: int = None):
         raise RestException('Failed to interpret "%s" in any meaningful way' % entity.getValue())
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class ResolutionCache:
+    """
+    Two level TTL cache of link resolutions.
+
+    The first level is an in-memory LRU. The optional second level is a store
+    shared between processes (see models.redirect_cache.RedirectCache).
+    Failed resolutions are cached too (negative caching), but for a much shorter
+    time, so transient errors don't stick.
+
+    :param maxsize: Maximum number of entries kept in memory.
+    :param ttl: Lifetime of successful resolutions in seconds.
+    :param negative_ttl: Lifetime of failed resolutions in seconds.
+    """
+
+    def __init__(self, maxsize=4096, ttl=7 * 24 * 3600, negative_ttl=600, store=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.store = store
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = dict.fromkeys(
+            ('hits', 'shared_hits', 'negative_hits', 'misses', 'store_errors'), 0
+        )
+
+    def _count(self, metric):
+        with self._lock:
+            self._metrics[metric] += 1
+
+    def _remember(self, link, target, negative, expires):
+        with self._lock:
+            self._cache[link] = (target, negative, expires)
+            self._cache.move_to_end(link)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def get(self, link, resolve):
+        """
+        Return the resolution of a link, calling resolve(link) only on a miss.
+
+        :param resolve: A callable returning a (target, negative) tuple.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(link)
+            if entry is not None and entry[2] <= now:
+                del self._cache[link]
+                entry = None
+            if entry is not None:
+                self._cache.move_to_end(link)
+        if entry is not None:
+            self._count('negative_hits' if entry[1] else 'hits')
+            return entry[0]
+
+        if self.store is not None:
+            try:
+                shared = self.store.lookup(link)
+            except Exception:
+                self._count('store_errors')
+                shared = None
+            if shared is not None:
+                target, negative, ttl = shared
+                self._count('negative_hits' if negative else 'shared_hits')
+                self._remember(link, target, negative, now + ttl)
+                return target
+
+        self._count('misses')
+        target, negative = resolve(link)
+        ttl = self.negative_ttl if negative else self.ttl
+        self._remember(link, target, negative, now + ttl)
+        if self.store is not None:
+            try:
+                self.store.store(link, target, negative, ttl)
+            except Exception:
+                self._count('store_errors')
+        return target
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            for metric in self._metrics:
+                self._metrics[metric] = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+            stats.update(size=len(self._cache), maxsize=self.maxsize,
+                         shared=self.store is not None)
+            return stats
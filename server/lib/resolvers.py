@@ -1,8 +1,10 @@
 import re
 from .entity import Entity
+from .http_client import SESSION
+from .resolution_cache import ResolutionCache
 from typing import Optional
-import contextlib
-from urllib.request import HTTPRedirectHandler, build_opener, Request
+
+import requests
 
 """Regex that matches:
 
@@ -26,15 +28,8 @@ _DOI_RESOLVERS_RE = re.compile(
 )
 
 
-class RedirectHandler(HTTPRedirectHandler):
-    last_url = None
-
-    def redirect_request(self, req, fp, code, msg, hdrs, newurl):
-        self.last_url = newurl
-        r = HTTPRedirectHandler.redirect_request(
-            self, req, fp, code, msg, hdrs, newurl)
-        r.get_method = lambda: 'HEAD'
-        return r
+# Shared by all DOIResolver instances, see DOIResolver.follow_redirects
+RESOLUTION_CACHE = ResolutionCache()
 
 
 class Resolver:
@@ -73,16 +68,25 @@ class DOIResolver(Resolver):
 
     @staticmethod
     def follow_redirects(link):
-        """Follow redirects recursively."""
-        redirect_handler = RedirectHandler()
-        opener = build_opener(redirect_handler)
-        req = Request(link)
-        req.get_method = lambda: 'HEAD'
+        """Follow redirects recursively, results are cached in RESOLUTION_CACHE."""
+        return RESOLUTION_CACHE.get(link, DOIResolver._follow_redirects)
+
+    @staticmethod
+    def _follow_redirects(link):
+        """Return the final url and whether the resolution should be considered failed."""
         try:
-            with contextlib.closing(opener.open(req, timeout=5)) as site:
-                return site.url
+            resp = SESSION.head(link, allow_redirects=True, timeout=5)
+        except requests.RequestException as exc:
+            # Report the last url of the redirect chain we managed to reach
+            failed_url = exc.request.url if exc.request is not None else None
+            if failed_url and failed_url != requests.Request('HEAD', link).prepare().url:
+                return failed_url, True
+            return link, True
         except Exception:
-            return redirect_handler.last_url if redirect_handler.last_url else link
+            return link, True
+        if not resp.history:
+            return link, True
+        return resp.url, resp.status_code >= 400
 
     @staticmethod
     def extractDOI(url: str):
@@ -0,0 +1,99 @@
+import os
+from collections import namedtuple
+from hashlib import sha256
+
+
+WorkspaceEntry = namedtuple('WorkspaceEntry', ['fullpath', 'relpath', 'stat'])
+
+
+class WorkspaceSnapshot:
+    """
+    Listing of all files in a workspace directory along with their stat info.
+
+    The directory tree is walked once, on first access, using os.scandir, which
+    avoids additional metadata syscalls for each entry. Files are listed in the
+    same order as os.walk would produce.
+    """
+
+    def __init__(self, rootpath):
+        if not rootpath.endswith('/'):
+            rootpath += '/'
+        self.rootpath = rootpath
+        self._entries = None
+        self._stats = None
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = list(self._walk(self.rootpath))
+        return self._entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """Return a dict mapping relative paths to os.stat_result."""
+        if self._stats is None:
+            self._stats = {entry.relpath: entry.stat for entry in self.entries}
+        return self._stats
+
+    def fingerprint(self):
+        """Return a digest that changes whenever a file is added, removed or modified."""
+        digest = sha256()
+        for entry in self.entries:
+            digest.update('{}\0{}\0{}\0{}\n'.format(
+                entry.relpath, entry.stat.st_size, entry.stat.st_mtime_ns, entry.stat.st_ino
+            ).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _is_dir(dir_entry):
+        try:
+            return dir_entry.is_dir()
+        except OSError:
+            return False
+
+    @staticmethod
+    def _stat(dir_entry):
+        """Return the stat of an entry (of the link if broken), None if it vanished."""
+        try:
+            return dir_entry.stat()
+        except OSError:
+            pass
+        try:
+            return dir_entry.stat(follow_symlinks=False)
+        except OSError:
+            return None
+
+    def _walk(self, top):
+        try:
+            it = os.scandir(top)
+        except OSError:
+            return
+        subdirs = []
+        with it:
+            while True:
+                try:
+                    dir_entry = next(it)
+                except StopIteration:
+                    break
+                except OSError:
+                    # As os.walk, keep what was listed so far
+                    break
+                if self._is_dir(dir_entry):
+                    # As os.walk, symlinks to directories are listed but not followed
+                    if not dir_entry.is_symlink():
+                        subdirs.append(dir_entry.path)
+                    continue
+                # Entries can vanish or become unreadable while walking, skip only those
+                stat = self._stat(dir_entry)
+                if stat is None:
+                    continue
+                yield WorkspaceEntry(
+                    dir_entry.path, dir_entry.path[len(self.rootpath):], stat
+                )
+        for subdir in subdirs:
+            yield from self._walk(subdir)
@@ -1,6 +1,8 @@
 import requests
 from girder.exceptions import RestException
 
+from ..http_client import SESSION
+
 
 class ZenodoVerificator:
     def __init__(self, resource_server, key):
@@ -17,9 +19,9 @@ class ZenodoVerificator:
             "Content-Type": "application/json",
         }
         try:
-            r = requests.post(self.create_deposition_url, data="{}", headers=headers)
+            r = SESSION.post(self.create_deposition_url, data="{}", headers=headers)
             r.raise_for_status()
-            r = requests.delete(
+            r = SESSION.delete(
                 self.delete_deposition_url.format(r.json()["id"]), headers=headers
             )
             r.raise_for_status()
@@ -1,8 +1,6 @@
 import pathlib
 import re
-import requests
 from urllib.parse import urlparse, urlunparse
-from urllib.request import urlopen
 
 from girder.models.folder import Folder
 from girder.models.item import Item
@@ -10,9 +8,10 @@ from girder.models.setting import Setting
 
 from ..import_providers import ImportProvider
 from ..data_map import DataMap
-from ..file_map import FileMap
+from ..file_stream import hierarchy_node
 from ..import_item import ImportItem
 from ..entity import Entity
+from ..http_client import SESSION
 from ... import constants
 from ...models.tale import Tale
 
@@ -53,7 +52,7 @@ class ZenodoImportProvider(ImportProvider):
     def _get_record(self, raw_url):
         url = urlparse(raw_url)
         record_id = url.path.rsplit("/", maxsplit=1)[1]
-        req = requests.get(
+        req = SESSION.get(
             urlunparse(url._replace(path="/api/records/" + record_id)),
             headers={
                 "accept": "application/vnd.zenodo.v1+json",
@@ -98,12 +97,9 @@ class ZenodoImportProvider(ImportProvider):
         file_url = file_ref["links"]["self"]
 
         def stream_zipfile(chunk_size):
-            with urlopen(file_url) as src:
-                while True:
-                    data = src.read(chunk_size)
-                    if not data:
-                        break
-                    yield data
+            with SESSION.get(file_url, stream=True) as src:
+                src.raise_for_status()
+                yield from src.iter_content(chunk_size)
 
         publishInfo = [
             {
@@ -151,21 +147,16 @@ class ZenodoImportProvider(ImportProvider):
             tale=self._is_tale(record),
         )
 
-    def listFiles(self, entity: Entity) -> FileMap:
-        stack = []
-        top = None
-        for item in self._listRecursive(entity.getUser(), entity.getValue(), None):
-            if item.type == ImportItem.FOLDER:
-                if len(stack) == 0:
-                    fm = FileMap(item.name)
-                else:
-                    fm = stack[-1].addChild(item.name)
-                stack.append(fm)
-            elif item.type == ImportItem.END_FOLDER:
-                top = stack.pop()
-            elif item.type == ImportItem.FILE:
-                stack[-1].addFile(item.name, item.size)
-        return top
+    def iterFiles(self, entity: Entity, path: list = None, depth: int = None):
+        # The record lists all the files, only the selected folder is walked
+        record = self._get_record(entity.getValue())
+        hierarchy = hierarchy_node(self._files_to_hierarchy(record["files"]), path)
+        if path:
+            yield ImportItem(ImportItem.FOLDER, name=path[-1])
+        else:
+            yield self._rootItem(entity.getValue(), record)
+        yield from self._recurseHierarchy(hierarchy, depth)
+        yield ImportItem(ImportItem.END_FOLDER)
 
     @staticmethod
     def _files_to_hierarchy(files):
@@ -187,34 +178,40 @@ class ZenodoImportProvider(ImportProvider):
             )
         return hierarchy
 
-    def _listRecursive(
-        self, user, pid: str, name: str, base_url: str = None, progress=None
-    ):
-        record = self._get_record(pid)
-
-        def _recurse_hierarchy(hierarchy):
-            files = hierarchy.pop("+files+")
-            for obj in files:
-                yield ImportItem(
-                    ImportItem.FILE,
-                    obj["name"],
-                    size=obj["size"],
-                    mimeType=obj["mimeType"],
-                    url=obj["url"],
+    @staticmethod
+    def _recurseHierarchy(hierarchy, depth=None):
+        files = hierarchy.pop("+files+")
+        for obj in files:
+            yield ImportItem(
+                ImportItem.FILE,
+                obj["name"],
+                size=obj["size"],
+                mimeType=obj["mimeType"],
+                url=obj["url"],
+            )
+        for folder in hierarchy.keys():
+            yield ImportItem(ImportItem.FOLDER, name=folder)
+            if depth is None or depth > 0:
+                yield from ZenodoImportProvider._recurseHierarchy(
+                    hierarchy[folder], None if depth is None else depth - 1
                 )
-            for folder in hierarchy.keys():
-                yield ImportItem(ImportItem.FOLDER, name=folder)
-                yield from _recurse_hierarchy(hierarchy[folder])
-                yield ImportItem(ImportItem.END_FOLDER)
+            yield ImportItem(ImportItem.END_FOLDER)
 
+    def _rootItem(self, pid, record):
         meta = {k: record.get(k, "") for k in ["conceptdoi", "conceptrecid"]}
         meta["subProvider"] = urlparse(pid).netloc
 
-        yield ImportItem(
+        return ImportItem(
             ImportItem.FOLDER,
             name=self._get_title_from_record(record),
             identifier=self._get_doi_from_record(record),
             meta=meta,
         )
-        yield from _recurse_hierarchy(self._files_to_hierarchy(record["files"]))
+
+    def _listRecursive(
+        self, user, pid: str, name: str, base_url: str = None, progress=None
+    ):
+        record = self._get_record(pid)
+        yield self._rootItem(pid, record)
+        yield from self._recurseHierarchy(self._files_to_hierarchy(record["files"]))
         yield ImportItem(ImportItem.END_FOLDER)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+from pymongo import DeleteMany, ReplaceOne
+
+from girder.constants import SortDir
+from girder.models.model_base import Model
+
+
+class FileChecksum(Model):
+    """
+    Cache of checksums and mimetypes of files living in Tale workspaces.
+
+    Entries are keyed by workspace id and a path relative to the workspace root,
+    and are considered valid as long as the size, mtime and inode of the file
+    did not change.
+    """
+
+    # Number of paths per delete, keeps the queries well below the BSON size limit
+    DELETE_BATCH = 1000
+
+    def initialize(self):
+        self.name = 'file_checksum'
+        self.ensureIndices([
+            ((('workspaceId', SortDir.ASCENDING), ('path', SortDir.ASCENDING)),
+             {'unique': True}),
+        ])
+
+    def validate(self, doc):
+        return doc
+
+    @staticmethod
+    def fingerprint(stat):
+        """Return the part of os.stat_result that invalidates a cache entry."""
+        return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'inode': stat.st_ino}
+
+    def getValid(self, workspaceId, stats):
+        """
+        Get valid cache entries for a workspace.
+
+        :param workspaceId: The id of the workspace folder.
+        :param stats: A dict mapping relative paths to os.stat_result.
+        :return: A dict mapping relative paths to cache entries that are still valid.
+        """
+        valid = {}
+        for doc in self.find({'workspaceId': workspaceId}):
+            stat = stats.get(doc['path'])
+            if stat is None:
+                continue
+            fingerprint = self.fingerprint(stat)
+            if all(doc.get(key) == value for key, value in fingerprint.items()):
+                valid[doc['path']] = doc
+        return valid
+
+    def record(self, workspaceId, entries, paths=None):
+        """
+        Store cache entries for a workspace.
+
+        :param workspaceId: The id of the workspace folder.
+        :param entries: A dict mapping relative paths to a tuple of os.stat_result
+            and a dict of cached values (e.g. md5, sha256, mimeType).
+        :param paths: If given, the relative paths of all the files currently in the
+            workspace. Entries of other paths are removed.
+        """
+        ops = []
+        if paths is not None:
+            stale = [
+                doc['path']
+                for doc in self.find({'workspaceId': workspaceId}, fields=['path'])
+                if doc['path'] not in paths
+            ]
+            for i in range(0, len(stale), self.DELETE_BATCH):
+                ops.append(DeleteMany({
+                    'workspaceId': workspaceId,
+                    'path': {'$in': stale[i:i + self.DELETE_BATCH]},
+                }))
+        for path, (stat, values) in entries.items():
+            doc = {'workspaceId': workspaceId, 'path': path}
+            doc.update(self.fingerprint(stat))
+            doc.update(values)
+            ops.append(ReplaceOne(
+                {'workspaceId': workspaceId, 'path': path}, doc, upsert=True
+            ))
+        if ops:
+            self.collection.bulk_write(ops, ordered=False)
+
+    def removeWorkspace(self, workspaceId):
+        self.collection.delete_many({'workspaceId': workspaceId})
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+from girder.models.model_base import Model
+
+
+class RedirectCache(Model):
+    """
+    Shared store of resolved redirect targets (e.g. DOI -> landing page).
+
+    Used as the second level of lib.resolution_cache.ResolutionCache so that
+    all Girder processes benefit from each other's lookups. Mongo removes
+    expired entries by itself.
+    """
+
+    def initialize(self):
+        self.name = 'redirect_cache'
+        self.ensureIndices([
+            ('link', {'unique': True}),
+            ('expires', {'expireAfterSeconds': 0}),
+        ])
+
+    def validate(self, doc):
+        return doc
+
+    def lookup(self, link):
+        """
+        Return (target, negative, ttl) for a link, where ttl is the remaining
+        lifetime in seconds, or None if there's no valid entry.
+        """
+        now = datetime.datetime.utcnow()
+        doc = self.findOne({'link': link, 'expires': {'$gt': now}})
+        if doc is not None:
+            return doc['target'], doc['negative'], (doc['expires'] - now).total_seconds()
+
+    def store(self, link, target, negative, ttl):
+        self.collection.update_one(
+            {'link': link},
+            {'$set': {
+                'target': target,
+                'negative': negative,
+                'expires': datetime.datetime.utcnow() + datetime.timedelta(seconds=ttl),
+            }},
+            upsert=True,
+        )
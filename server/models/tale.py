@@ -25,6 +25,7 @@ from ..constants import TaleStatus
 from ..schema.misc import related_identifiers_schema
 from ..utils import getOrCreateRootFolder, init_progress
 from ..lib.license import WholeTaleLicense
+from ..lib.manifest_cache import MANIFEST_CACHE
 from ..lib.manifest_parser import ManifestParser
 
 from gwvolman.tasks import build_tale_image, BUILD_TALE_IMAGE_STEP_TOTAL
@@ -239,6 +240,7 @@ class Tale(AccessControlledModel):
         :returns: The tale document that was edited.
         """
         tale['updated'] = datetime.datetime.utcnow()
+        MANIFEST_CACHE.invalidate(tale['_id'])
         return self.save(tale)
 
     def setAccessList(self, doc, access, save=False, user=None, force=False,
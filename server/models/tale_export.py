@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+from hashlib import sha256
+import json
+import os
+import tempfile
+
+from pymongo.errors import DuplicateKeyError
+
+from girder.constants import SortDir
+from girder.models.assetstore import Assetstore
+from girder.models.folder import Folder
+from girder.models.model_base import Model
+from girder.models.setting import Setting
+from girder.plugins.jobs.models.job import Job
+from girder.utility import assetstore_utilities
+
+from ..constants import PluginSettings, TaleExportStatus
+from ..lib.workspace_snapshot import WorkspaceSnapshot
+
+
+class TaleExport(Model):
+    """
+    Exported Tales materialized as zip files in the assetstore temp dir.
+
+    Each export is identified by a key derived from the requesting user, the
+    Tale's last update, the export format and a fingerprint of the workspace
+    content, so unchanged Tales can be served from disk instead of being
+    rebuilt. Exports are kept per user, since the manifest and the datasets
+    they contain are resolved with the permissions of the user building them.
+
+    The key is unique, the document inserted with BUILDING status acts as a
+    lock: a single job builds a given export, concurrent requests wait for it.
+    """
+
+    # A BUILDING export not updated for that long is considered abandoned
+    build_timeout = datetime.timedelta(minutes=5)
+    heartbeat = datetime.timedelta(seconds=30)
+
+    def initialize(self):
+        self.name = 'tale_export'
+        self.ensureIndices([
+            ('key', {'unique': True}),
+            ([('taleId', 1), ('userId', 1)], {}),
+            'lastAccessed',
+        ])
+
+    def validate(self, doc):
+        return doc
+
+    @staticmethod
+    def _getTempDir():
+        assetstore = next((_ for _ in Assetstore().list() if _['type'] == 101), None)
+        if assetstore:
+            adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
+            return adapter.tempDir
+        return tempfile.gettempdir()
+
+    @staticmethod
+    def exportKey(tale, user, taleFormat):
+        """Compute a key that changes whenever the content exported for user would."""
+        workspace = Folder().load(tale['workspaceId'], force=True)
+        key = sha256()
+        key.update(json.dumps(
+            [str(tale['_id']), str(user['_id']), str(tale['updated']), taleFormat]
+        ).encode())
+        if workspace and 'fsPath' in workspace:
+            key.update(WorkspaceSnapshot(workspace['fsPath']).fingerprint().encode())
+        return key.hexdigest()
+
+    def _isAbandoned(self, doc):
+        if doc['status'] != TaleExportStatus.BUILDING:
+            return False
+        return datetime.datetime.utcnow() - doc['updated'] > self.build_timeout
+
+    def getOrCreate(self, tale, user, taleFormat):
+        """
+        Return the export of the Tale for user, scheduling a job to build it if
+        necessary.
+
+        The returned document may still be BUILDING, or ERROR if the last
+        attempt failed (the next call retries).
+
+        :param tale: The Tale to export.
+        :param user: The user requesting the export, owner of the export and the job.
+        :param taleFormat: Format of the export, e.g. 'native' or 'bagit'.
+        """
+        key = self.exportKey(tale, user, taleFormat)
+        while True:
+            doc = self.findOne({'key': key})
+            if doc is not None:
+                if doc['status'] == TaleExportStatus.READY and not os.path.isfile(doc['path']):
+                    self.remove(doc)
+                elif self._isAbandoned(doc):
+                    self.remove(doc)
+                elif doc['status'] == TaleExportStatus.ERROR:
+                    # Report the failure once, a later request rebuilds it
+                    self.remove(doc)
+                    return doc
+                else:
+                    return self.touch(doc)
+
+            # Previous versions of the Tale in that format won't be requested again
+            for old in self.find(
+                    {'taleId': tale['_id'], 'userId': user['_id'], 'taleFormat': taleFormat}):
+                if old['key'] != key and old.get('status') != TaleExportStatus.BUILDING:
+                    self.remove(old)
+
+            now = datetime.datetime.utcnow()
+            doc = {
+                'taleId': tale['_id'],
+                'userId': user['_id'],
+                'taleFormat': taleFormat,
+                'key': key,
+                'status': TaleExportStatus.BUILDING,
+                'created': now,
+                'updated': now,
+                'lastAccessed': now,
+            }
+            try:
+                doc = self.save(doc)
+            except DuplicateKeyError:
+                # Somebody else started building it in the meantime
+                continue
+            break
+
+        job = Job().createLocalJob(
+            title='Export Tale "{}"'.format(tale.get('title', tale['_id'])), user=user,
+            type='wholetale.export_tale', public=False, _async=True,
+            module='girder.plugins.wholetale.tasks.export_tale',
+            args=(doc['_id'],),
+            kwargs={'taleId': tale['_id'], 'taleFormat': taleFormat}
+        )
+        doc['jobId'] = job['_id']
+        self.update({'_id': doc['_id']}, {'$set': {'jobId': job['_id']}}, multi=False)
+        Job().scheduleJob(job)
+        return doc
+
+    def build(self, doc, exporter):
+        """
+        Write the zip produced by exporter and mark the export READY.
+
+        Meant to be run by the export_tale job. If the export was removed in
+        the meantime (e.g. with its Tale), the zip is discarded.
+        """
+        digest = sha256()
+        size = 0
+        lastBeat = datetime.datetime.utcnow()
+        with tempfile.NamedTemporaryFile(
+                dir=self._getTempDir(), suffix='.zip', delete=False) as fp:
+            try:
+                for chunk in exporter.stream():
+                    fp.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                    now = datetime.datetime.utcnow()
+                    if now - lastBeat > self.heartbeat:
+                        self.update(
+                            {'_id': doc['_id']}, {'$set': {'updated': now}}, multi=False)
+                        lastBeat = now
+            except Exception:
+                os.unlink(fp.name)
+                raise
+
+        now = datetime.datetime.utcnow()
+        result = self.update({
+            '_id': doc['_id'], 'status': TaleExportStatus.BUILDING
+        }, {'$set': {
+            'status': TaleExportStatus.READY,
+            'path': fp.name,
+            'size': size,
+            'sha256': digest.hexdigest(),
+            'updated': now,
+            'lastAccessed': now,
+        }}, multi=False)
+        if not result.matched_count:
+            os.unlink(fp.name)
+        self.evict(keep=doc['_id'])
+
+    def fail(self, doc, message):
+        self.update({'_id': doc['_id'], 'status': TaleExportStatus.BUILDING}, {'$set': {
+            'status': TaleExportStatus.ERROR,
+            'error': message,
+            'updated': datetime.datetime.utcnow(),
+        }}, multi=False)
+
+    def touch(self, doc):
+        doc['lastAccessed'] = datetime.datetime.utcnow()
+        self.update(
+            {'_id': doc['_id']}, {'$set': {'lastAccessed': doc['lastAccessed']}}, multi=False)
+        return doc
+
+    def evict(self, keep=None):
+        """
+        Remove exports not accessed within the export_cache_ttl setting, then
+        the least recently accessed ones until the total size of exports is
+        within the export_cache_size setting.
+
+        :param keep: Id of an export that is never removed, e.g. the one just built.
+        """
+        ttl = Setting().get(PluginSettings.EXPORT_CACHE_TTL)
+        maxSize = Setting().get(PluginSettings.EXPORT_CACHE_SIZE)
+        expired = datetime.datetime.utcnow() - datetime.timedelta(seconds=ttl)
+        total = 0
+        for doc in self.find(
+                {'status': TaleExportStatus.READY},
+                sort=[('lastAccessed', SortDir.DESCENDING)],
+                fields=['path', 'size', 'lastAccessed']):
+            total += doc['size']
+            if doc['_id'] != keep and (doc['lastAccessed'] < expired or total > maxSize):
+                self.remove(doc)
+
+    def removeTale(self, taleId):
+        for doc in self.find({'taleId': taleId}):
+            self.remove(doc)
+
+    def remove(self, doc, **kwargs):
+        # Exports being served are read through an already open file, which
+        # remains readable until closed, so it can be unlinked right away.
+        if doc.get('path'):
+            try:
+                os.unlink(doc['path'])
+            except OSError:
+                pass
+        return super().remove(doc, **kwargs)
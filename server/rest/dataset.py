@@ -4,7 +4,7 @@ from bson import ObjectId
 from girder.api import access
 from girder.api.docs import addModel
 from girder.api.describe import Description, autoDescribeRoute
-from girder.api.rest import Resource
+from girder.api.rest import Resource, RestException
 from girder.constants import AccessType, SortDir, TokenScope
 from girder.exceptions import ValidationException
 from girder.models.item import Item
@@ -13,9 +13,13 @@ from girder.plugins.jobs.models.job import Job
 
 from ..constants import CATALOG_NAME
 from ..lib.dataone import DataONELocations
+from ..lib.folder_size import get_folder_sizes
 from ..schema.misc import dataMapListSchema
 from ..utils import getOrCreateRootFolder, init_progress
 
+# Upper bound of the number of datasets an import registers concurrently
+MAX_WORKERS = 8
+
 
 datasetModel = {
     "description": "Object representing registered data.",
@@ -61,6 +65,10 @@ datasetModel = {
             "type": "integer",
             "description": "Total size of the dataset in bytes."
         },
+        "fileCount": {
+            "type": "integer",
+            "description": "Total number of files in the dataset (folders only)."
+        },
         "identifier": {
             "type": ["string", "null"],
             "description": "External, unique identifier"
@@ -80,13 +88,23 @@ datasetModelKeys = set(datasetModel['properties'].keys())
 addModel('dataset', datasetModel, resources='dataset')
 
 
-def _itemOrFolderToDataset(obj):
+def _itemOrFolderToDataset(obj, folderSize=None):
     ds = {key: obj[key] for key in obj.keys() & datasetModelKeys}
     ds['provider'] = obj['meta'].get('provider', 'unknown')
     ds['identifier'] = obj['meta'].get('identifier', 'unknown')
+    if folderSize is not None:
+        ds['size'], ds['fileCount'] = folderSize
     return ds
 
 
+def _foldersToDatasets(folders, user):
+    sizes = get_folder_sizes(folders, user=user)
+    return [
+        _itemOrFolderToDataset(folder, folderSize=sizes[folder['_id']])
+        for folder in folders
+    ]
+
+
 class Dataset(Resource):
 
     def __init__(self):
@@ -125,18 +143,22 @@ class Dataset(Resource):
                 {'meta.identifier': {'$in': identifiers}}
             )
 
-            for modelType in ('folder', 'item'):
-                for obj in self.model(modelType).find(filters):
-                    obj['_modelType'] = modelType
-                    datasets.append(_itemOrFolderToDataset(obj))
+            folders = list(folderModel.find(filters))
+            for folder in folders:
+                folder['_modelType'] = 'folder'
+            datasets += _foldersToDatasets(folders, user)
+            for obj in self.model('item').find(filters):
+                obj['_modelType'] = 'item'
+                datasets.append(_itemOrFolderToDataset(obj))
             return datasets
 
         parent = getOrCreateRootFolder(CATALOG_NAME)
-        for folder in folderModel.childFolders(
-                parentType='folder', parent=parent, user=user,
-                limit=limit, offset=offset, sort=sort, filters=filters):
+        folders = list(folderModel.childFolders(
+            parentType='folder', parent=parent, user=user,
+            limit=limit, offset=offset, sort=sort, filters=filters))
+        for folder in folders:
             folder['_modelType'] = 'folder'
-            datasets.append(_itemOrFolderToDataset(folder))
+        datasets += _foldersToDatasets(folders, user)
 
         if myData:
             cursor = Item().find(filters)
@@ -168,6 +190,8 @@ class Dataset(Resource):
             doc['_modelType'] = 'item'
         if 'meta' not in doc or 'provider' not in doc['meta']:
             raise ValidationException('No such item: %s' % str(doc['_id']), 'id')
+        if doc['_modelType'] == 'folder':
+            return _foldersToDatasets([doc], user)[0]
         return _itemOrFolderToDataset(doc)
 
     @access.user
@@ -206,6 +230,16 @@ class Dataset(Resource):
                            'include https://dev.nceas.ucsb.edu/knb/d1/mn/v2 and '
                            'https://cn.dataone.org/cn/v2',
                required=False, dataType='string', default=DataONELocations.prod_cn)
+        .param('sync', 'If true, datasets that were registered before are compared with '
+                       'their current listing and only the differences are written. '
+                       'A summary of the changes is added to the job log.',
+               required=False, dataType='boolean', default=False)
+        .param('prune', 'When syncing, also remove files and folders that are no '
+                        'longer part of the dataset.',
+               required=False, dataType='boolean', default=False)
+        .param('workers', 'Number of datasets registered concurrently, between 1 and '
+                          '{}. By default they are registered one at a time.'.format(MAX_WORKERS),
+               required=False, dataType='integer', default=1)
         .errorResponse('Write access denied for parent collection.', 403)
     )
     def importData(self,
@@ -214,7 +248,13 @@ class Dataset(Resource):
                    public,
                    dataMap,
                    base_url,
+                   sync,
+                   prune,
+                   workers,
                    params):
+        if not 1 <= workers <= MAX_WORKERS:
+            raise RestException(
+                'Workers has to be between 1 and {}.'.format(MAX_WORKERS))
         user = self.getCurrentUser()
         if not parentId or parentType not in ('folder', 'item'):
             parent = getOrCreateRootFolder(CATALOG_NAME)
@@ -236,7 +276,7 @@ class Dataset(Resource):
             type='wholetale.register_data', public=False, _async=False,
             module='girder.plugins.wholetale.tasks.register_dataset',
             args=(dataMap, parent, parentType, user),
-            kwargs={'base_url': base_url},
+            kwargs={'base_url': base_url, 'sync': sync, 'prune': prune, 'workers': workers},
             otherFields={'wt_notification_id': str(notification['_id'])},
         )
         Job().scheduleJob(job)
@@ -1,18 +1,20 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import json
 from operator import itemgetter
 
 from girder.api import access
 from girder.api.describe import Description, autoDescribeRoute
 from girder.api.docs import addModel
-from girder.api.rest import Resource, RestException
+from girder.api.rest import Resource, RestException, setResponseHeader
 from girder.models.setting import Setting
 
 from ..constants import PluginSettings
 from ..lib.dataone import DataONELocations
 from ..lib.data_map import dataMapDoc
 from ..lib.file_map import fileMapDoc
-from ..lib import pids_to_entities
+from ..lib.file_stream import parse_cursor
+from ..lib import pids_to_entities, stream_files
 
 
 addModel('dataMap', dataMapDoc)
@@ -85,16 +87,89 @@ class Repository(Resource):
             dataType='string',
             default=DataONELocations.prod_cn,
         )
+        .param(
+            'stream',
+            'If True, files are returned as they are listed, one JSON entry per line '
+            '(NDJSON), instead of a single fileMap per dataset. Use it for large datasets.',
+            required=False,
+            dataType='boolean',
+            default=False,
+        )
+        .param(
+            'path',
+            'Slash separated names of the folders leading to the listed one. By default '
+            'the root of each dataset is listed.',
+            required=False,
+            dataType='string',
+        )
+        .param(
+            'depth',
+            'Don\'t list contents of folders nested deeper than depth levels below the '
+            'listed one. With 0, only a single level is listed, which is much faster for '
+            'large datasets.',
+            required=False,
+            dataType='integer',
+        )
+        .param(
+            'limit',
+            'Only with stream. Maximum number of entries returned. If there are more, '
+            'the last line holds the cursor to pass to get the next ones. Each page '
+            'lists the dataset again up to the cursor, so small limits make paging '
+            'through large datasets slow.',
+            required=False,
+            dataType='integer',
+        )
+        .param(
+            'cursor',
+            'Only with stream. Cursor returned by a previous call with the same '
+            'parameters.',
+            required=False,
+            dataType='string',
+        )
         .responseClass('fileMap', array=True)
     )
-    def listFiles(self, dataId, base_url):
+    def listFiles(self, dataId, base_url, stream, path, depth, limit, cursor):
+        path = path.strip('/').split('/') if path else None
+        if stream:
+            return self._streamFiles(dataId, base_url, path, depth, limit, cursor)
         try:
             results = pids_to_entities(
-                dataId, user=self.getCurrentUser(), base_url=base_url, lookup=False
+                dataId, user=self.getCurrentUser(), base_url=base_url, lookup=False,
+                path=path, depth=depth
             )
         except RuntimeError as exc:
             raise RestException(exc.args[0])
-        return sorted(results, key=lambda k: list(k))
+        results.sort(key=lambda fileMap: fileMap.getName())
+        setResponseHeader('Content-Type', 'application/json')
+
+        # Listings are serialized straight from their FileMaps, without
+        # building their dict representation
+        def stream():
+            yield '['
+            for i, fileMap in enumerate(results):
+                if i:
+                    yield ', '
+                yield from fileMap.iterJSON()
+            yield ']'
+        return stream
+
+    def _streamFiles(self, dataId, base_url, path, depth, limit, cursor):
+        try:
+            parse_cursor(cursor)
+        except ValueError as exc:
+            raise RestException(exc.args[0])
+        if limit is not None and limit < 1:
+            raise RestException('Limit has to be a positive integer.')
+        entries = stream_files(
+            dataId, user=self.getCurrentUser(), base_url=base_url, path=path,
+            depth=depth, cursor=cursor, limit=limit
+        )
+        setResponseHeader('Content-Type', 'application/x-ndjson')
+
+        def stream():
+            for entry in entries:
+                yield json.dumps(entry) + '\n'
+        return stream
 
     @access.public
     @autoDescribeRoute(
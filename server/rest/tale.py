@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import cherrypy
+from cherrypy.lib import httputil
 import json
 import pathlib
 import shutil
@@ -32,15 +33,17 @@ from girder.plugins.jobs.constants import JobStatus
 from ..schema.tale import taleModel as taleSchema
 from ..models.tale import Tale as taleModel
 from ..models.image import Image as imageModel
+from ..models.file_checksum import FileChecksum
+from ..models.tale_export import TaleExport
 from ..lib import pids_to_entities, IMPORT_PROVIDERS
 from ..lib.dataone import DataONELocations  # TODO: get rid of it
-from ..lib.manifest import Manifest
+from ..lib.manifest_cache import MANIFEST_CACHE
 from ..lib.exporters.bag import BagTaleExporter
 from ..lib.exporters.native import NativeTaleExporter
 
 from girder.plugins.worker import getCeleryApp
 
-from ..constants import ImageStatus, TaleStatus, PluginSettings, \
+from ..constants import ImageStatus, TaleStatus, TaleExportStatus, PluginSettings, \
     DEFAULT_IMAGE_ICON, DEFAULT_ILLUSTRATION
 
 
@@ -200,6 +203,9 @@ class Tale(Resource):
                 ctx.update(total=Folder().subtreeCount(workspace))
             shutil.rmtree(workspace["fsPath"], ignore_errors=True)
             Folder().remove(workspace, progress=ctx)
+        FileChecksum().removeWorkspace(workspace['_id'])
+        TaleExport().removeTale(tale['_id'])
+        MANIFEST_CACHE.invalidate(tale['_id'])
         self._model.remove(tale)
 
     @access.user
@@ -409,24 +415,105 @@ class Tale(Resource):
         .modelParam('id', model='tale', plugin='wholetale', level=AccessType.READ)
         .param('taleFormat', 'Format of the exported Tale', required=False,
                enum=['bagit', 'native'], strip=True, default='native')
+        .param('resumable', 'If True, the zipfile is built on the server by a job and '
+               'served with support for HTTP Range requests and ETags. Until it is ready, '
+               'the response is 202 Accepted and the request should be retried. Exports '
+               'of an unchanged Tale are shared by all the users who can read it.',
+               required=False, dataType='boolean', default=False)
         .responseClass('tale')
         .produces('application/zip')
         .errorResponse('ID was invalid.', 404)
         .errorResponse('You are not authorized to export this tale.', 403)
+        .errorResponse('Requested range not satisfiable.', 416)
+        .errorResponse('Building the export failed.', 500)
     )
-    def exportTale(self, tale, taleFormat):
+    def exportTale(self, tale, taleFormat, resumable):
         user = self.getCurrentUser()
         zip_name = str(tale['_id'])
 
+        if resumable:
+            export = TaleExport().getOrCreate(tale, user, taleFormat)
+            if export['status'] == TaleExportStatus.READY:
+                try:
+                    # Opened right away, so that the export can be removed while served
+                    fp = open(export['path'], 'rb')
+                except FileNotFoundError:
+                    # Evicted in the meantime
+                    export = TaleExport().getOrCreate(tale, user, taleFormat)
+                else:
+                    setContentDisposition(zip_name + '.zip')
+                    return self._serveExport(export, fp)
+            if export['status'] == TaleExportStatus.ERROR:
+                raise RestException(
+                    'Building the export failed: {}'.format(export.get('error')), code=500)
+            cherrypy.response.status = 202
+            setResponseHeader('Retry-After', 5)
+            return {
+                'taleId': export['taleId'],
+                'taleFormat': export['taleFormat'],
+                'status': export['status'],
+                'created': export['created'],
+            }
+
         if taleFormat == 'bagit':
             exporter = BagTaleExporter(tale, user, expand_folders=True)
         elif taleFormat == 'native':
             exporter = NativeTaleExporter(tale, user)
-
         setResponseHeader('Content-Type', 'application/zip')
         setContentDisposition(zip_name + '.zip')
         return exporter.stream
 
+    @staticmethod
+    def _serveExport(export, fp, chunk_size=65536):
+        """
+        Serve a materialized export honoring Range, If-Range and If-None-Match.
+
+        Only single ranges are supported, the whole file is sent in response
+        to a request for multiple ranges.
+
+        :param fp: The export file opened for reading, closed once served.
+        """
+        size = export['size']
+        etag = '"{}"'.format(export['sha256'])
+        headers = cherrypy.request.headers
+        setResponseHeader('ETag', etag)
+        setResponseHeader('Accept-Ranges', 'bytes')
+
+        if headers.get('If-None-Match') == etag:
+            fp.close()
+            cherrypy.response.status = 304
+            return
+
+        setResponseHeader('Content-Type', 'application/zip')
+        offset, end = 0, size
+        range_header = headers.get('Range')
+        if_range = headers.get('If-Range')
+        if range_header and (if_range is None or if_range == etag):
+            ranges = httputil.get_ranges(range_header, size)
+            if ranges == []:
+                fp.close()
+                setResponseHeader('Content-Range', 'bytes */{}'.format(size))
+                raise RestException('Requested range not satisfiable.', code=416)
+            elif ranges and len(ranges) == 1:
+                offset, end = ranges[0]
+                cherrypy.response.status = 206
+                setResponseHeader(
+                    'Content-Range', 'bytes {}-{}/{}'.format(offset, end - 1, size)
+                )
+        setResponseHeader('Content-Length', end - offset)
+
+        def stream():
+            with fp:
+                fp.seek(offset)
+                remaining = end - offset
+                while remaining > 0:
+                    data = fp.read(min(chunk_size, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                    yield data
+        return stream
+
     @access.public
     @autoDescribeRoute(
         Description('Generate the Tale manifest')
@@ -445,8 +532,7 @@ class Tale(Resource):
         """
 
         user = self.getCurrentUser()
-        manifest_doc = Manifest(tale, user, expand_folders=expandFolders)
-        return manifest_doc.manifest
+        return MANIFEST_CACHE.get(tale, user, expand_folders=expandFolders)
 
     @access.user
     @autoDescribeRoute(
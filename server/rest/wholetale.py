@@ -6,6 +6,8 @@ from girder.api.describe import Description, autoDescribeRoute
 from girder.api.rest import Resource
 
 from ..constants import API_VERSION
+from ..lib.manifest_cache import MANIFEST_CACHE
+from ..lib.resolvers import RESOLUTION_CACHE
 from ..models.tale import Tale
 
 
@@ -16,6 +18,7 @@ class wholeTale(Resource):
 
         self.route('GET', (), self.get_wholetale_info)
         self.route('PUT', ('citations',), self.regenerate_citations)
+        self.route('GET', ('cache',), self.get_cache_stats)
 
     @access.public
     @autoDescribeRoute(Description('Return basic info about Whole Tale plugin'))
@@ -35,3 +38,12 @@ class wholeTale(Resource):
             event = events.trigger('tale.update_citation', eventParams)
             if len(event.responses):
                 Tale().save(event.responses[-1])
+                MANIFEST_CACHE.invalidate(tale['_id'])
+
+    @access.admin
+    @autoDescribeRoute(Description('Return hit and miss counters of internal caches'))
+    def get_cache_stats(self):
+        return {
+            'manifest': MANIFEST_CACHE.stats(),
+            'resolver': RESOLUTION_CACHE.stats(),
+        }
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import traceback
+from girder.plugins.jobs.constants import JobStatus
+from girder.models.user import User
+from girder.plugins.jobs.models.job import Job
+
+from ..lib.exporters.bag import BagTaleExporter
+from ..lib.exporters.native import NativeTaleExporter
+from ..models.tale import Tale
+from ..models.tale_export import TaleExport
+
+
+def run(job):
+    jobModel = Job()
+    jobModel.updateJob(job, status=JobStatus.RUNNING)
+
+    exportId, = job["args"]
+    user = User().load(job["userId"], force=True)
+    taleFormat = job["kwargs"]["taleFormat"]
+    export = TaleExport().load(exportId, force=True)
+    if export is None:
+        jobModel.updateJob(job, status=JobStatus.SUCCESS, log="Export was removed")
+        return
+
+    try:
+        tale = Tale().load(job["kwargs"]["taleId"], force=True)
+        if taleFormat == "bagit":
+            exporter = BagTaleExporter(tale, user, expand_folders=True)
+        else:
+            exporter = NativeTaleExporter(tale, user)
+        TaleExport().build(export, exporter)
+        jobModel.updateJob(job, status=JobStatus.SUCCESS, log="Export finished")
+    except Exception:
+        t, val, tb = sys.exc_info()
+        log = "%s: %s\n%s" % (t.__name__, repr(val), traceback.extract_tb(tb))
+        TaleExport().fail(export, "%s: %s" % (t.__name__, val))
+        jobModel.updateJob(job, status=JobStatus.ERROR, log=log)
+        raise
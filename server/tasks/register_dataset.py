@@ -1,16 +1,23 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import json
+
 from girder.models.user import User
 from girder.plugins.jobs.constants import JobStatus
 from girder.plugins.jobs.models.job import Job
 
-from ..lib import register_dataMap
+from ..lib import RegistrationError, register_dataMap, sync_dataMap
 
 
 def run(job):
     dataMap, parent, parentType, user = job["args"]
     base_url = job["kwargs"].get("base_url")
+    # With sync, only differences with previously registered data are written
+    sync = job["kwargs"].get("sync", False)
+    prune = job["kwargs"].get("prune", False)
+    # Number of datasets registered concurrently, one at a time unless requested
+    workers = job["kwargs"].get("workers", 1)
     # In case this job is a part of a more complex task, progressTotal and progressCurrent can be
     # passed as kwargs to take that into account
     progressTotal = job["kwargs"].get("progressTotal", 2)
@@ -18,6 +25,17 @@ def run(job):
 
     progressCurrent += 1
     jobModel = Job()
+    # If the job was interrupted, continue from the last checkpoint instead of
+    # starting over
+    resume = jobModel.findOne({"_id": job["_id"]}, fields=["wt_checkpoint"]).get(
+        "wt_checkpoint"
+    )
+
+    def checkpoint(state):
+        jobModel.update(
+            {"_id": job["_id"]}, {"$set": {"wt_checkpoint": state}}, multi=False
+        )
+
     jobModel.updateJob(
         job,
         status=JobStatus.RUNNING,
@@ -30,14 +48,49 @@ def run(job):
     # being emitted, since all we care about is the wt_notification encompassing this job. We lose a
     # lot of granularity here.
     # TODO: pass progress context associated with wt_notification perhaps?
-    importedData = register_dataMap(
-        dataMap, parent, parentType, user=user, base_url=base_url, progress=False
-    )
+    register = sync_dataMap if sync else register_dataMap
+    kwargs = {"prune": prune} if sync else {}
+    errors = []
+    try:
+        results = register(
+            dataMap, parent, parentType, user=user, base_url=base_url, progress=False,
+            checkpoint=checkpoint, resume=resume, workers=workers, **kwargs
+        )
+    except RegistrationError as exc:
+        # Keep what was registered, the checkpoint makes a rerun retry only the
+        # failed datasets
+        errors = exc.errors
+        results = [result for result in exc.results if result is not None]
+
+    if sync:
+        importedData = [result["_id"] for result in results]
+        jobModel.updateJob(
+            job,
+            log="\n".join(
+                "{}: {}".format(result["dataId"], json.dumps(result["changes"]))
+                for result in results
+            ),
+        )
+    else:
+        importedData = results
+    if not errors:
+        jobModel.update({"_id": job["_id"]}, {"$unset": {"wt_checkpoint": ""}}, multi=False)
     if importedData:
         user_data = set(user.get("myData", []))
         user["myData"] = list(user_data.union(set(importedData)))
         user = User().save(user)
 
+    if errors:
+        jobModel.updateJob(
+            job,
+            progressTotal=progressTotal,
+            progressCurrent=progressTotal,
+            progressMessage="Task failed",
+            status=JobStatus.ERROR,
+            log="\n".join(message for _, message in errors),
+        )
+        return
+
     # For some reason updating both status and progress keywords swallows a notification. Let's do
     # it in two steps then.
     progressCurrent += 1